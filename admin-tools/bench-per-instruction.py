@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""Measure the average time the VM spends per bytecode instruction.
+
+The programs run here do little more than shuffle small ints around, so
+almost all of the time measured is interpreter overhead: fetching,
+decoding and dispatching instructions. Run this before and after a change
+to the main loop to see its effect, e.g.:
+
+    python admin-tools/bench-per-instruction.py
+"""
+
+import time
+
+import click
+
+from xpython.vm import ENGINES, PyVM
+
+PROGRAMS = {
+    "arith": """
+def arith(n):
+    total = 0
+    i = 0
+    while i < n:
+        total = total + i * 2 - (i & 3)
+        total += -i
+        i += 1
+    return total
+arith(20000)
+""",
+    "attrs": """
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+def attrs(n):
+    p = Point(1, 2)
+    total = 0
+    for i in range(n):
+        p.x = p.y + i
+        p.y = p.x - i
+        total += p.x + p.y
+    return total
+attrs(5000)
+""",
+    "calls": """
+def add(a, b):
+    return a + b
+def calls(n):
+    total = 0
+    for i in range(n):
+        total = add(total, i)
+    return total
+calls(5000)
+""",
+    "fib": """
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+fib(15)
+""",
+    "globals": """
+SCALE = 3
+TABLE = (1, 2, 3)
+def lookups(n):
+    total = 0
+    for i in range(n):
+        total += abs(i - SCALE) + len(TABLE) + SCALE
+    return total
+lookups(5000)
+i = 0
+while i < 2000:
+    i = i + len(TABLE) - SCALE + 1
+""",
+    "kwcalls": """
+def scale(x, factor=1, *, offset=0):
+    return x * factor + offset
+def kwcalls(n):
+    total = 0
+    for i in range(n):
+        total += scale(i, factor=2, offset=1) + scale(i)
+    return total
+kwcalls(3000)
+""",
+    "methods": """
+class Counter(object):
+    def __init__(self):
+        self.total = 0
+    def add(self, x, y=1):
+        self.total += x * y
+def methods(n):
+    c = Counter()
+    for i in range(n):
+        c.add(i)
+        c.add(i, y=2)
+    return c.total
+methods(3000)
+""",
+    "natives": """
+def natives(n):
+    xs = []
+    for i in range(n):
+        xs.append(abs(i - len(xs)))
+    return max(xs)
+natives(5000)
+""",
+    "tries": """
+def tries(n):
+    total = 0
+    for i in range(n):
+        try:
+            total += i
+        finally:
+            total -= 1
+        try:
+            total += {0: 1}[i & 7]
+        except KeyError:
+            pass
+    return total
+tries(3000)
+""",
+    "subscr": """
+def subscr(n):
+    xs = [1, 2, 3, 4]
+    total = 0
+    for i in range(n):
+        total += xs[i & 3]
+        xs[i & 3] = i
+    return total
+subscr(10000)
+""",
+}
+
+
+class CountingVM(PyVM):
+    """A VM that counts the instructions it dispatches. This is done in
+    the classic engine, which dispatches every instruction."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.instruction_count = 0
+
+    def dispatch(self, *args, **kwargs):
+        self.instruction_count += 1
+        return super().dispatch(*args, **kwargs)
+
+
+def count_instructions(code):
+    vm = CountingVM()
+    vm.run_code(code)
+    return vm.instruction_count
+
+
+def best_time(code, repeat, engine):
+    best = None
+    for _ in range(repeat):
+        vm = PyVM(engine=engine)
+        start = time.perf_counter()
+        vm.run_code(code)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+@click.command()
+@click.option("-r", "--repeat", default=5, help="number of timing runs to take the best of")
+@click.option("-e", "--engine", type=click.Choice(ENGINES), default="classic")
+@click.argument("names", nargs=-1)
+def main(repeat, engine, names):
+    """Print nanoseconds per instruction for each of the benchmark programs
+    NAMES, or all of them."""
+    for name in names or sorted(PROGRAMS):
+        code = compile(PROGRAMS[name], "<%s>" % name, "exec")
+        count = count_instructions(code)
+        seconds = best_time(code, repeat, engine)
+        print(
+            "%-8s %9d instructions %8.3fs %8.0f ns/instruction"
+            % (name, count, seconds, seconds * 1e9 / count)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Count how often opcodes follow each other in the bytecode test corpus.
+
+This is what we use to pick the superinstructions that
+xpython.vmclosure fuses. Only sequences that could be fused are
+counted: no instruction other than the first may be a jump target.
+The counts are static, that is, of sequences in the code, not of
+sequences run.
+
+    python admin-tools/mine-opcode-pairs.py          # all of test/bytecode-*
+    python admin-tools/mine-opcode-pairs.py -n 3 test/bytecode-3.8
+"""
+
+import glob
+import os.path as osp
+from collections import Counter, defaultdict
+
+import click
+from xdis import iscode, load_module
+from xdis.op_imports import get_opcode_module
+
+from xpython.instruction import DecodedCode
+
+
+def code_objects(code):
+    """Yield `code` and all the code objects nested in it."""
+    yield code
+    for const in code.co_consts:
+        if iscode(const):
+            for nested in code_objects(const):
+                yield nested
+
+
+def sequences(decoded, length):
+    """Yield the tuples of `length` opcode names that could be fused in
+    `decoded`, a DecodedCode."""
+    jump_targets = decoded.jump_targets
+    insts = []
+    last = None
+    for inst in decoded.instructions:
+        if inst is not None and inst is not last:
+            insts.append(inst)
+            last = inst
+    for i in range(len(insts) - length + 1):
+        window = insts[i : i + length]
+        if any(inst.offset in jump_targets for inst in window[1:]):
+            continue
+        yield tuple(inst.opname for inst in window)
+
+
+def count_directory(directory, length):
+    counts = Counter()
+    for path in sorted(glob.glob(osp.join(directory, "*.pyc"))):
+        try:
+            version, _, _, code, is_pypy, _, _ = load_module(path)
+        except Exception:
+            continue
+        opc = get_opcode_module(version, "pypy" if is_pypy else None)
+        for nested in code_objects(code):
+            try:
+                decoded = DecodedCode(nested, opc, version)
+            except Exception:
+                # Some bytecode we can't interpret yet, e.g. 3.11's LOAD_GLOBAL.
+                continue
+            counts.update(sequences(decoded, length))
+    return counts
+
+
+@click.command()
+@click.option("-n", "--length", default=2, help="length of opcode sequences")
+@click.option("-t", "--top", default=15, help="how many sequences to show")
+@click.argument("directories", nargs=-1)
+def main(length, top, directories):
+    """Show the most frequent opcode sequences in each of DIRECTORIES, by
+    default the test/bytecode-* directories, and over all of them."""
+    if not directories:
+        testdir = osp.join(osp.dirname(__file__), "..", "test")
+        directories = sorted(glob.glob(osp.join(testdir, "bytecode-*")))
+    total = Counter()
+    by_directory = defaultdict(Counter)
+    for directory in directories:
+        by_directory[directory] = count_directory(directory, length)
+        total.update(by_directory[directory])
+    for directory, counts in by_directory.items():
+        all_count = sum(counts.values()) or 1
+        print("%s:" % osp.basename(directory))
+        for sequence, count in counts.most_common(top):
+            print("  %6d %5.1f%% %s" % (count, 100.0 * count / all_count, " ".join(sequence)))
+    all_count = sum(total.values()) or 1
+    print("all:")
+    for sequence, count in total.most_common(top):
+        print("  %6d %5.1f%% %s" % (count, 100.0 * count / all_count, " ".join(sequence)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""This program is self-checking!"""
+
+# Handlers entered by way of the exception table, in 3.11 and later,
+# with nothing that makes a call.
+
+x = 0
+try:
+    {}["k"]
+except KeyError:
+    x = 1
+assert x == 1
+
+try:
+    try:
+        1 / 0
+    except KeyError:
+        x = 2
+    finally:
+        x += 10
+except ZeroDivisionError as e:
+    x += 100
+    assert e
+assert x == 111
+
+try:
+    try:
+        [][0]
+    except IndexError:
+        try:
+            {}[0]
+        except KeyError:
+            x = 3
+        raise
+except IndexError:
+    x += 1
+except KeyError:
+    x = 0
+assert x == 4
@@ -0,0 +1,107 @@
+# Tests BREAK_LOOP and CONTINUE_LOOP out of the "try" blocks and
+# handlers they can be in, and the values of the data stack they leave.
+"""This program is self-checking!"""
+
+
+def count(xs):
+    total = 0
+    for x in xs:
+        for y in (1, 2):
+            if x == 0:
+                break
+            try:
+                if x == 1:
+                    break
+                try:
+                    if x == 2:
+                        continue
+                    if x == 3:
+                        break
+                    {}[x]
+                except KeyError:
+                    if x == 4:
+                        break
+                    if x == 5:
+                        continue
+                total += y
+            except IndexError:
+                pass
+            total += 10 * y
+    return total
+
+
+assert count(range(8)) == 66
+
+
+def finally_count(xs):
+    total = 0
+    for x in xs:
+        try:
+            try:
+                if x == 1:
+                    continue
+                if x == 3:
+                    break
+            except KeyError:
+                pass
+        finally:
+            total += 1
+        total += 10
+    return total
+
+
+assert finally_count(range(5)) == 2 * 10 + 4
+
+
+def handled():
+    result = []
+    for x in range(3):
+        try:
+            raise KeyError(x)
+        except KeyError:
+            result.append(x)
+            if x == 1:
+                break
+    return result
+
+
+assert handled() == [0, 1]
+
+
+def return_in_handler():
+    try:
+        raise KeyError(1)
+    except KeyError as e:
+        return e.args
+
+
+assert return_in_handler() == (1,)
+
+
+def return_in_loop_handler(xs):
+    for x in xs:
+        try:
+            {}[x]
+        except KeyError as e:
+            if x == 1:
+                continue
+            if x == 3:
+                return e.args
+    return None
+
+
+assert return_in_loop_handler(range(5)) == (3,)
+
+out = []
+i = 0
+while i < 10:
+    i += 1
+    try:
+        if i % 2:
+            continue
+        if i > 6:
+            break
+    except ValueError:
+        pass
+    out.append(i)
+assert out == [2, 4, 6]
@@ -136,6 +136,23 @@ class TestBasic(vmtest.VmTestCase):
                 raises=NameError,
             )
 
+        def test_name_lookup_order(self):
+            self.assert_ok(
+                """\
+                len = lambda x: "global len"
+                x = "global x"
+                class C:
+                    x = "class x"
+                    a = x
+                    b = len(x)
+                    del x
+                    c = x
+                print(C.a, C.b, C.c)
+                del len
+                print(len(x))
+                """
+            )
+
         def test_deleting_local_names(self):
             self.assert_ok(
                 """\
@@ -301,6 +318,31 @@ class TestBasic(vmtest.VmTestCase):
                 """
             )
 
+        def test_methods_follow_class_changes(self):
+            self.assert_ok(
+                """\
+                class A:
+                    def f(self):
+                        return "A.f"
+                class B(A):
+                    pass
+                def call(obj):
+                    return obj.f()
+                b = B()
+                print([call(b) for i in range(3)])
+                B.f = lambda self: "B.f"
+                print(call(b))
+                A.f = lambda self: "new A.f"
+                del B.f
+                print(call(b))
+                b.f = lambda: "b.f"
+                print(call(b))
+                del b.f
+                B.f = staticmethod(lambda: "static")
+                print(call(b))
+                """
+            )
+
         def test_unpacking(self):
             self.assert_ok(
                 """\
@@ -0,0 +1,41 @@
+"""Test the builtins given to code of other Python versions."""
+
+import unittest
+
+from xdis.version_info import PYTHON_VERSION_TRIPLE
+
+from xpython.stdlib.builtins import compatible_builtins
+
+if PYTHON_VERSION_TRIPLE >= (3, 0):
+    import builtins as host_builtins
+
+
+@unittest.skipIf(PYTHON_VERSION_TRIPLE < (3, 0), "needs Python 3 builtins")
+class TestCompatibleBuiltins(unittest.TestCase):
+    def test_host_builtins_are_not_changed(self):
+        names = set(host_builtins.__dict__)
+        py27 = compatible_builtins((2, 7))
+        self.assertIs(py27.xrange, range)
+        self.assertIs(py27.len, len)
+        self.assertEqual(set(host_builtins.__dict__), names)
+        self.assertNotIn("xrange", host_builtins.__dict__)
+
+    def test_new_module_per_run(self):
+        for version in ((2, 7), PYTHON_VERSION_TRIPLE):
+            first = compatible_builtins(version)
+            self.assertIsNot(first, host_builtins)
+            first.foo = 1
+            del first.open
+            second = compatible_builtins(version)
+            self.assertIsNot(second, first)
+            self.assertNotIn("foo", second.__dict__)
+            self.assertIs(second.open, open)
+        self.assertIs(host_builtins.open, open)
+        self.assertEqual(
+            set(compatible_builtins((2, 7, 18)).__dict__),
+            set(compatible_builtins((2, 7)).__dict__),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
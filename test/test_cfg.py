@@ -0,0 +1,135 @@
+"""Tests of the control-flow graphs in xpython.cfg."""
+
+import os.path as osp
+import textwrap
+import unittest
+
+from xdis import load_module
+from xdis.bytecode import parse_exception_table
+from xdis.op_imports import get_opcode_module
+
+from xpython.cfg import control_flow_graph
+from xpython.instruction import DecodedCode
+from xpython.vm import PyVM
+
+
+def function_cfg(source):
+    """Return the control-flow graph of the function defined in `source`."""
+    vm = PyVM()
+    module = compile(textwrap.dedent(source), "<cfg>", "exec")
+    code = [const for const in module.co_consts if hasattr(const, "co_code")][0]
+    return control_flow_graph(DecodedCode(code, vm.opc, vm.version))
+
+
+class TestControlFlowGraph(unittest.TestCase):
+    def test_if_else(self):
+        cfg = function_cfg(
+            """\
+            def f(x):
+                if x:
+                    y = 1
+                else:
+                    y = 2
+                return y
+            """
+        )
+        first = cfg.blocks[0]
+        self.assertEqual(len(first.successors), 2)
+        then_block, else_block = first.successors
+        self.assertEqual(then_block.predecessors, [first])
+        self.assertEqual(else_block.predecessors, [first])
+        last = cfg.blocks[-1]
+        self.assertEqual(last.instructions[-1].opname, "RETURN_VALUE")
+        self.assertEqual(last.successors, [])
+        self.assertTrue(all(not block.exception_successors for block in cfg.blocks))
+
+        # Every instruction is in exactly one block.
+        offsets = [
+            inst.offset for block in cfg.blocks for inst in block.instructions
+        ]
+        self.assertEqual(offsets, sorted(set(offsets)))
+        for block in cfg.blocks:
+            for index, inst in enumerate(block.instructions):
+                self.assertEqual(cfg.positions[inst.offset], (block, index))
+
+    def test_exception_edges(self):
+        cfg = function_cfg(
+            """\
+            def f(x):
+                try:
+                    g(x)
+                except ValueError:
+                    return 1
+                return 2
+            """
+        )
+        call_block = [
+            block
+            for block in cfg.blocks
+            if any(inst.opname.startswith("CALL") for inst in block.instructions)
+        ][0]
+        (handler,) = call_block.exception_successors
+        opnames = [inst.opname for inst in handler.instructions]
+        self.assertTrue("COMPARE_OP" in opnames or "JUMP_IF_NOT_EXC_MATCH" in opnames)
+        # The handler itself is not protected by the try.
+        self.assertEqual(handler.exception_successors, [])
+
+    def test_exception_table(self):
+        # Python 3.11 code, which has an exception table and no SETUP_*
+        # instructions. We can decode it, if not yet run it.
+        path = osp.join(
+            osp.dirname(__file__), "bytecode-3.11", "test_catching_exceptions.pyc"
+        )
+        version, _, _, code = load_module(path)[:4]
+        decoded = DecodedCode(code, get_opcode_module(version), version)
+        table = decoded.exception_table
+        entries = parse_exception_table(code.co_exceptiontable)
+        self.assertEqual(sorted(table.entries), sorted(entries))
+        for entry in entries:
+            self.assertEqual(table.handler(entry.start), entry)
+            self.assertEqual(table.handler(entry.end - 2), entry)
+            self.assertIn(entry.target, decoded.jump_targets)
+        self.assertIsNone(table.handler(0))
+        self.assertIsNone(table.handler(entries[-1].end))
+
+        cfg = control_flow_graph(decoded)
+        for entry in entries:
+            block = cfg.block_at(entry.start)
+            self.assertIn(cfg.block_at(entry.target), block.exception_successors)
+
+    def test_loop_exits(self):
+        # Python 3.7 code, which has BREAK_LOOP and CONTINUE_LOOP.
+        path = osp.join(
+            osp.dirname(__file__), "bytecode-3.7", "test_break_and_continue.pyc"
+        )
+        version, _, _, code = load_module(path)[:4]
+        opc = get_opcode_module(version)
+        functions = {
+            const.co_name: const
+            for const in code.co_consts
+            if hasattr(const, "co_code")
+        }
+
+        cfg = control_flow_graph(DecodedCode(functions["count"], opc, version))
+        # One break right in its loop, and the rest from within one or two
+        # "try" blocks.
+        self.assertEqual(sorted(cfg.loop_exits.values()), [0, 1, 1, 1, 2, 2])
+        for offset in cfg.loop_exits:
+            inst = cfg.decoded.instruction_at(offset)
+            self.assertIn(inst.opname, ("BREAK_LOOP", "CONTINUE_LOOP"))
+
+        # Leaving a "finally" block runs its handler.
+        cfg = control_flow_graph(
+            DecodedCode(functions["finally_count"], opc, version)
+        )
+        self.assertEqual(cfg.loop_exits, {})
+
+    def test_cached(self):
+        vm = PyVM()
+        code = compile("x = 1", "<cfg>", "exec")
+        decoded = DecodedCode(code, vm.opc, vm.version)
+        self.assertIs(control_flow_graph(decoded), control_flow_graph(decoded))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+"""Run the VM tests again, using the closure engine."""
+
+try:
+    import test_basic
+    import test_data
+    import test_exceptions
+    import test_functions
+    import test_stmts
+    import test_with
+    import vmtest
+except ImportError:
+    from . import (
+        test_basic,
+        test_data,
+        test_exceptions,
+        test_functions,
+        test_stmts,
+        test_with,
+        vmtest,
+    )
+
+for module in (
+    test_basic,
+    test_data,
+    test_exceptions,
+    test_functions,
+    test_stmts,
+    test_with,
+):
+    for name, test_class in list(vars(module).items()):
+        if (
+            isinstance(test_class, type)
+            and issubclass(test_class, vmtest.VmTestCase)
+            and test_class is not vmtest.VmTestCase
+        ):
+            closure_name = name + "Closure"
+            globals()[closure_name] = type(
+                closure_name, (test_class,), {"engine": "closure"}
+            )
+
+del module, name, test_class
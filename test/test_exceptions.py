@@ -1,5 +1,9 @@
 """Test exceptions."""
 
+import os
+import os.path as osp
+import subprocess
+import sys
 import unittest
 
 try:
@@ -9,6 +13,8 @@ except ImportError:
 
 from xdis.version_info import PYTHON_VERSION_TRIPLE, PYTHON3
 
+from xpython.vm import PyVM, PyVMUncaughtException
+
 PY2 = not PYTHON3
 
 
@@ -35,6 +41,131 @@ class TestExceptions(vmtest.VmTestCase):
     def test_coverage_issue_92(self):
         self.assert_ok("raise ValueError", raises=ValueError)
 
+    def test_uncaught_exception(self):
+        # An error in a call at the top level comes out with its message.
+        code = compile("len(1, 2)", "<uncaught>", "exec")
+        with self.assertRaises(PyVMUncaughtException) as cm:
+            PyVM(vmtest_testing=True, engine=self.engine).run_code(code)
+        self.assertEqual(cm.exception[0], TypeError)
+        self.assertEqual(
+            cm.exception.args, ("len() takes exactly one argument (2 given)",)
+        )
+
+    def test_reraise_traceback(self):
+        # The traceback goes back to where the exception was first raised.
+        self.assert_ok(
+            """\
+            def a():
+                raise KeyError("a")
+            def b():
+                try:
+                    a()
+                except KeyError:
+                    raise
+            def c():
+                return b()
+            c()
+            """,
+            raises=KeyError,
+        )
+
+    def test_raise_in_handler_traceback(self):
+        self.assert_ok(
+            """\
+            def a(n):
+                if n == 1:
+                    raise KeyError("a")
+                return [][n]
+            def b():
+                try:
+                    a(3)
+                except IndexError:
+                    a(1)
+            def c():
+                return b()
+            c()
+            """,
+            raises=KeyError,
+        )
+
+    def test_traceback_through_calls(self):
+        # An exception caught earlier doesn't get in the way.
+        self.assert_ok(
+            """\
+            def a():
+                try:
+                    {}[1]
+                except KeyError:
+                    pass
+                b()
+            def b():
+                c()
+            def c():
+                return 1 / 0
+            a()
+            """,
+            raises=ZeroDivisionError,
+        )
+
+    def test_failing_instruction_line(self):
+        # The closure engine runs some instruction sequences as one
+        # superinstruction; the traceback still has the line of the
+        # instruction that failed.
+        for source, raises in (
+            (
+                """\
+                def f(flag):
+                    a = 1
+                    if flag:
+                        b = 2
+                    return a + b
+                f(False)
+                """,
+                UnboundLocalError,
+            ),
+            (
+                """\
+                def f(a):
+                    if a < None:
+                        return 1
+                f(1)
+                """,
+                TypeError,
+            ),
+            (
+                """\
+                def f(flag):
+                    if flag:
+                        b = 2
+                    a = 1
+                    b
+                f(False)
+                """,
+                UnboundLocalError,
+            ),
+            (
+                """\
+                def f(flag):
+                    a = 1
+                    if flag:
+                        b = 2
+                    return (a +
+                            b)
+                f(False)
+                """,
+                UnboundLocalError,
+            ),
+            (
+                """\
+                def f(a):
+                    return a + 1
+                f("x")
+                """,
+                TypeError,
+            ),
+        ):
+            self.assert_ok(source, raises=raises)
+
     if PYTHON_VERSION_TRIPLE >= (3, 6):
         print("Test not gone over yet for >= 3.6")
     else:
@@ -163,5 +294,31 @@ class TestExceptions(vmtest.VmTestCase):
             )
 
 
+class TestExceptionTable(vmtest.VmTestCase):
+    """In 3.11 and later, handlers are found in the exception table of
+    the code. This is 3.11 bytecode that makes no calls, so it can run
+    whatever the Python running the tests. Loading the 3.9+ opcodes
+    removes ones that older bytecode uses, so before 3.9, where the rest
+    of the tests don't load them, it runs in its own process."""
+
+    def test_handlers(self):
+        path = osp.join(vmtest.srcdir, "bytecode-3.11", "test_except_without_calls.pyc")
+        for engine in ("classic", "closure"):
+            if PYTHON_VERSION_TRIPLE >= (3, 9):
+                self.engine = engine
+                self.assert_runs_ok(path, arg_type="bytecode-file")
+                continue
+            pythonpath = os.pathsep.join(
+                filter(None, [osp.dirname(vmtest.srcdir), os.environ.get("PYTHONPATH")])
+            )
+            result = subprocess.run(
+                [sys.executable, "-m", "xpython", "-e", engine, path],
+                env=dict(os.environ, PYTHONPATH=pythonpath),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            self.assertEqual(result.returncode, 0, result.stdout.decode())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -65,6 +65,57 @@ else:
                 """
             )
 
+        def test_deep_recursion(self):
+            # Interpreted calls don't recurse in the VM, so this goes deeper
+            # than the VM itself could recurse.
+            self.assert_ok(
+                """\
+                def depth(n):
+                    if n == 0:
+                        return 0
+                    return depth(n - 1) + 1
+                print(depth(500))
+                """
+            )
+
+        def test_exception_through_calls(self):
+            self.assert_ok(
+                """\
+                def inner(x):
+                    return len(x)
+                def outer(x):
+                    inner(x)
+                    return "not reached"
+                def catch(x):
+                    result = "not caught"
+                    try:
+                        result = outer(x)
+                    except TypeError:
+                        result = "caught"
+                    return result
+                print(catch(1))
+                print(catch("ok"))
+                """
+            )
+
+        def test_locals_is_a_snapshot(self):
+            self.assert_ok(
+                """\
+                def fn(a, b=2):
+                    c = a + b
+                    d = locals()
+                    d["c"] = 100
+                    print(sorted(locals().keys()), c)
+                    del c
+                    try:
+                        c
+                    except UnboundLocalError:
+                        print("c is unbound")
+                    return eval("a + b")
+                print(fn(1))
+                """
+            )
+
         def test_nested_names(self):
             self.assert_ok(
                 """\
@@ -105,6 +156,142 @@ else:
                 """
             )
 
+        def test_binding_arguments(self):
+            self.assert_ok(
+                """\
+                def fn(a, b=2, *args, c, d=4, **kwargs):
+                    def inner():
+                        return a
+                    return a, b, args, c, d, kwargs, inner()
+                print(fn(1, c=3))
+                print(fn(1, 5, 6, 7, c=3, e=8))
+                print(fn(c=3, a=1, b=0, d=None))
+                fn.__defaults__ = (20,)
+                fn.__kwdefaults__["d"] = 40
+                print(fn(1, c=3))
+                for args, kwargs in [((), {"c": 3}), ((1, 2), {}),
+                                     ((1,), {"a": 1, "c": 3})]:
+                    try:
+                        fn(*args, **kwargs)
+                    except TypeError as e:
+                        print(type(e).__name__)
+                try:
+                    fn(1, 2, b=3, c=4)
+                except TypeError as e:
+                    print(type(e).__name__)
+
+                class Thing(object):
+                    def method(self, x, *rest, y=0):
+                        return self, x, rest, y
+                thing = Thing()
+                print(thing.method(1)[1:], thing.method(1, 2, y=3)[1:])
+                print(thing.method(x=1)[0] is thing, [thing.method(x)[1] for x in "ab"])
+                """
+            )
+
+        def test_binding_errors(self):
+            self.assert_ok(
+                """\
+                def h(a, b=2, *, c, d=4):
+                    return a
+                def m(a, b, c, d=1):
+                    pass
+                def k(**kwargs):
+                    return kwargs
+                class C(object):
+                    def meth(self, a):
+                        pass
+                for call in [
+                    lambda: h(1, 2, 3), lambda: h(1, 2, 3, c=1), lambda: h(1),
+                    lambda: h(c=1), lambda: h(1, a=1, c=3),
+                    lambda: h(1, c=3, e=5), lambda: h(1, **{1: 2}),
+                    lambda: k(**{1: 2}), lambda: k(a=1, **{1: 2}),
+                    lambda: m(), lambda: m(1), lambda: m(1, 2, 3, 4, 5),
+                    lambda: C().meth(), lambda: C().meth(1, 2),
+                ]:
+                    try:
+                        call()
+                    except TypeError as e:
+                        print(e)
+                """
+            )
+
+        if PYTHON_VERSION_TRIPLE >= (3, 8):
+
+            def test_positional_only_binding_errors(self):
+                self.assert_ok(
+                    """\
+                    def g(x, y, /, z=1, **kw):
+                        return x, y, z, kw
+                    def k(a, /, b):
+                        return a
+                    print(g(1, 2, y=3))
+                    for call in [
+                        lambda: g(1, y=2), lambda: g(1, 2, 3, 4),
+                        lambda: k(a=1, b=2), lambda: k(1, 2, a=1),
+                    ]:
+                        try:
+                            call()
+                        except TypeError as e:
+                            print(e)
+                    """
+                )
+
+        def test_calling_kinds_of_callables(self):
+            self.assert_ok(
+                """\
+                class Adder(object):
+                    def __call__(self, x):
+                        return x + "!"
+                def fn(a):
+                    xs = []
+                    append = xs.append
+                    for f, x in ((len, a), (Adder(), a), (abs, -2),
+                                 (str.upper, a), (eval, "1 + 2")):
+                        append(f(x))
+                    append(sorted(locals()))
+                    append("fn" in globals())
+                    return xs
+                print(fn("ab"))
+                T = type("T", (object,), {"x": 1})
+                print(T.__name__, T.x)
+                """
+            )
+
+        def test_repeated_calls(self):
+            self.assert_ok(
+                """\
+                def snapshot(x):
+                    return locals()
+                def adder(n):
+                    def add(x):
+                        return x + n
+                    return add
+                def fib(n):
+                    return n if n < 2 else fib(n - 1) + fib(n - 2)
+                add1, add2 = adder(1), adder(2)
+                print(snapshot(1), snapshot(2), add1(10), add2(10), fib(10))
+                """
+            )
+
+        def test_calls_with_changing_types(self):
+            self.assert_ok(
+                """\
+                def add(a, b):
+                    return a + b
+                def lt(a, b):
+                    if a < b:
+                        return True
+                    return False
+                for i in range(20):
+                    add(i, 1)
+                    lt(i, 10)
+                print(add("a", "b"), add([1], [2]), lt(1.5, 2))
+                lt(1, None)
+                """,
+                raises=TypeError,
+            )
+
     class TestClosures(vmtest.VmTestCase):
         if PYTHON_VERSION_TRIPLE < (3, 8):
 
@@ -120,6 +307,27 @@ else:
                 def test_call_ex_kw(self):
                     self.self_checking()
 
+        def test_cells_shared_between_frames(self):
+            self.assert_ok(
+                """\
+                def counter(start):
+                    def bump():
+                        nonlocal start
+                        start += 1
+                        return start
+                    bump()
+                    return bump, lambda: start
+                bump, get = counter(10)
+                bump()
+                print(get())
+
+                class Thing:
+                    def name(self):
+                        return __class__.__name__
+                print(Thing().name())
+                """
+            )
+
     class TestGenerators(vmtest.VmTestCase):
         def test_first(self):
             self.assert_ok(
@@ -201,8 +409,98 @@ else:
                 """
             )
 
+        def test_deep_generator_pipeline(self):
+            # Generators resumed by FOR_ITER run in the loop of the frame
+            # that resumes them, so a pipeline can be deeper than the VM
+            # itself could recurse.
+            self.assert_ok(
+                """\
+                g = iter(range(5))
+                for i in range(400):
+                    g = (x + 1 for x in g)
+                print(list(g))
+
+                def fails():
+                    yield 1
+                    raise ValueError("in generator")
+                try:
+                    for x in fails():
+                        print(x)
+                except ValueError as e:
+                    print("caught", e)
+                """
+            )
+
         if PYTHON_VERSION_TRIPLE >= (3, 3):
             # yield from starts in 3.3
+            def test_yield_from_chain(self):
+                self.assert_ok(
+                    """\
+                    def leaf(n):
+                        for i in range(n):
+                            got = yield i
+                            if got:
+                                print("leaf got", got)
+                        return "leaf done"
+
+                    def bad():
+                        yield "b"
+                        {}["k"]
+
+                    def middle(n):
+                        r = yield from leaf(n)
+                        print("middle", r)
+                        try:
+                            yield from bad()
+                        except KeyError as e:
+                            print("middle caught", e)
+                        return "middle done"
+
+                    def top(n):
+                        r = yield from middle(n)
+                        yield r
+
+                    g = top(3)
+                    for x in g:
+                        print(x)
+                        if x == 1:
+                            break
+                    print(next(g), list(g))
+                    g = top(3)
+                    print(next(g), g.send("hi"), g.send(None), next(g))
+
+                    def nest(n):
+                        if n:
+                            yield from nest(n - 1)
+                        else:
+                            yield 1
+                            yield 2
+                    print(list(nest(300)))
+                    """
+                )
+
+            def test_stop_iteration_in_generator(self):
+                self.assert_ok(
+                    """\
+                    def inner():
+                        yield 1
+                    def outer():
+                        yield from inner()
+                        raise StopIteration(2)
+                    def main():
+                        x = yield from outer()
+                        print("not reached", x)
+                    g = main()
+                    print(next(g))
+                    try:
+                        next(g)
+                    except StopIteration:
+                        print("StopIteration")
+                    print(list(main()))
+                    """,
+                    raises=RuntimeError,
+                )
+
             def test_yield_from(self):
                 self.assert_ok(
                     """\
@@ -290,6 +588,60 @@ else:
                 """
                 )
 
+    class TestNativeFunctions(vmtest.VmTestCase):
+        # Hot functions are run natively; see xpython.native.
+        native_threshold = 2
+
+        def test_deep_native_recursion(self):
+            self.assert_ok(
+                """\
+                import sys
+                def depth(n):
+                    return 0 if n == 0 else depth(n - 1) + 1
+                print(depth(10))
+                print(depth(sys.getrecursionlimit() - 100))
+                """
+            )
+
+        def test_unbounded_native_recursion(self):
+            # The program's own recursion limit holds, in native code too.
+            self.assert_ok(
+                """\
+                import sys
+                def forever(n):
+                    return forever(n + 1)
+                def limit():
+                    return sys.getrecursionlimit()
+                old_limit = sys.getrecursionlimit()
+                try:
+                    sys.setrecursionlimit(6000)
+                    print([limit() for i in range(5)])
+                    forever(0)
+                except RecursionError as e:
+                    print(e)
+                finally:
+                    sys.setrecursionlimit(old_limit)
+                print(limit() == old_limit)
+                """
+            )
+
+        def test_hot_functions(self):
+            self.assert_ok(
+                """\
+                def countdown(n):
+                    while n > 0:
+                        n -= 1
+                    return n
+                def closure(k):
+                    def inner():
+                        return k
+                    return inner
+                inner = closure(3)
+                print([(countdown(i), inner()) for i in range(5)])
+                print(countdown(10))
+                """
+            )
+
     if __name__ == "__main__":
         # import unittest
         # unittest.main()
@@ -0,0 +1,279 @@
+"""Check the counters the VM keeps, and what it shows of how it ran code."""
+
+import builtins
+import os.path as osp
+import sys
+import textwrap
+import types
+import unittest
+
+from xdis import load_module
+
+from xpython import methodcache
+from xpython.pyobj import Function
+from xpython.vm import PyVM, PyVMError
+from xpython.vmtrace import PyVMEVENT_NONE, PyVMTraced
+
+ENGINES = ("classic", "closure")
+
+
+def run(vm, source):
+    """Run `source` in `vm` and return the globals it left."""
+    env = {"__name__": "__main__", "__builtins__": builtins}
+    vm.run_code(compile(textwrap.dedent(source), "<stats>", "exec"), env)
+    return env
+
+
+class TestSpecialization(unittest.TestCase):
+    """The closure engine specializes instructions for the types of the
+    values they see, and goes back when the types change."""
+
+    def test_specialize_and_deoptimize(self):
+        vm = PyVM(engine="closure")
+        run(
+            vm,
+            """\
+            def add(a, b):
+                return a + b
+            def lt(a, b):
+                return a < b
+            for i in range(20):
+                add(i, 1)
+                lt(i, 10)
+            add("a", "b")
+            lt(1.5, 2)
+            """,
+        )
+        stats = vm.specialization_stats
+        self.assertEqual(stats["specialized", "BINARY_ADD", "int"], 1)
+        self.assertEqual(stats["deoptimized", "BINARY_ADD", "int"], 1)
+        self.assertEqual(stats["specialized", "COMPARE_OP", "int"], 1)
+        self.assertEqual(stats["deoptimized", "COMPARE_OP", "int"], 1)
+        self.assertEqual(stats["specialized", "FOR_ITER", "range"], 1)
+
+
+class TestNativeExecution(unittest.TestCase):
+    """With a native_threshold, functions that have become hot are run
+    natively, unless something is watching them run. A function run
+    natively sees its own frame."""
+
+    SOURCE = """\
+        import sys
+        def where(n=0):
+            while n > 0:
+                n -= 1
+            return sys._getframe().f_code.co_name
+        def closure(module):
+            def inner():
+                return module._getframe().f_code.co_name
+            return inner
+        inner = closure(sys)
+        names = []
+        inner_names = []
+        for i in range(5):
+            names.append(where())
+            inner_names.append(inner())
+        """
+
+    def test_hot_function_runs_natively(self):
+        for engine in ENGINES:
+            env = run(PyVM(engine=engine, native_threshold=3), self.SOURCE)
+            self.assertEqual(env["names"][3:], ["where", "where"], engine)
+            self.assertNotIn("where", env["names"][:3], engine)
+            # Functions with free variables stay interpreted.
+            self.assertNotIn("inner", env["inner_names"], engine)
+
+    def test_backward_jumps_make_hot(self):
+        source = """\
+            import sys
+            def where(n):
+                while n > 0:
+                    n -= 1
+                return sys._getframe().f_code.co_name
+            first = where(10)
+            second = where(0)
+            """
+        for engine in ENGINES:
+            env = run(PyVM(engine=engine, native_threshold=5), source)
+            self.assertNotEqual(env["first"], "where", engine)
+            self.assertEqual(env["second"], "where", engine)
+
+    def test_functions_made_stay_interpreted(self):
+        source = """\
+            import sys
+            def make():
+                def inner(x):
+                    return x + 1
+                return inner
+            def make_all(n):
+                return [lambda: i for i in range(n)]
+            def where(n):
+                squares = [i * i for i in range(n)]
+                return sys._getframe().f_code.co_name
+            made = [make() for i in range(5)]
+            made_all = [make_all(2) for i in range(5)]
+            names = [where(3) for i in range(5)]
+            """
+        for engine in ENGINES:
+            env = run(PyVM(engine=engine, native_threshold=2), source)
+            made = env["made"] + [f for fs in env["made_all"] for f in fs]
+            self.assertTrue(all(isinstance(f, Function) for f in made), engine)
+            # A comprehension alone doesn't keep a function interpreted.
+            self.assertEqual(env["names"][3:], ["where", "where"], engine)
+
+    def test_off_by_default(self):
+        env = run(PyVM(), self.SOURCE)
+        self.assertNotIn("where", env["names"])
+
+    def test_bad_threshold(self):
+        self.assertRaises(PyVMError, PyVM, native_threshold=-1)
+
+    def test_not_while_traced(self):
+        def callback(event, *args):
+            return True
+
+        env = run(PyVMTraced(callback, native_threshold=0), self.SOURCE)
+        self.assertNotIn("where", env["names"])
+        # Nothing traced.
+        vm = PyVMTraced(callback, event_flags=PyVMEVENT_NONE, native_threshold=0)
+        env = run(vm, self.SOURCE)
+        self.assertEqual(env["names"][1:], ["where"] * 4)
+
+
+class TestFastLocals(unittest.TestCase):
+    """Functions keep their locals in a list; f_locals is made from it
+    when asked for, and changes to it are seen."""
+
+    def test_trace_function_changes_locals(self):
+        def callback(event, offset, byte_name, byte_code, line_number, *args):
+            frame = args[-1].frame
+            if event == "line" and frame.f_code.co_name == "f" and line_number == 3:
+                frame.f_locals["x"] = 42
+            return True
+
+        source = """\
+            def f():
+                x = 1
+                return x
+            result = f()
+            """
+        env = run(PyVMTraced(callback), source)
+        self.assertEqual(env["result"], 42)
+
+
+class TestFunctionShadow(unittest.TestCase):
+    """The native function that shadows a VM function is made only when
+    it is asked for."""
+
+    def test_made_on_first_use(self):
+        env = run(PyVM(), "adders = [lambda x, n=n: x + n for n in range(3)]")
+        adders = env["adders"]
+        self.assertEqual([add(1) for add in adders], [1, 2, 3])
+        self.assertTrue(all(add._shadow is None for add in adders))
+        native = adders[2]._func
+        self.assertIsInstance(native, types.FunctionType)
+        self.assertEqual(native.__defaults__, (2,))
+        self.assertIs(adders[2]._func, native)
+
+
+class TestFrameRecycling(unittest.TestCase):
+    """The frames of returned calls are set up again for later calls of
+    the same code."""
+
+    def test_frames_are_reused(self):
+        source = """\
+            def fib(n):
+                return n if n < 2 else fib(n - 1) + fib(n - 2)
+            fib(10)
+            """
+        for engine in ENGINES:
+            vm = PyVM(engine=engine)
+            run(vm, source)
+            self.assertGreater(vm.frame_stats["reused"], 100, engine)
+            self.assertLess(vm.frame_stats["made"], 20, engine)
+
+
+class TestSetupBlocks(unittest.TestCase):
+    """The block pushed by a SETUP_* instruction is made once and pushed
+    again each time the instruction runs."""
+
+    def test_blocks_are_shared(self):
+        vm = PyVM()
+        env = run(
+            vm,
+            """\
+            def count(xs):
+                total = 0
+                for x in xs:
+                    try:
+                        total += 10
+                    finally:
+                        total += 1
+                    try:
+                        total += {0: 1}[x]
+                    except KeyError:
+                        continue
+                return total
+            count(range(3))
+            """,
+        )
+        count = env["count"]
+        setup_blocks = vm.decoded_code[id(count.__code__)].setup_blocks
+        blocks = dict(setup_blocks)
+        self.assertTrue(blocks)
+        count(range(10))
+        for offset, block in blocks.items():
+            self.assertIs(setup_blocks[offset], block)
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "LOAD_METHOD is new in 3.7")
+class TestMethodCache(unittest.TestCase):
+    """LOAD_METHOD pushes methods of VM classes unbound, using a cache
+    keyed on type."""
+
+    def test_hits_and_misses(self):
+        source = """\
+            class A:
+                def f(self):
+                    return "A.f"
+            def call(obj):
+                return obj.f()
+            a = A()
+            for i in range(3):
+                call(a)
+            A.f = lambda self: "new A.f"
+            call(a)
+            """
+        for engine in ENGINES:
+            vm = PyVM(engine=engine)
+            run(vm, source)
+            stats = methodcache.stats(vm)
+            self.assertGreaterEqual(stats["hits"], 2, engine)
+            self.assertGreaterEqual(stats["misses"], 1, engine)
+
+
+class TestMethodCalls(unittest.TestCase):
+    """Before 3.7, "obj.name(...)" is a LOAD_ATTR and a CALL_FUNCTION.
+    These are paired up when the code is decoded and run the way
+    LOAD_METHOD and CALL_METHOD are."""
+
+    def test_falsy_self(self):
+        path = osp.join(
+            osp.dirname(__file__),
+            "bytecode-3.6",
+            "test_bound_method_on_falsy_objects.pyc",
+        )
+        version, _, _, code = load_module(path)[:4]
+        for engine in ENGINES:
+            vm = PyVM(python_version=version, engine=engine)
+            decoded = vm.get_decoded(vm.make_frame(code))
+            (load,) = decoded.method_loads
+            (call,) = decoded.method_calls
+            self.assertEqual(decoded.instruction_at(load).opname, "LOAD_ATTR")
+            self.assertEqual(decoded.instruction_at(call).opname, "CALL_FUNCTION")
+            vm.run_code(code, {"__name__": "__main__", "__builtins__": builtins})
+            self.assertEqual(methodcache.stats(vm)["misses"], 1, engine)
+
+
+if __name__ == "__main__":
+    unittest.main()
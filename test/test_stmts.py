@@ -29,6 +29,30 @@ else:
         def test_exec(self):
             self.self_checking()
 
+        def test_break_and_continue(self):
+            self.self_checking()
+
+        def test_break_and_continue_around_handlers(self):
+            self.assert_ok(
+                """\
+                def count(xs):
+                    total = 0
+                    for x in xs:
+                        try:
+                            total += 10
+                        finally:
+                            total += 1
+                        try:
+                            total += {0: 1}[x]
+                        except KeyError:
+                            continue
+                        if x > 5:
+                            break
+                    return total
+                print([count(range(n)) for n in range(10)])
+                """
+            )
+
 
 if __name__ == "__main__":
     # import unittest
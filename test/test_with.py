@@ -10,7 +10,7 @@ from xdis.version_info import PYTHON_VERSION_TRIPLE
 
 class TestWithStatement(vmtest.VmTestCase):
 
-    if PYTHON_VERSION_TRIPLE < (3, 8):
+    if PYTHON_VERSION_TRIPLE < (3, 9):
 
         def test_simple_context_manager(self):
             self.self_checking()
@@ -36,6 +36,30 @@ class TestWithStatement(vmtest.VmTestCase):
         def test_raise_in_with(self):
             self.do_one()
 
+    def test_contextmanager(self):
+        self.assert_ok(
+            """\
+            from contextlib import contextmanager
+
+            @contextmanager
+            def tag(name):
+                print("<%s>" % name)
+                try:
+                    yield name
+                finally:
+                    print("</%s>" % name)
+
+            def first(names):
+                for name in names:
+                    with tag(name) as x:
+                        return x
+
+            with tag("a") as x:
+                print(x)
+            print(first(["b", "c"]))
+            """
+        )
+
     if PYTHON_VERSION_TRIPLE >= (3, 6):
         print("Test not gone over yet for >= 3.6")
     else:
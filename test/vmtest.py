@@ -36,6 +36,19 @@ def parent_function_name():
 
 LINE_STR = "-" * 25
 
+
+def traceback_entries(tb, filename):
+    """The function names and line numbers in traceback `tb` of the code
+    compiled from `filename`."""
+    entries = []
+    while tb is not None:
+        f_code = tb.tb_frame.f_code
+        if f_code.co_filename == filename:
+            entries.append((f_code.co_name, tb.tb_lineno))
+        tb = tb.tb_next
+    return entries
+
+
 supported_versions = frozenset(
     [(2, 7), (3, 2), (3, 3), (3, 4), (3, 5), (3, 6), (3, 7), (3, 8), (3, 9), (3, 10),
      (3, 11)]
@@ -43,6 +56,11 @@ supported_versions = frozenset(
 
 
 class VmTestCase(unittest.TestCase):
+    # The PyVM engine to run code with.
+    engine = "classic"
+    # The native_threshold of the PyVM; see xpython.native.
+    native_threshold = None
+
     def do_one(self):
         self.version_pair = PYTHON_VERSION_TRIPLE[:2]
         assert self.version_pair in supported_versions
@@ -107,7 +125,11 @@ class VmTestCase(unittest.TestCase):
         vm_stdout = six.StringIO()
         if CAPTURE_STDOUT:  # pragma: no branch
             sys.stdout = vm_stdout
-        vm = PyVM(vmtest_testing=True)
+        vm = PyVM(
+            vmtest_testing=True,
+            engine=self.engine,
+            native_threshold=self.native_threshold,
+        )
 
         vm_value = vm_exc = None
         try:
@@ -149,6 +171,11 @@ class VmTestCase(unittest.TestCase):
         sys.stdout = real_stdout
 
         self.assert_same_exception(vm_exc, py_exc)
+        if py_exc is not None:
+            self.assertEqual(
+                traceback_entries(vm.last_traceback, code.co_filename),
+                traceback_entries(py_exc.__traceback__, code.co_filename),
+            )
         self.assertEqual(vm_stdout.getvalue(), py_stdout.getvalue())
         self.assertEqual(vm_value, py_value)
         if raises:
@@ -197,7 +224,7 @@ class VmTestCase(unittest.TestCase):
             )
         )
 
-        vm = PyVM(python_version=self.version_pair)
+        vm = PyVM(python_version=self.version_pair, engine=self.engine)
 
         vm_value = vm_exc = None
         try:
@@ -5,7 +5,7 @@ import logging
 import sys
 
 from xpython import execfile
-from xpython.vm import PyVMRuntimeError
+from xpython.vm import ENGINES, PyVMRuntimeError
 from xpython.version import __version__
 from xdis.version_info import IS_PYPY, version_tuple_to_str
 
@@ -38,9 +38,28 @@ def version_message():
 @click.option(
     "-c", "--command-to-run", help="program passed in as a string", required=False
 )
+@click.option(
+    "-e",
+    "--engine",
+    type=click.Choice(ENGINES),
+    default="classic",
+    show_default=True,
+    help="how to run bytecode: in the classic interpreter loop, or "
+    "translated into a closure per instruction. With --verbose, the "
+    "classic loop is used so that instructions can be logged.",
+)
+@click.option(
+    "-n",
+    "--native-threshold",
+    type=click.IntRange(min=0),
+    default=None,
+    help="run a function natively, bypassing the interpreter, once it has "
+    "been called or looped in this many times. Only for bytecode of the "
+    "running Python, and not while instructions are logged or traced.",
+)
 @click.argument("path", nargs=1, type=click.Path(readable=True), required=False)
 @click.argument("args", nargs=-1)
-def main(module, verbose, command_to_run, path, args):
+def main(module, verbose, command_to_run, engine, native_threshold, path, args):
     """
     Runs Python programs or bytecode using a bytecode interpreter written in Python.
     """
@@ -68,7 +87,7 @@ def main(module, verbose, command_to_run, path, args):
         sys.exit(4)
 
     try:
-        run_fn(path, args)
+        run_fn(path, args, engine=engine, native_threshold=native_threshold)
     except PyVMRuntimeError:
         # Tracebacks and error messages should been previously printed
         sys.exit(10)
@@ -117,13 +117,9 @@ def builtin_super(self: Any, typ=None, obj=None):
     """
     super() but first argument is filled in via interpreter
     """
-    cells = self.cells
-    if hasattr(cells, "__class__"):
-        cell = cells["__class__"]
-    elif hasattr(cells, "__classcell__"):
-        cell = cells["__classcell__"]
-
-    start_class = cell.get()
+    code = self.f_code
+    names = list(code.co_cellvars) + list(code.co_freevars)
+    start_class = self.cells[names.index("__class__")].contents
     return WrappedSuperClass(start_class, typ, obj)
 
     return None
@@ -122,4 +122,8 @@ def get_byteop(vm, python_version, is_pypy):
                 raise vm.PyVMError(f"Version {python_version} not supported")
             pass
         pass
+
+    from xpython.byteop.byteop import make_dispatch_table
+
+    byteop.dispatch_table = make_dispatch_table(byteop, vm.opc)
     return byteop
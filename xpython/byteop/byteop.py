@@ -8,12 +8,16 @@ import inspect
 import logging
 import operator
 import sys
+import types
+from functools import partial
 from typing import Any, Callable, Tuple
 
+from xdis.opcodes.opcode_311 import _nb_ops
 from xdis.version_info import PYTHON_VERSION_TRIPLE, version_tuple_to_str
 
 from xpython.builtins import build_class, builtin_super
-from xpython.pyobj import Function
+from xpython.methodcache import MethodCache
+from xpython.pyobj import Function, Method
 
 
 # FIXME: in the future we can get this from xdis
@@ -64,28 +68,48 @@ BINARY_OPERATORS = {
     "OR": operator.or_,
 }
 
-INPLACE_OPERATORS = frozenset(
-    [
-        "ADD",
-        "AND",
-        "DIVIDE",
-        "FLOOR_DIVIDE",
-        "LSHIFT",
-        "MODULO",
-        "MULTIPLY",
-        "OR",
-        "POWER" "RSHIFT",
-        "SUBTRACT",
-        "TRUE_DIVIDE",
-        "XOR",
-        # 3.5 on
-        "POWER",
-        "MATRIX_MULTIPLY",
-    ]
-)
+
+def inplace_divide(x, y):
+    # Overwritten __div__ is not picked up by x //= y
+    # which seems to puck up FLOOR_DIVIDE
+    # See Python 2.7 test_augassign.py
+    if hasattr(x, "__idiv__"):
+        return x.__idiv__(y)
+    x //= y
+    return x
+
+
+INPLACE_OPERATORS = {
+    "ADD": operator.iadd,
+    "AND": operator.iand,
+    "DIVIDE": inplace_divide,
+    "FLOOR_DIVIDE": operator.ifloordiv,
+    "LSHIFT": operator.ilshift,
+    "MODULO": operator.imod,
+    "MULTIPLY": operator.imul,
+    "OR": operator.ior,
+    "POWER": operator.ipow,
+    "RSHIFT": operator.irshift,
+    "SUBTRACT": operator.isub,
+    "TRUE_DIVIDE": operator.itruediv,
+    "XOR": operator.ixor,
+}
 
 if PYTHON_VERSION_TRIPLE >= (3, 5):
     BINARY_OPERATORS["MATRIX_MULTIPLY"] = operator.matmul
+    INPLACE_OPERATORS["MATRIX_MULTIPLY"] = operator.imatmul
+
+
+def arithmetic_operator(opname):
+    """Return the function that arithmetic opcode `opname` applies and
+    the number of operands it takes, or None if `opname` is not one."""
+    if opname.startswith("UNARY_") and opname[6:] in UNARY_OPERATORS:
+        return UNARY_OPERATORS[opname[6:]], 1
+    if opname.startswith("BINARY_") and opname[7:] in BINARY_OPERATORS:
+        return BINARY_OPERATORS[opname[7:]], 2
+    if opname.startswith("INPLACE_") and opname[8:] in INPLACE_OPERATORS:
+        return INPLACE_OPERATORS[opname[8:]], 2
+    return None
 
 
 def fmt_binary_op(vm, arg=None, repr=repr):
@@ -117,6 +141,120 @@ def fmt_unary_op(vm, arg=None, repr=repr):
         raise vm.PyVMError("Empty stack in unary op")
 
 
+def unary_op_routine(vm, fn):
+    """Return an opcode routine that replaces the top of the evaluation
+    stack with the result of applying `fn` to it.
+    """
+
+    def unary_op():
+        stack = vm.frame.stack
+        x = stack.pop()
+        stack.append(fn(x))
+
+    return unary_op
+
+
+def binary_op_routine(vm, fn):
+    """Return an opcode routine that replaces the top two entries of
+    the evaluation stack with the result of applying `fn` to them.
+    """
+
+    def binary_op():
+        stack = vm.frame.stack
+        y = stack.pop()
+        x = stack.pop()
+        stack.append(fn(x, y))
+
+    return binary_op
+
+
+def binary_op_311_routine(vm):
+    """Return the opcode routine for 3.11's BINARY_OP, which is a binary or
+    in-place operator selected by its operand, an index into _nb_ops.
+    """
+    nb_fns = []
+    for nb_name, _ in _nb_ops:
+        op = nb_name[len("NB_") :]
+        if op.startswith("INPLACE_"):
+            nb_fns.append(INPLACE_OPERATORS[op[len("INPLACE_") :]])
+        else:
+            nb_fns.append(BINARY_OPERATORS[op])
+
+    def BINARY_OP(op):
+        stack = vm.frame.stack
+        y = stack.pop()
+        x = stack.pop()
+        stack.append(nb_fns[op](x, y))
+
+    return BINARY_OP
+
+
+def make_dispatch_table(byteop, opc):
+    """Return a list, indexed by opcode, of the routines in `byteop` that
+    run each opcode of `opc`. Routines are called with the instruction's
+    arguments, and the entry for an opcode we do not handle is None.
+
+    Arithmetic and slice opcodes do not have routines of their own in
+    `byteop`; for those we bind the operator in a routine here, so that
+    the VM does not need to look at the opcode name when it runs them.
+    """
+    vm = byteop.vm
+    table = [None] * len(opc.opname)
+    for opcode, opname in enumerate(opc.opname):
+        fn = None
+        if opname.startswith("UNARY_"):
+            op = opname[len("UNARY_") :]
+            if op in UNARY_OPERATORS:
+                fn = unary_op_routine(vm, UNARY_OPERATORS[op])
+        elif opname == "BINARY_OP":
+            fn = binary_op_311_routine(vm)
+        elif opname.startswith("BINARY_"):
+            op = opname[len("BINARY_") :]
+            if op in BINARY_OPERATORS:
+                fn = binary_op_routine(vm, BINARY_OPERATORS[op])
+        elif opname.startswith("INPLACE_"):
+            op = opname[len("INPLACE_") :]
+            if op in INPLACE_OPERATORS:
+                fn = binary_op_routine(vm, INPLACE_OPERATORS[op])
+        elif "SLICE+" in opname:
+            fn = partial(vm.sliceOperator, opname)
+        if fn is None:
+            fn = getattr(byteop, opname, None)
+        table[opcode] = fn
+    return table
+
+
+# What call_function_with_args_resolved() does for a callable, which
+# depends only on its type; see callable_kind().
+CALL_PLAIN = "plain"  # just call it
+CALL_FUNCTION = "function"  # a pyobj.Function, which may run inline
+CALL_METHOD = "method"  # a pyobj.Method, called as its function
+CALL_NATIVE_FUNCTION = "native function"  # which may have a pyobj.Function
+CALL_BUILTIN = "builtin"  # which may be in SPECIAL_BUILTIN_NAMES
+CALL_CLASS = "class"  # which may be type() or super()
+
+# Builtin functions that need to know the frame calling them, or are
+# otherwise run differently in the VM; see call_special_builtin().
+SPECIAL_BUILTIN_NAMES = frozenset(
+    ("globals", "locals", "compile", "exec", "eval", "__build_class__")
+)
+
+
+def callable_kind(tp) -> str:
+    """Return the CALL_ kind of callables of type `tp`."""
+    if tp is Function:
+        return CALL_FUNCTION
+    if issubclass(tp, Method):
+        return CALL_METHOD
+    if issubclass(tp, types.BuiltinFunctionType):
+        return CALL_BUILTIN
+    if issubclass(tp, types.FunctionType):
+        return CALL_NATIVE_FUNCTION
+    if issubclass(tp, type):
+        return CALL_CLASS
+    return CALL_PLAIN
+
+
 class ByteOpBase(object):
     def __init__(self, vm):
         self.vm = vm
@@ -140,17 +278,29 @@ class ByteOpBase(object):
         self.cross_bytecode_eval_warning_shown = False
         self.cross_bytecode_exec_warning_shown = False
 
+        # The kind of callable that objects of a type are; see
+        # callable_kind().
+        self.callable_kinds = {}
+
+        # The caches of load_method(), keyed by method name. The closure
+        # engine has one per instruction instead.
+        self.method_cache = {}
+
     def binaryOperator(self, op):
-        x, y = self.vm.popn(2)
-        self.vm.push(BINARY_OPERATORS[op](x, y))
+        stack = self.vm.frame.stack
+        y = stack.pop()
+        stack[-1] = BINARY_OPERATORS[op](stack[-1], y)
 
     def build_container(self, count, container_fn):
         elts = self.vm.popn(count)
         self.vm.push(container_fn(elts))
 
     def call_function_with_args_resolved(self, func, pos_args, named_args):
-        frame = self.vm.frame
-        if hasattr(func, "im_func"):
+        kind = self.callable_kinds.get(type(func))
+        if kind is None:
+            kind = self.callable_kinds[type(func)] = callable_kind(type(func))
+
+        if kind is CALL_METHOD:
             # Methods get self as an implicit first parameter.
             if func.im_self is not None:
                 pos_args.insert(0, func.im_self)
@@ -166,172 +316,250 @@ class ByteOpBase(object):
                     )
                 )
             func = func.im_func
-
-        # FIXME: put this in a separate routine.
-        if inspect.isbuiltin(func):
-            log.debug("handling built-in function %s" % func.__name__)
-            if func == globals:
-                # Use the frame's globals(), not the interpreter's
-                self.vm.push(frame.f_globals)
-                return
-            elif func == locals:
-                # Use the frame's locals(), not the interpreter's
-                self.vm.push(frame.f_locals)
-                return
-            elif func == compile:
-                # Set dont_inherit parameter.
-                # FIXME: we should set other flags too based on the interpreted environment?
-                if len(pos_args) < 5 and "dont_inherit" not in named_args:
-                    named_args["dont_inherit"] = True
-                    pass
-            # In Python 3.0 or greater, "exec()" is a builtin.  In
-            # Python 2.7 it was an opcode EXEC_STMT and is not a
-            # built-in function.
-            #
-            # FIXME: a better test would be nice. There can be
-            # other builtin "exec"s. Tk has a built-in "eval". See 3.6.10
-            # test_tcl.py.
-            # If we drop the requirement of supporting 2.7 we can do the simpler
-            # and more reliable:
-            #   func == exec
-            elif func.__name__ == "exec":
-                if not 1 <= len(pos_args) <= 3:
-                    raise self.vm.PyVMError(
-                        "exec() builtin should have 1..3 positional arguments; got %d"
-                        % (len(pos_args))
-                    )
-                n = len(pos_args)
-                assert 1 <= n <= 3
-
-                # Note that in contrast to `eval()` handled below, if
-                # the `locals` parameter is not provided, the
-                # `globals` parameter value (whether provided or
-                # default value) is used for the `locals`
-                # parameter. So we shouldn't use the frame's `locals`.
-                if len(pos_args) == 1:
-                    pos_args.append(self.vm.frame.f_globals)
-
-                if self.version_info[:2] == PYTHON_VERSION_TRIPLE[:2]:
-                    source = pos_args[0]
-                    if isinstance(source, str) or isinstance(source, bytes):
-                        try:
-                            pos_args[0] = compile(
-                                source, "<string>", mode="exec", dont_inherit=True
-                            )
-                        except (TypeError, SyntaxError, ValueError):
-                            raise
-                    self.vm.push(self.vm.run_code(*pos_args, toplevel=False))
-                    return
-                else:
-                    if not self.cross_bytecode_exec_warning_shown:
-                        log.warning(
-                            "Running built-in `exec()` because we are cross-version interpreting version %s from version %s."
-                            % (
-                                version_tuple_to_str(self.version_info, end=2),
-                                version_tuple_to_str(PYTHON_VERSION_TRIPLE, end=2),
-                            )
-                        )
-                        self.cross_bytecode_exec_warning_shown = True
-
-            elif func == eval:
-                if not 1 <= len(pos_args) <= 3:
-                    raise self.vm.PyVMError(
-                        "eval() builtin should have 1..3 positional arguments; got %d"
-                        % (len(pos_args))
-                    )
-                assert 1 <= len(pos_args) <= 3
-                # Use the frame's globals(), not the interpreter's
-                n = len(pos_args)
-                if n < 2:
-                    pos_args.append(self.vm.frame.f_globals)
-                # Likewise for locals()
-                if n < 3:
-                    pos_args.append(self.vm.frame.f_locals)
-                assert len(pos_args) == 3
-
-                if self.version_info[:2] == PYTHON_VERSION_TRIPLE[:2]:
-                    source = pos_args[0]
-                    if isinstance(source, str) or isinstance(source, unicode):
-                        try:
-                            pos_args[0] = compile(
-                                source, "<string>", mode="eval", dont_inherit=True
-                            )
-                        except (TypeError, SyntaxError, ValueError):
-                            raise
-                    self.vm.push(self.vm.run_code(*pos_args, toplevel=False))
-                    return
-                else:
-                    if not self.cross_bytecode_eval_warning_shown:
-                        log.warning(
-                            "Running built-in `eval()` because we are cross-version interpreting version %s from version %s."
-                            % (
-                                version_tuple_to_str(self.version_info, end=2),
-                                version_tuple_to_str(PYTHON_VERSION_TRIPLE, end=2),
-                            )
-                        )
-                        self.cross_bytecode_eval_warning_shown = True
-
-            elif PYTHON_VERSION_TRIPLE >= (3, 0) and func == __build_class__:
-                assert (
-                    len(pos_args) > 0
-                ), "__build_class__() should have at least one argument, an __init__() function."
-                init_fn = pos_args[0]
-                if (
-                    isinstance(init_fn, Function)
-                    or self.is_pypy
-                    or self.version_info[:2] != PYTHON_VERSION_TRIPLE[:2]
-                ) and PYTHON_VERSION_TRIPLE >= (3, 3):
-                    # 3.3+ __build_class__() works only on bytecode
-                    # that matches the CPython interpreter, so use
-                    # Darius' version instead.  Down the line we will
-                    # try to do this universally, but it is tricky:
-                    retval = build_class(self.vm.opc, *pos_args, **named_args)
-                    self.vm.push(retval)
-                    return
-                else:
-                    # Use builtin __build_class__(). However for that, we need a native function.
-                    # This is wrong though in that we won't trace into __init__().
-                    init_fn = pos_args[0]
-                    if isinstance(init_fn, Function) and init_fn in self.vm.fn2native:
-                        pos_args[0] = self.vm.fn2native[init_fn]
-        elif func == type and len(pos_args) == 3:
-            # Set __module__
-            assert not named_args
-            namespace = pos_args[2]
-            namespace["__module__"] = namespace.get(
-                "__name__", self.vm.frame.f_globals["__name__"]
-            )
+            kind = callable_kind(type(func))
 
         if (
-            inspect.isfunction(func)
+            kind is CALL_NATIVE_FUNCTION
             and self.version_info[:2] == PYTHON_VERSION_TRIPLE[:2]
         ):
             # Try to convert to an interpreter function so we can interpret it.
             if func in self.vm.fn2native:
                 func = self.vm.fn2native[func]
-            elif False:  # self.vm.version < (3, 0):
-                # Not quite ready. See 3.7 test_asyncgen.py for an
-                # example of code that comes here. In that test, the
-                # LOAD_GLOBAL '_ignore_deprecated_imports' fails to
-                # find the global. '_ignore_deprecated_imports' is a method name
-                # in test.support module of test/support/__init__.py.
-                # In Python 2.X we work around a similar problem by
-                # not tying to handle functions with closures.
-                assert len(pos_args) > 0
-                pos_args[0] = self.convert_native_to_Function(frame, pos_args[0])
-
-        if (
-            inspect.isfunction(func)
-            and self.version_info[:2] == PYTHON_VERSION_TRIPLE[:2]
-        ):
-            log.debug("calling native function %s" % func.__name__)
-        elif inspect.isclass(func):
-            if func.__name__ == "super":
+                kind = callable_kind(type(func))
+            else:
+                log.debug("calling native function %s", func.__name__)
+
+        if kind is CALL_FUNCTION:
+            if self.vm.inline_calls:
+                frame = func.inline_call_frame(pos_args, named_args)
+                if frame is not None:
+                    # PyVM.eval_frame() runs the frame next, without a
+                    # recursive call, and pushes its return value.
+                    self.vm.call_frame = frame
+                    return "call"
+        elif kind is CALL_BUILTIN:
+            if func.__name__ in SPECIAL_BUILTIN_NAMES:
+                return self.call_special_builtin(func, pos_args, named_args)
+        elif kind is CALL_CLASS:
+            if func is type and len(pos_args) == 3:
+                # Set __module__
+                assert not named_args
+                namespace = pos_args[2]
+                namespace["__module__"] = namespace.get(
+                    "__name__", self.vm.frame.f_globals["__name__"]
+                )
+            elif func.__name__ == "super":
                 pos_args = [self.vm.frame] + pos_args
                 func = builtin_super
 
         retval = func(*pos_args, **named_args)
-        self.vm.push(retval)
+        self.vm.frame.stack.append(retval)
+
+    def call_special_builtin(self, func, pos_args, named_args):
+        """Call `func`, a builtin function named in SPECIAL_BUILTIN_NAMES,
+        which may need the frame making the call."""
+        log.debug("handling built-in function %s", func.__name__)
+        frame = self.vm.frame
+        if func is globals:
+            # Use the frame's globals(), not the interpreter's
+            self.vm.push(frame.f_globals)
+            return
+        elif func is locals:
+            # Use the frame's locals(), not the interpreter's
+            self.vm.push(frame.f_locals)
+            return
+        elif func is compile:
+            # Set dont_inherit parameter.
+            # FIXME: we should set other flags too based on the interpreted environment?
+            if len(pos_args) < 5 and "dont_inherit" not in named_args:
+                named_args["dont_inherit"] = True
+                pass
+        # In Python 3.0 or greater, "exec()" is a builtin.  In
+        # Python 2.7 it was an opcode EXEC_STMT and is not a
+        # built-in function.
+        #
+        # FIXME: a better test would be nice. There can be
+        # other builtin "exec"s. Tk has a built-in "eval". See 3.6.10
+        # test_tcl.py.
+        # If we drop the requirement of supporting 2.7 we can do the simpler
+        # and more reliable:
+        #   func == exec
+        elif func.__name__ == "exec":
+            if not 1 <= len(pos_args) <= 3:
+                raise self.vm.PyVMError(
+                    "exec() builtin should have 1..3 positional arguments; got %d"
+                    % (len(pos_args))
+                )
+            n = len(pos_args)
+            assert 1 <= n <= 3
+
+            # Note that in contrast to `eval()` handled below, if
+            # the `locals` parameter is not provided, the
+            # `globals` parameter value (whether provided or
+            # default value) is used for the `locals`
+            # parameter. So we shouldn't use the frame's `locals`.
+            if len(pos_args) == 1:
+                pos_args.append(self.vm.frame.f_globals)
+
+            if self.version_info[:2] == PYTHON_VERSION_TRIPLE[:2]:
+                source = pos_args[0]
+                if isinstance(source, str) or isinstance(source, bytes):
+                    try:
+                        pos_args[0] = compile(
+                            source, "<string>", mode="exec", dont_inherit=True
+                        )
+                    except (TypeError, SyntaxError, ValueError):
+                        raise
+                self.vm.push(self.vm.run_code(*pos_args, toplevel=False))
+                return
+            else:
+                if not self.cross_bytecode_exec_warning_shown:
+                    log.warning(
+                        "Running built-in `exec()` because we are cross-version interpreting version %s from version %s."
+                        % (
+                            version_tuple_to_str(self.version_info, end=2),
+                            version_tuple_to_str(PYTHON_VERSION_TRIPLE, end=2),
+                        )
+                    )
+                    self.cross_bytecode_exec_warning_shown = True
+
+        elif func is eval:
+            if not 1 <= len(pos_args) <= 3:
+                raise self.vm.PyVMError(
+                    "eval() builtin should have 1..3 positional arguments; got %d"
+                    % (len(pos_args))
+                )
+            assert 1 <= len(pos_args) <= 3
+            # Use the frame's globals(), not the interpreter's
+            n = len(pos_args)
+            if n < 2:
+                pos_args.append(self.vm.frame.f_globals)
+            # Likewise for locals()
+            if n < 3:
+                pos_args.append(self.vm.frame.f_locals)
+            assert len(pos_args) == 3
+
+            if self.version_info[:2] == PYTHON_VERSION_TRIPLE[:2]:
+                source = pos_args[0]
+                if isinstance(source, str) or isinstance(source, unicode):
+                    try:
+                        pos_args[0] = compile(
+                            source, "<string>", mode="eval", dont_inherit=True
+                        )
+                    except (TypeError, SyntaxError, ValueError):
+                        raise
+                self.vm.push(self.vm.run_code(*pos_args, toplevel=False))
+                return
+            else:
+                if not self.cross_bytecode_eval_warning_shown:
+                    log.warning(
+                        "Running built-in `eval()` because we are cross-version interpreting version %s from version %s."
+                        % (
+                            version_tuple_to_str(self.version_info, end=2),
+                            version_tuple_to_str(PYTHON_VERSION_TRIPLE, end=2),
+                        )
+                    )
+                    self.cross_bytecode_eval_warning_shown = True
+
+        elif PYTHON_VERSION_TRIPLE >= (3, 0) and func is __build_class__:
+            assert (
+                len(pos_args) > 0
+            ), "__build_class__() should have at least one argument, an __init__() function."
+            init_fn = pos_args[0]
+            if (
+                isinstance(init_fn, Function)
+                or self.is_pypy
+                or self.version_info[:2] != PYTHON_VERSION_TRIPLE[:2]
+            ) and PYTHON_VERSION_TRIPLE >= (3, 3):
+                # 3.3+ __build_class__() works only on bytecode
+                # that matches the CPython interpreter, so use
+                # Darius' version instead.  Down the line we will
+                # try to do this universally, but it is tricky:
+                retval = build_class(self.vm.opc, *pos_args, **named_args)
+                self.vm.push(retval)
+                return
+            else:
+                # Use builtin __build_class__(). However for that, we need a native function.
+                # This is wrong though in that we won't trace into __init__().
+                init_fn = pos_args[0]
+                if isinstance(init_fn, Function):
+                    native_fn = self.vm.fn2native.get(init_fn) or init_fn._func
+                    if native_fn is not None:
+                        pos_args[0] = native_fn
+        retval = func(*pos_args, **named_args)
+        self.vm.frame.stack.append(retval)
+
+    def call_function_from_stack(self, start: int, kwnames=()) -> Any:
+        """Call the callable at stack[start - 1] with the arguments in
+        stack[start:], and replace them all with what it returns. The last
+        len(kwnames) arguments are keyword arguments named by the tuple
+        `kwnames`; the rest are positional.
+
+        An interpreted function run in the loop of the caller binds its
+        arguments where they are on the stack; see
+        xpython.callargs.BindingPlan.bind_stack().
+        """
+        stack = self.vm.frame.stack
+        func = stack[start - 1]
+        if func.__class__ is Function and self.vm.inline_calls:
+            frame = func.inline_call_frame_from_stack(stack, start, kwnames)
+            if frame is not None:
+                del stack[start - 1 :]
+                self.vm.call_frame = frame
+                return "call"
+        if kwnames:
+            end = len(stack) - len(kwnames)
+            pos_args = stack[start:end]
+            named_args = dict(zip(kwnames, stack[end:]))
+        else:
+            pos_args = stack[start:]
+            named_args = {}
+        del stack[start - 1 :]
+        return self.call_function_with_args_resolved(func, pos_args, named_args)
+
+    def load_method(self, name):
+        """Replace TOS, an object whose attribute `name` is about to be
+        called, with two items: the function for the method and the
+        object, when the method is a pyobj.Function in a class of the
+        object; otherwise the attribute and None. call_method() or
+        ByteOp37.CALL_METHOD then calls the function with the object as
+        the first argument, so no bound method is made.
+
+        This is LOAD_METHOD, and LOAD_ATTR before 3.7 when
+        DecodedCode.method_loads says it is for a call; see
+        xpython.methodcache.
+        """
+        stack = self.vm.frame.stack
+        obj = stack[-1]
+        cache = self.method_cache.get(name)
+        if cache is None:
+            cache = self.method_cache[name] = MethodCache(self.vm, name)
+        func = cache.lookup(obj)
+        if func is None:
+            stack[-1] = getattr(obj, name)
+            stack.append(None)
+        else:
+            stack[-1] = func
+            stack.append(obj)
+
+    def call_method(self, argc: int) -> Any:
+        """Call what load_method() pushed, with arguments given as for
+        CALL_FUNCTION before 3.6: the low byte of argc is the number of
+        positional arguments, the high byte the number of keyword
+        arguments, each of which is a name and a value on the stack."""
+        stack = self.vm.frame.stack
+        len_kw, len_pos = divmod(argc, 256)
+        start = len(stack) - len_pos - 2 * len_kw - 1
+        if stack[start] is None:
+            # Not a method, so there is no object to pass.
+            del stack[start]
+        kwnames = ()
+        if len_kw:
+            pairs = stack[-2 * len_kw :]
+            del stack[-2 * len_kw :]
+            kwnames = tuple(pairs[0::2])
+            stack.extend(pairs[1::2])
+        return self.call_function_from_stack(start, kwnames)
 
     def call_function(self, argc: int, var_args, keyword_args: dict) -> Any:
         named_args = {}
@@ -432,57 +660,24 @@ class ByteOpBase(object):
 
     def inplaceOperator(self, op):
         x, y = self.vm.popn(2)
-        if op == "POWER":
-            x **= y
-        elif op == "MULTIPLY":
-            x *= y
-        elif op == "DIVIDE":
-            # Overwritten __div__ is not picked up by x //= y
-            # which seems to puck up FLOOR_DIVIDE
-            # See Python 2.7 test_augassign.py
-            if hasattr(x, "__idiv__"):
-                x = x.__idiv__(y)
-            else:
-                x //= y
-        elif op == "FLOOR_DIVIDE":
-            x //= y
-        elif op == "TRUE_DIVIDE":
-            x /= y
-        elif op == "MODULO":
-            x %= y
-        elif op == "ADD":
-            x += y
-        elif op == "SUBTRACT":
-            x -= y
-        elif op == "LSHIFT":
-            x <<= y
-        elif op == "RSHIFT":
-            x >>= y
-        elif op == "AND":
-            x &= y
-        elif op == "XOR":
-            x ^= y
-        elif op == "OR":
-            x |= y
-        # 3.5 on
-        elif op == "MATRIX_MULTIPLY":
-            operator.imatmul(x, y)
-        else:  # pragma: no cover
+        if op not in INPLACE_OPERATORS:  # pragma: no cover
             raise self.PyVMError("Unknown in-place operator: %r" % op)
-        self.vm.push(x)
+        self.vm.push(INPLACE_OPERATORS[op](x, y))
 
     def lookup_name(self, name):
         """Returns the value in the current frame associated for name"""
         frame = self.vm.frame
-        if name in frame.f_locals:
-            val = frame.f_locals[name]
-        elif name in frame.f_globals:
-            val = frame.f_globals[name]
-        elif name in frame.f_builtins:
-            val = frame.f_builtins[name]
-        else:
-            raise NameError("name '%s' is not defined" % name)
-        return val
+        f_locals = frame.f_locals
+        if name in f_locals:
+            return f_locals[name]
+        f_globals = frame.f_globals
+        # At module level the locals are the globals; don't look twice.
+        if f_globals is not f_locals and name in f_globals:
+            return f_globals[name]
+        f_builtins = frame.f_builtins
+        if name in f_builtins:
+            return f_builtins[name]
+        raise NameError("name '%s' is not defined" % name)
 
     def print_item(self, item, to=None):
         if to is None:
@@ -523,5 +718,5 @@ class ByteOpBase(object):
             to.softspace = 0
 
     def unaryOperator(self, op):
-        x = self.vm.pop()
-        self.vm.push(UNARY_OPERATORS[op](x))
+        stack = self.vm.frame.stack
+        stack[-1] = UNARY_OPERATORS[op](stack[-1])
@@ -31,7 +31,7 @@ from xpython.byteop.byteop import (
     fmt_ternary_op,
     fmt_unary_op,
 )
-from xpython.pyobj import Cell, Function, traceback_from_frame
+from xpython.pyobj import UNBOUND, Cell, Function, Generator
 from xpython.vmtrace import PyVMEVENT_RETURN, PyVMEVENT_YIELD
 
 log = logging.getLogger(__name__)
@@ -40,24 +40,12 @@ log = logging.getLogger(__name__)
 COMPREHENSION_FN_NAMES = frozenset(("<setcomp>", "<dictcomp>", "<genexpr>"))
 
 
-def get_cell_name(vm, i: int):
-    # From LOAD_CLOSURE:
-    # The name of the variable is co_cellvars[i] if i is less
-    # than the length of co_cellvars. Otherwise it is co_freevars[i -len(co_cellvars)]
-    f_code = vm.frame.f_code
-    if i < len(f_code.co_cellvars):
-        return f_code.co_cellvars[i]
-    else:
-        var_idx = i - len(f_code.co_cellvars)
-        return f_code.co_freevars[var_idx]
-
-
 def fmt_store_deref(vm, int_arg, repr=repr):
     return " (%s)" % (vm.top())
 
 
 def fmt_load_deref(vm, int_arg, repr=repr):
-    return " (%s)" % (vm.frame.cells[get_cell_name(vm, int_arg)].get())
+    return " (%s)" % (vm.frame.cells[int_arg].contents)
 
 
 def fmt_call_function(vm, argc: int, repr=repr):
@@ -135,7 +123,7 @@ class ByteOp24(ByteOpBase):
         last_i = frame.f_lasti
         orig_opcode = frame.brkpt[last_i]
         orig_opname = vm.opc.opname[orig_opcode]
-        log.info("Breakpoint at offset %d instruction %s" % (last_i, orig_opname))
+        log.info("Breakpoint at offset %d instruction %s", last_i, orig_opname)
         (
             byte_name,
             byte_code,
@@ -146,9 +134,12 @@ class ByteOp24(ByteOpBase):
         ) = vm.parse_byte_and_args(orig_opcode, replay=True)
 
         if vm.callback:
+            # The callback may change locals through frame.f_locals.
+            frame.fast_to_locals()
             result = vm.callback(
                 "breakpoint", last_i, byte_name, byte_code, line_number, None, [], vm
             )
+            frame.locals_to_fast()
 
             # FIXME: DRY with vmtrace code
             if result:
@@ -186,32 +177,39 @@ class ByteOp24(ByteOpBase):
 
     def POP_TOP(self):
         "Removes the top-of-stack (TOS) item."
-        self.vm.pop()
+        self.vm.frame.stack.pop()
 
     def ROT_TWO(self):
         "Swaps the two top-most stack items."
-        a, b = self.vm.popn(2)
-        self.vm.push(b, a)
+        stack = self.vm.frame.stack
+        stack[-2], stack[-1] = stack[-1], stack[-2]
 
     def ROT_THREE(self):
         "Lifts second and third stack item one position up, moves top down to position three."
-        a, b, c = self.vm.popn(3)
-        self.vm.push(c, a, b)
+        stack = self.vm.frame.stack
+        stack[-3], stack[-2], stack[-1] = stack[-1], stack[-3], stack[-2]
 
     def ROT_FOUR(self):
         "Lifts second, third and forth stack item one position up, moves top down to position four."
-        a, b, c, d = self.vm.popn(4)
-        self.vm.push(d, a, b, c)
+        stack = self.vm.frame.stack
+        stack[-4], stack[-3], stack[-2], stack[-1] = (
+            stack[-1],
+            stack[-4],
+            stack[-3],
+            stack[-2],
+        )
 
     def DUP_TOP(self):
         """Duplicates the reference on top of the stack."""
-        self.vm.push(self.vm.top())
+        stack = self.vm.frame.stack
+        stack.append(stack[-1])
 
     # Unary operators are handled elsewhere
 
     def GET_ITER(self):
         """Implements TOS = iter(TOS)."""
-        self.vm.push(iter(self.vm.pop()))
+        stack = self.vm.frame.stack
+        stack[-1] = iter(stack[-1])
 
     # Binary operators are handled elsewhere
     # Inplace operators are handled elsewhere
@@ -219,8 +217,10 @@ class ByteOp24(ByteOpBase):
 
     def STORE_SUBSCR(self):
         """Implements TOS1[TOS] = TOS2."""
-        val, obj, subscr = self.vm.popn(3)
-        obj[subscr] = val
+        stack = self.vm.frame.stack
+        subscr = stack.pop()
+        obj = stack.pop()
+        obj[subscr] = stack.pop()
 
     def DELETE_SUBSCR(self):
         """Implements del TOS1[TOS]."""
@@ -253,7 +253,12 @@ class ByteOp24(ByteOpBase):
 
     def BREAK_LOOP(self):
         """Terminates a loop due to a break statement."""
-        return "break"
+        loop = self.vm.exit_loop()
+        if loop is None:
+            return "break"
+        self.vm.pop_block()
+        self.vm.unwind_block(loop)
+        self.vm.jump(loop.handler)
 
     def CONTINUE_LOOP(self, dest):
         """
@@ -266,8 +271,10 @@ class ByteOp24(ByteOpBase):
         # where to jump to, for return, it's the value to return.  It gets
         # pushed on the stack for both, so continue puts the jump destination
         # into return_value.
-        self.vm.return_value = dest
-        return "continue"
+        if self.vm.exit_loop() is None:
+            self.vm.return_value = dest
+            return "continue"
+        self.vm.jump(dest)
 
     def LIST_APPEND(self):
         """Calls list.append(TOS1, TOS). Used to implement list
@@ -287,7 +294,7 @@ class ByteOp24(ByteOpBase):
 
     def RETURN_VALUE(self):
         """Returns with TOS to the caller of the function."""
-        self.vm.return_value = self.vm.pop()
+        self.vm.return_value = self.vm.frame.stack.pop()
         if self.vm.frame.generator:
             self.vm.frame.generator.finished = True
         return "return"
@@ -296,7 +303,7 @@ class ByteOp24(ByteOpBase):
         """
         Pops TOS and yields it from a generator.
         """
-        self.vm.return_value = self.vm.pop()
+        self.vm.return_value = self.vm.frame.stack.pop()
         return "yield"
 
     def IMPORT_STAR(self):
@@ -386,7 +393,8 @@ class ByteOp24(ByteOpBase):
         """Implements name = TOS. namei is the index of name in the attribute
         co_names of the code object. The compiler tries to use STORE_LOCAL or
         STORE_GLOBAL if possible."""
-        self.vm.frame.f_locals[name] = self.vm.pop()
+        frame = self.vm.frame
+        frame.f_locals[name] = frame.stack.pop()
 
     def DELETE_GLOBAL(self, name):
         """Implements del name, where name in global."""
@@ -400,9 +408,8 @@ class ByteOp24(ByteOpBase):
         """Unpacks TOS into count individual values, which are put onto the
         stack right-to-left.
         """
-        seq = self.vm.pop()
-        for x in reversed(seq):
-            self.vm.push(x)
+        stack = self.vm.frame.stack
+        stack.extend(reversed(stack.pop()))
 
     def DUP_TOPX(self, count):
         """
@@ -415,8 +422,9 @@ class ByteOp24(ByteOpBase):
 
     def STORE_ATTR(self, name):
         """Implements TOS.name = TOS1, where namei is the index of name in co_names."""
-        val, obj = self.vm.popn(2)
-        setattr(obj, name, val)
+        stack = self.vm.frame.stack
+        obj = stack.pop()
+        setattr(obj, name, stack.pop())
 
     def DELETE_ATTR(self, name):
         """Implements del TOS.name, using namei as index into co_names."""
@@ -426,11 +434,11 @@ class ByteOp24(ByteOpBase):
     def STORE_GLOBAL(self, name):
         "Works as STORE_NAME, but stores the name as a global."
         f = self.vm.frame
-        f.f_globals[name] = self.vm.pop()
+        f.f_globals[name] = f.stack.pop()
 
     def LOAD_CONST(self, const):
         """Pushes co_consts[consti] onto the stack."""
-        self.vm.push(const)
+        self.vm.frame.stack.append(const)
 
     def LOAD_NAME(self, name):
         """Pushes the value associated with co_names[namei] onto the stack."""
@@ -439,7 +447,7 @@ class ByteOp24(ByteOpBase):
         # FIXME: Better would be to separate NameErrors caused by
         # interpreting bytecode versus NameErrors that are caused as a result of bugs
         # in the interpreter.
-        self.vm.push(self.lookup_name(name))
+        self.vm.frame.stack.append(self.lookup_name(name))
         # try:
         #     self.lookup_name(name)
         # except NameError:
@@ -483,10 +491,15 @@ class ByteOp24(ByteOpBase):
         """Replaces TOS with getattr(TOS, co_names[namei]).
 
         Note: name = co_names[namei] set in parse_byte_and_args()
+
+        When the attribute is only called, as in "obj.name(...)", this is
+        done as LOAD_METHOD is from 3.7; see DecodedCode.method_loads.
         """
-        obj = self.vm.pop()
-        val = getattr(obj, name)
-        self.vm.push(val)
+        frame = self.vm.frame
+        if frame.f_lasti in frame.decoded.method_loads:
+            return self.load_method(name)
+        stack = frame.stack
+        stack[-1] = getattr(stack[-1], name)
 
     # Comparisons
 
@@ -507,8 +520,32 @@ class ByteOp24(ByteOpBase):
 
     def COMPARE_OP(self, opname):
         """Performs a Boolean operation. The operation name can be found in cmp_op[opname]."""
-        x, y = self.vm.popn(2)
-        self.vm.push(self.COMPARE_OPERATORS[opname](x, y))
+        stack = self.vm.frame.stack
+        y = stack.pop()
+        stack[-1] = self.COMPARE_OPERATORS[opname](stack[-1], y)
+
+    # Sequences of instructions that the "closure" engine runs as a single
+    # superinstruction; see xpython.vmclosure. They were picked with
+    # admin-tools/mine-opcode-pairs.py. Later versions adjust the list to
+    # their opcodes.
+    SUPERINSTRUCTIONS = (
+        ("LOAD_FAST", "LOAD_CONST", "BINARY_ADD"),
+        ("LOAD_FAST", "LOAD_CONST", "BINARY_SUBTRACT"),
+        ("LOAD_FAST", "LOAD_CONST", "BINARY_MULTIPLY"),
+        ("LOAD_FAST", "LOAD_CONST", "INPLACE_ADD"),
+        ("LOAD_FAST", "LOAD_CONST", "INPLACE_SUBTRACT"),
+        ("LOAD_FAST", "LOAD_FAST"),
+        ("LOAD_FAST", "LOAD_CONST"),
+        ("LOAD_FAST", "LOAD_ATTR"),
+        ("STORE_FAST", "LOAD_FAST"),
+        ("LOAD_CONST", "LOAD_CONST"),
+        ("LOAD_NAME", "LOAD_CONST"),
+        ("STORE_NAME", "LOAD_CONST"),
+        ("STORE_NAME", "LOAD_NAME"),
+        ("LOAD_GLOBAL", "CALL_FUNCTION"),
+        ("COMPARE_OP", "JUMP_IF_FALSE"),
+        ("COMPARE_OP", "JUMP_IF_TRUE"),
+    )
 
     # Imports
 
@@ -580,8 +617,7 @@ class ByteOp24(ByteOpBase):
 
         Note: jump = delta + f.f_lasti set in parse_byte_and_args()
         """
-        val = self.vm.top()
-        if val:
+        if self.vm.frame.stack[-1]:
             self.vm.jump(jump_offset)
 
     def JUMP_IF_FALSE(self, jump_offset):
@@ -591,8 +627,7 @@ class ByteOp24(ByteOpBase):
 
         Note: jump = delta + f.f_lasti set in parse_byte_and_args()
         """
-        val = self.vm.top()
-        if not val:
+        if not self.vm.frame.stack[-1]:
             self.vm.jump(jump_offset)
 
     def JUMP_ABSOLUTE(self, target):
@@ -611,12 +646,15 @@ class ByteOp24(ByteOpBase):
         Note: jump = delta + f.f_lasti set in parse_byte_and_args()
         """
 
-        iterobj = self.vm.top()
+        stack = self.vm.frame.stack
+        if stack[-1].__class__ is Generator:
+            why = self.vm.resume_generator(stack[-1], None)
+            if why:
+                return why
         try:
-            v = next(iterobj)
-            self.vm.push(v)
+            stack.append(next(stack[-1]))
         except StopIteration:
-            self.vm.pop()
+            stack.pop()
             self.vm.jump(jump_offset)
 
     def LOAD_GLOBAL(self, name):
@@ -632,7 +670,7 @@ class ByteOp24(ByteOpBase):
             val = f.f_builtins[name]
         else:
             raise NameError("global name '%s' is not defined" % name)
-        self.vm.push(val)
+        f.stack.append(val)
 
     def SETUP_LOOP(self, jump_offset):
         """
@@ -641,7 +679,7 @@ class ByteOp24(ByteOpBase):
 
         Note: jump = delta + f.f_lasti set in parse_byte_and_args()
         """
-        self.vm.push_block("loop", jump_offset)
+        self.vm.setup_block("loop", jump_offset)
 
     def SETUP_EXCEPT(self, jump_offset):
         """
@@ -651,7 +689,7 @@ class ByteOp24(ByteOpBase):
         Note: jump = delta + f.f_lasti set in parse_byte_and_args()
         """
 
-        self.vm.push_block("setup-except", jump_offset)
+        self.vm.setup_block("setup-except", jump_offset)
 
     def SETUP_FINALLY(self, jump_offset):
         """
@@ -660,15 +698,16 @@ class ByteOp24(ByteOpBase):
 
         Note: jump = delta + f.f_lasti set in parse_byte_and_args()
         """
-        self.vm.push_block("finally", jump_offset)
+        self.vm.setup_block("finally", jump_offset)
 
     def STORE_MAP(self):
         """
         Store a key and value pair in a dictionary. Pops the key and value while leaving the dictionary on the stack.
         """
-        the_map, val, key = self.vm.popn(3)
-        the_map[key] = val
-        self.vm.push(the_map)
+        stack = self.vm.frame.stack
+        key = stack.pop()
+        val = stack.pop()
+        stack[-1][key] = val
 
     # some (but not all) Names
 
@@ -676,21 +715,41 @@ class ByteOp24(ByteOpBase):
         """
         Pushes a reference to the local co_varnames[var_num] onto the stack.
         """
-        if name in self.vm.frame.f_locals:
-            val = self.vm.frame.f_locals[name]
+        frame = self.vm.frame
+        fast_locals = frame.fast_locals
+        if fast_locals is None:
+            # Code that isn't optimized keeps its locals in a dict.
+            val = frame.f_locals.get(name, UNBOUND)
         else:
+            val = fast_locals[frame.decoded.varindex[name]]
+        if val is UNBOUND:
             raise UnboundLocalError(
                 "local variable '%s' referenced before assignment" % name
             )
-        self.vm.push(val)
+        frame.stack.append(val)
 
     def STORE_FAST(self, var_num):
         """Stores TOS into the local co_varnames[var_num]."""
-        self.vm.frame.f_locals[var_num] = self.vm.pop()
+        frame = self.vm.frame
+        fast_locals = frame.fast_locals
+        if fast_locals is None:
+            frame.f_locals[var_num] = frame.stack.pop()
+        else:
+            fast_locals[frame.decoded.varindex[var_num]] = frame.stack.pop()
 
     def DELETE_FAST(self, var_num):
         """Deletes local co_varnames[var_num]."""
-        del self.vm.frame.f_locals[var_num]
+        frame = self.vm.frame
+        fast_locals = frame.fast_locals
+        if fast_locals is None:
+            del frame.f_locals[var_num]
+            return
+        i = frame.decoded.varindex[var_num]
+        if fast_locals[i] is UNBOUND:
+            raise UnboundLocalError(
+                "local variable '%s' referenced before assignment" % var_num
+            )
+        fast_locals[i] = UNBOUND
 
     def LOAD_CLOSURE(self, i):
         """
@@ -698,21 +757,24 @@ class ByteOp24(ByteOpBase):
         free variable storage. The name of the variable is co_cellvars[i] if i is less
         than the length of co_cellvars. Otherwise it is co_freevars[i -len(co_cellvars)].
         """
-        self.vm.push(self.vm.frame.cells[i])
+        frame = self.vm.frame
+        frame.stack.append(frame.cells[i])
 
-    def LOAD_DEREF(self, name):
+    def LOAD_DEREF(self, i):
         """
         Loads the cell contained in slot i of the cell and free variable
         storage. Pushes a reference to the object the cell contains on the
         stack.
         """
-        self.vm.push(self.vm.frame.cells[name].get())
+        frame = self.vm.frame
+        frame.stack.append(frame.cells[i].contents)
 
-    def STORE_DEREF(self, name):
+    def STORE_DEREF(self, i):
         """
         Stores TOS into the cell contained in slot i of the cell and free variable storage.
         """
-        self.vm.frame.cells[name].set(self.vm.pop())
+        frame = self.vm.frame
+        frame.cells[i].contents = frame.stack.pop()
 
     # End names
 
@@ -851,9 +913,17 @@ class ByteOp24(ByteOpBase):
         and pushes the return value returned by the callable object.
         """
         try:
+            frame = self.vm.frame
+            if frame.f_lasti in frame.decoded.method_calls:
+                # The callable is from a LOAD_ATTR done as LOAD_METHOD.
+                return self.call_method(argc)
+            if argc < 256:
+                # Positional arguments only.
+                stack = frame.stack
+                return self.call_function_from_stack(len(stack) - argc)
             return self.call_function(argc, var_args=[], keyword_args={})
         except TypeError as exc:
-            tb = self.vm.last_traceback = traceback_from_frame(self.vm.frame)
+            tb = self.vm.traceback_here(self.vm.frame, exc)
             self.vm.last_exception = (TypeError, exc, tb)
             return "exception"
 
@@ -26,6 +26,16 @@ def fmt_map_add(vm, arg, repr=repr):
 
 
 class ByteOp27(ByteOp26):
+    # JUMP_IF_FALSE and JUMP_IF_TRUE have given way to the POP_ variants.
+    SUPERINSTRUCTIONS = tuple(
+        sequence
+        for sequence in ByteOp26.SUPERINSTRUCTIONS
+        if sequence[-1] not in ("JUMP_IF_FALSE", "JUMP_IF_TRUE")
+    ) + (
+        ("COMPARE_OP", "POP_JUMP_IF_FALSE"),
+        ("COMPARE_OP", "POP_JUMP_IF_TRUE"),
+    )
+
     def __init__(self, vm):
         super(ByteOp27, self).__init__(vm)
         self.stack_fmt["SET_ADD"] = fmt_set_add
@@ -138,9 +148,9 @@ class ByteOp27(ByteOp26):
             self.convert_method_native_func(self.vm.frame, context_manager.__enter__)
         finally_block = context_manager.__enter__()
         if self.version_info[:2] < (3, 0):
-            self.vm.push_block("with", delta)
+            self.vm.setup_block("with", delta)
         else:
-            self.vm.push_block("finally", delta)
+            self.vm.setup_block("finally", delta)
         self.vm.push(finally_block)
 
     def BUILD_SET(self, count):
@@ -154,14 +164,12 @@ class ByteOp27(ByteOp26):
 
     def POP_JUMP_IF_TRUE(self, target):
         """If TOS is true, sets the bytecode counter to target. TOS is popped."""
-        val = self.vm.pop()
-        if val:
+        if self.vm.frame.stack.pop():
             self.vm.jump(target)
 
     def POP_JUMP_IF_FALSE(self, target):
         """If TOS is false, sets the bytecode counter to target. TOS is popped."""
-        val = self.vm.pop()
-        if not val:
+        if not self.vm.frame.stack.pop():
             self.vm.jump(target)
 
     def JUMP_IF_TRUE_OR_POP(self, target):
@@ -169,19 +177,19 @@ class ByteOp27(ByteOp26):
         If TOS is true, sets the bytecode counter to target and leaves TOS
         on the stack. Otherwise (TOS is false), TOS is popped.
         """
-        val = self.vm.top()
-        if val:
+        stack = self.vm.frame.stack
+        if stack[-1]:
             self.vm.jump(target)
         else:
-            self.vm.pop()
+            stack.pop()
 
     def JUMP_IF_FALSE_OR_POP(self, target):
         """
         If TOS is false, sets the bytecode counter to target and leaves TOS
         on the stack. Otherwise (TOS is true), TOS is popped.
         """
-        val = self.vm.top()
-        if not val:
+        stack = self.vm.frame.stack
+        if not stack[-1]:
             self.vm.jump(target)
         else:
-            self.vm.pop()
+            stack.pop()
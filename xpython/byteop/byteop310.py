@@ -96,9 +96,6 @@ class ByteOp310(ByteOp39):
         if argc == 0 and code.co_name in COMPREHENSION_FN_NAMES:
             fn_vm.has_dot_zero = True
 
-        if fn_vm._func:
-            self.vm.fn2native[fn_vm] = fn_vm._func
-
         self.vm.push(fn_vm)
 
     # New in 3.10
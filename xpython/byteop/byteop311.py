@@ -10,9 +10,13 @@
 from typing import Any
 from xpython.byteop.byteop24 import Version_info
 from xpython.byteop.byteop310 import ByteOp310
-from xpython.pyobj import traceback_from_frame
 
 class ByteOp311(ByteOp310):
+    # Exception handlers come from the exception table rather than from
+    # jump instructions, so we can't tell whether a sequence can be
+    # entered in the middle. Don't fuse anything.
+    SUPERINSTRUCTIONS = ()
+
     def __init__(self, vm):
         super(ByteOp310, self).__init__(vm)
         self.hexversion = 0x30A00F0
@@ -91,7 +95,7 @@ class ByteOp311(ByteOp310):
         try:
             return self.call_function38(argc)
         except TypeError as exc:
-            tb = self.vm.last_traceback = traceback_from_frame(self.vm.frame)
+            tb = self.vm.traceback_here(self.vm.frame, exc)
             self.vm.last_exception = (TypeError, exc, tb)
             return "exception"
 
@@ -160,12 +164,51 @@ class ByteOp311(ByteOp310):
         self.vm.set(0, stack_i)
 
 
+    def PUSH_EXC_INFO(self):
+        """
+        Pops a value from the stack. Pushes the current exception to the
+        top of the stack. Pushes the value originally popped back to the
+        stack. Used in exception handlers.
+        """
+        vm = self.vm
+        value = vm.pop()
+        vm.push(vm.exc_info, value)
+        vm.exc_info = vm.frame.handled
+
+    def POP_EXCEPT(self):
+        """
+        Pops a value from the stack, which is used to restore the
+        exception state.
+        """
+        exc_info = self.vm.exc_info = self.vm.pop()
+        if exc_info is not None:
+            value = exc_info[0]
+            self.vm.last_exception = (type(value), value, value.__traceback__)
+            self.vm.frame.handled = exc_info
+
+    def RERAISE(self, oparg: int):
+        """
+        Re-raises the exception currently on top of the stack. If oparg
+        is non-zero, pops an additional value from the stack which is
+        used to set f_lasti of the current frame.
+        """
+        # CPython sets the frame's last instruction from the index that
+        # oparg picks out, which is where the exception was first raised.
+        # The handler is still looked up from the RERAISE itself, and the
+        # frame's traceback entry already has that instruction, so the VM
+        # leaves f_lasti alone.
+        value = self.vm.pop()
+        self.vm.last_exception = (type(value), value, value.__traceback__)
+        return "reraise"
+
     def CHECK_EXC_MATCH(self):
         """
-        To be continued...
+        Performs exception matching for except. Tests whether TOS1 is an
+        exception matching TOS. Pops TOS and pushes the boolean result of
+        the test.
         """
-        # FIXME
-        raise self.vm.PyVMError("KW_NAMES not implemented")
+        right = self.vm.pop()
+        self.vm.push(isinstance(self.vm.top(), right))
 
     def JUMP_BACKWARD(self, delta: int):
         """
@@ -187,7 +230,7 @@ class ByteOp311(ByteOp310):
         If TOS is true, increments the bytecode counter by delta. TOS is popped.
         """
         val = self.vm.pop()
-        if val == True:  # noqa
+        if val:
             self.vm.jump(delta)
 
 
@@ -196,7 +239,7 @@ class ByteOp311(ByteOp310):
         If TOS is true, decrements the bytecode counter by delta. TOS is popped.
         """
         val = self.vm.pop()
-        if val == True:  # noqa
+        if val:
             self.vm.jump(-delta)
 
 
@@ -205,7 +248,7 @@ class ByteOp311(ByteOp310):
         If TOS is false, increments the bytecode counter by delta. TOS is popped.
         """
         val = self.vm.pop()
-        if val == False:  # noqa
+        if not val:
             self.vm.jump(delta)
 
 
@@ -214,7 +257,7 @@ class ByteOp311(ByteOp310):
         If TOS is false, decrements the bytecode counter by delta. TOS is popped.
         """
         val = self.vm.pop()
-        if val == False:  # noqa
+        if not val:
             self.vm.jump(-delta)
 
 
@@ -263,10 +306,10 @@ class ByteOp311(ByteOp310):
 
         The oparg is now a relative delta rather than an absolute target.
         """
-        val = self.vm.top()
-        if val == True:  # noqa
+        if self.vm.top():
             self.vm.jump(delta)
-        self.vm.pop()
+        else:
+            self.vm.pop()
 
 
     def RESUME(self, where: int):
@@ -44,7 +44,10 @@ class ByteOp32(ByteOp27):
         self.version_info = Version_info(3, 2, 6, "final", 0)
 
     def convert_native_to_Function(self, frame, func):
+        """Native functions, such as the methods of contextlib's context
+        managers, are called as they are rather than interpreted."""
         assert inspect.isfunction(func) or isinstance(func, Function)
+        return func
 
     def DUP_TOP_TWO(self):
         """Duplicates the reference on top of the stack."""
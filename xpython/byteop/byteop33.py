@@ -137,6 +137,10 @@ class ByteOp33(ByteOp32):
         u = self.vm.pop()
         x = self.vm.top()
 
+        if x.__class__ is Generator:
+            why = self.vm.resume_generator(x, u)
+            if why:
+                return why
         try:
             if not isinstance(x, Generator) or u is None:
                 # Call next on iterators.
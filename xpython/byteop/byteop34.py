@@ -24,13 +24,14 @@ class ByteOp34(ByteOp33):
 
     # New in 3.4
 
-    def LOAD_CLASSDEREF(self, count):
+    def LOAD_CLASSDEREF(self, i):
         """
         Much like LOAD_DEREF but first checks the locals dictionary before
         consulting the cell. This is used for loading free variables in class
         bodies.
         """
-        self.vm.push(self.vm.frame.cells[count].get())
+        frame = self.vm.frame
+        frame.stack.append(frame.cells[i].contents)
 
     ##############################################################################
     # Order of function here is the same as in:
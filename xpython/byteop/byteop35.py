@@ -169,7 +169,7 @@ class ByteOp35(ByteOp34):
             fourth, third, second = self.vm.popn(3)
             tp, exc, tb = self.vm.popn(3)
             exit_method = self.vm.pop()
-            self.vm.push(None)
+            self.vm.push(tp, exc, tb, None)
             self.vm.push(fourth, third, second)
             block = self.vm.pop_block()
             assert block.type == "except-handler"
@@ -293,6 +293,6 @@ class ByteOp35(ByteOp34):
         pos_args = self.vm.popn(len_pos)
         pos_args.extend(var_args)
         func = self.vm.pop()
-        self.call_function_with_args_resolved(
+        return self.call_function_with_args_resolved(
             func, pos_args=pos_args, named_args=keyword_args
         )
@@ -78,15 +78,9 @@ class ByteOp36(ByteOp35):
         self.version_info = Version_info(3, 6, 14, "final", 0)
 
     def call_function_kw(self, argc: int):
-        namedargs = {}
-        namedargs_tup = self.vm.pop()
-        for name in reversed(namedargs_tup):
-            namedargs[name] = self.vm.pop()
-
-        lenPos = argc - len(namedargs_tup)
-        posargs = self.vm.popn(lenPos)
-        func = self.vm.pop()
-        self.call_function_with_args_resolved(func, posargs, namedargs)
+        stack = self.vm.frame.stack
+        kwnames = stack.pop()
+        return self.call_function_from_stack(len(stack) - argc, kwnames)
 
     ##############################################################################
     # Order of function here is the same as in:
@@ -206,9 +200,6 @@ class ByteOp36(ByteOp35):
         if argc == 0 and code.co_name in COMPREHENSION_FN_NAMES:
             fn_vm.has_dot_zero = True
 
-        if fn_vm._func:
-            self.vm.fn2native[fn_vm] = fn_vm._func
-
         self.vm.push(fn_vm)
 
     # New in 3.6...
@@ -284,7 +275,7 @@ class ByteOp36(ByteOp35):
         namedargs = self.vm.pop() if flags & 1 else {}
         posargs = self.vm.pop()
         func = self.vm.pop()
-        self.call_function_with_args_resolved(func, posargs, namedargs)
+        return self.call_function_with_args_resolved(func, posargs, namedargs)
 
     def SETUP_ANNOTATIONS(self):
         """
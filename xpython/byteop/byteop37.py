@@ -58,19 +58,13 @@ class ByteOp37(ByteOp36):
         NULL and the object return by the attribute lookup are pushed.
 
         rocky: In our implementation in Python we don't have NULL: all
-        stack entries have *some* value. So instead we'll push another
-        item: the status. Also, instead of pushing the unbound method
-        and self, we will pass the bound method, since that is what we
-        have here. So TOS (self) is not pushed back onto the stack.
+        stack entries have *some* value. So we use None, as PUSH_NULL
+        does, and put it above the object rather than below it, so
+        that the thing to call is always the lower of the two items.
+        The methods we push unbound are the pyobj.Functions of classes
+        made by the VM; see ByteOpBase.load_method().
         """
-        TOS = self.vm.pop()
-        if hasattr(TOS, name):
-            # FIXME: check that gettr(TO, name) is a method
-            self.vm.push(getattr(TOS, name))
-            self.vm.push("LOAD_METHOD lookup success")
-        else:
-            self.vm.push("fill in attribute method lookup")
-            self.vm.push(None)
+        self.load_method(name)
 
     def CALL_METHOD(self, count):
         """Calls a method. argc is the number of positional
@@ -81,16 +75,13 @@ class ByteOp37(ByteOp36):
         method object or NULL and an arbitrary callable). All of them
         are popped and the return value is pushed.
 
-        rocky: In our setting, before "self" we have an additional
-        item which is the status of the LOAD_METHOD. There is no way
-        in Python to represent a value outside of a Python value which
-        you can do in C, and is in effect what NULL is.
+        As described in LOAD_METHOD, here the two items are either an
+        unbound method and self, or a callable and None.
         """
-        posargs = self.vm.popn(count)
-        is_success = self.vm.pop()
-        if is_success:
-            func = self.vm.pop()
-            self.call_function_with_args_resolved(func, posargs, {})
-        else:
-            # FIXME: do something else
-            raise self.vm.PyVMError("CALL_METHOD not implemented yet")
+        stack = self.vm.frame.stack
+        start = len(stack) - count - 1
+        if stack[start] is None:
+            # Not a method, so there is no object to pass.
+            del stack[start]
+        # Otherwise the object is the first argument, below the others.
+        return self.call_function_from_stack(start)
@@ -52,32 +52,16 @@ class ByteOp37PyPy(ByteOp37, ByteOpPyPy):
         """
         argc has a count of the number of keyword parameters.
         TOS has a tuple of keyword parameter names. Below that are the
-        keyword values. After that is the a cached method which in our
-        case is garbage. After that is the method to call.
+        keyword values. Below those are the two items pushed by
+        LOAD_METHOD: the method to call and either self or None.
         """
 
-        # We are going to access parameter off of the stack which is
-        # has the last parameter closest to the top.
-        # Reverse keyword names in the tuple match our access pattern.
-        kw_names = self.vm.pop()
+        stack = self.vm.frame.stack
+        kw_names = stack.pop()
         assert isinstance(kw_names, tuple)
-        kw_names = list(reversed(kw_names))
-        kwarg_count = len(kw_names)
-
-        assert argc >= kwarg_count
-        pos_argc = argc - kwarg_count
-        keyword_args = {}
-
-        for i in range(kwarg_count):
-            param_value = self.vm.pop()
-            keyword_args[kw_names[i]] = param_value
-
-        pos_args = []
-        for i in range(pos_argc):
-            pos_args.append(self.vm.pop())
-
-        pos_args = list(reversed(pos_args))
-
-        self.vm.pop()  # cached method slot is not used here.
-        func = self.vm.pop()
-        return self.call_function_with_args_resolved(func, pos_args, keyword_args)
+        assert argc >= len(kw_names)
+        start = len(stack) - argc - 1
+        if stack[start] is None:
+            # Not a method, so there is no object to pass.
+            del stack[start]
+        return self.call_function_from_stack(start, kw_names)
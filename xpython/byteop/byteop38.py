@@ -26,6 +26,40 @@ class ByteOp38(ByteOp37):
 
     # Changed in 3.8...
 
+    def WITH_CLEANUP_FINISH(self):
+        """Pops exception type and result of "exit" function call from the stack.
+
+        If the stack represents an exception, and the function call
+        returns a true value, the exception handler block made for the
+        exception is removed, and NULL is pushed so that END_FINALLY
+        goes on as if there had been no exception.
+        """
+        exit_result = self.vm.pop()
+        exception = self.vm.pop()
+        if exception is not None and exit_result:
+            block = self.vm.pop_block()
+            assert block.type == "except-handler"
+            self.vm.unwind_block(block)
+            self.vm.push(None)
+
+    def POP_EXCEPT(self):
+        """
+        Removes one block from the block stack. The popped block must be an
+        exception handler block, as implicitly created when entering an except
+        handler. The three values on top of the frame stack are popped and
+        used to restore the exception state.
+
+        Values below those are left alone: a "return" in the handler has put
+        the value to return there, for after the "finally" part runs.
+        """
+        block = self.vm.pop_block()
+        if block.type != "except-handler":
+            raise self.vm.PyVMError(
+                "popped block is not an except handler; is %s" % block
+            )
+        tb, value, exctype = self.vm.popn(3)
+        self.vm.last_exception = exctype, value, tb
+
     # New in 3.8
 
     ##############################################################################
@@ -76,16 +110,13 @@ class ByteOp38(ByteOp37):
             why = None
         elif isinstance(v, int):
             self.vm.jump(v)
-            why = "return"
+            why = None
         elif issubclass(v, BaseException):
             # from trepan.api import debug; debug()
             exctype = v
             val = self.vm.pop()
             tb = self.vm.pop()
             self.vm.last_exception = (exctype, val, tb)
-
-            raise self.vm.PyVMError("END_FINALLY not finished yet")
-            # FIXME: pop 3 more values
             why = "reraise"
         else:  # pragma: no cover
             raise self.vm.PyVMError("Confused END_FINALLY")
@@ -96,8 +127,9 @@ class ByteOp38(ByteOp37):
         increments bytecode counter by delta. Used for calling the
         finally block as a "subroutine".
         """
-        # Is it f_lasti or the one after that
-        self.vm.push(self.vm.frame.f_lasti)
+        frame = self.vm.frame
+        inst = self.vm.get_decoded(frame).instruction_at(frame.f_lasti)
+        self.vm.push(inst.next_offset)
         self.vm.jump(delta)
 
     def POP_FINALLY(self, preserve_tos):
@@ -20,6 +20,6 @@ class ByteOp38PyPy(ByteOp38, ByteOpPyPy):
         Note: jump = delta + f.f_lasti set in parse_byte_and_args()
         """
 
-        self.vm.push_block("setup-except", jump_offset)
+        self.vm.setup_block("setup-except", jump_offset)
 
     CALL_METHOD_KW = ByteOp37PyPy.CALL_METHOD_KW
@@ -2,7 +2,6 @@
 
 Specific PyPy versions i.e. PyPy 2.7, 3.2, 3.5-3.7 inherit this.
 """
-import inspect
 
 
 class ByteOpPyPy(object):
@@ -19,30 +18,24 @@ class ByteOpPyPy(object):
         """
         self.vm.jump(jump_offset)
 
-    # For Python 3.7 this is not correct
     def LOOKUP_METHOD(self, name):
         """
-        For now, we'll assume this is the same as LOAD_ATTR:
+        Like LOAD_METHOD in CPython 3.7: replaces TOS with either the
+        unbound method co_names[namei] and TOS, or getattr(TOS,
+        co_names[namei]) and None. See ByteOpBase.load_method().
 
-        Replaces TOS with getattr(TOS, co_names[namei]).
         Note: name = co_names[namei] set in parse_byte_and_args()
         """
-        obj = self.vm.pop()
-        val = getattr(obj, name)
-        self.vm.push(val)
-        if self.version_info[:2] >= (3, 7):
-            if inspect.isfunction(val) or inspect.isbuiltin(val):
-                self.vm.push("LOAD_METHOD lookup success")
-            else:
-                self.vm.push("fill in attribute method lookup")
+        self.load_method(name)
 
     def CALL_METHOD(self, argc: int):
         """
-        For now, we'll assume this is like CALL_FUNCTION:
-
-        Calls a callable object.
+        Calls what LOOKUP_METHOD pushed, passing the object as the first
+        argument when there is one.
         The low byte of argc indicates the number of positional
         arguments, the high byte the number of keyword arguments.
         ...
+
+        From 3.7, ByteOp37.CALL_METHOD is used instead.
         """
-        return self.call_function(argc, [], {})
+        return self.call_method(argc)
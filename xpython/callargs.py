@@ -0,0 +1,242 @@
+"""Binding the arguments of a call to the parameters of a function.
+
+The general way of doing this, getcallargs() from inspect or from our
+xpython.stdlib.inspect2 and inspect3, works out the signature of the
+function on every call and returns a dict, which the new frame then
+turns into its list of fast locals.
+
+A BindingPlan is worked out once from a function's code object, its
+defaults and its keyword-only defaults, and binds arguments straight into
+a list of fast locals. It takes positional arguments, defaults, *args,
+**kwargs, keyword-only arguments and, for 3.8 and later, positional-only
+arguments.
+
+A call opcode whose callee is an interpreted function has the plan bind
+the arguments where they are on the caller's stack (bind_stack()), with
+keyword arguments named by a tuple as in CPython's vectorcall, so no
+list of positional arguments or dict of keyword arguments is made for
+the call. A dict is made only for a function that takes **kwargs, and a
+tuple only for one that takes *args.
+
+When a call doesn't fit the function, the plan says so, and call_error()
+gives the TypeError that CPython 3 raises for it. Calls of functions
+whose parameters the plan can't handle go the general way: Python 2
+functions with tuple parameters, and code that isn't optimized.
+"""
+
+from xdis import CO_OPTIMIZED, CO_VARARGS, CO_VARKEYWORDS
+
+# The value of a fast local that is not bound; see Frame.fast_locals.
+UNBOUND = object()
+
+
+class BindingPlan(object):
+    """How to bind arguments to the parameters of a function with code
+    `code`, defaults `defaults` and keyword-only defaults `kwdefaults`."""
+
+    __slots__ = (
+        "code",
+        "defaults",
+        "kwdefaults",
+        "argcount",
+        "first_default",
+        "kwonly",
+        "posonlycount",
+        "varargs",
+        "varkw",
+        "keyword_index",
+        "unbound",
+    )
+
+    def __init__(self, code, defaults, kwdefaults):
+        self.code = code
+        self.defaults = defaults
+        self.kwdefaults = kwdefaults
+        varnames = code.co_varnames
+        # What the fast locals past the arguments start out as.
+        self.unbound = (UNBOUND,) * len(varnames)
+        argcount = self.argcount = code.co_argcount
+        self.first_default = argcount - len(defaults or ())
+        kwonlycount = getattr(code, "co_kwonlyargcount", 0)
+        # The keyword-only parameters with their index. Their defaults are
+        # looked up on each call, since __kwdefaults__ can be changed in
+        # place.
+        self.kwonly = [
+            (i, varnames[i]) for i in range(argcount, argcount + kwonlycount)
+        ]
+        i = argcount + kwonlycount
+        if code.co_flags & CO_VARARGS:
+            self.varargs = i
+            i += 1
+        else:
+            self.varargs = None
+        self.varkw = i if code.co_flags & CO_VARKEYWORDS else None
+        # The index of each parameter that can be passed by keyword.
+        posonlycount = self.posonlycount = getattr(code, "co_posonlyargcount", 0)
+        self.keyword_index = dict(
+            (varnames[i], i) for i in range(posonlycount, argcount + kwonlycount)
+        )
+
+    def bind(self, args, kwargs):
+        """Return the fast locals for a call with positional arguments
+        `args` and keyword arguments `kwargs`, or None if they don't fit
+        the parameters."""
+        return self.bind_keywords(list(args), kwargs.items() if kwargs else ())
+
+    def bind_stack(self, stack, start, kwnames):
+        """Return the fast locals for a call whose arguments are
+        stack[start:], or None if they don't fit the parameters.
+
+        As in CPython's vectorcall, the last len(kwnames) of the arguments
+        are keyword arguments named by the tuple `kwnames`, and the rest
+        are positional. The stack is left as it is.
+        """
+        if kwnames:
+            end = len(stack) - len(kwnames)
+            return self.bind_keywords(stack[start:end], zip(kwnames, stack[end:]))
+        return self.bind_keywords(stack[start:], ())
+
+    def bind_keywords(self, fast_locals, keywords):
+        """Return the fast locals for a call with the positional arguments
+        in the list `fast_locals`, which becomes the fast locals, and the
+        keyword arguments in the (name, value) pairs of `keywords`; or None
+        if they don't fit the parameters."""
+        argcount = self.argcount
+        nargs = len(fast_locals)
+        if nargs > argcount:
+            if self.varargs is None:
+                return None
+            varargs = tuple(fast_locals[argcount:])
+            del fast_locals[argcount:]
+            fast_locals += self.unbound[argcount:]
+            fast_locals[self.varargs] = varargs
+        else:
+            fast_locals += self.unbound[nargs:]
+            if self.varargs is not None:
+                fast_locals[self.varargs] = ()
+        if self.varkw is not None:
+            # A dict is made only for functions that take **kwargs.
+            extra = fast_locals[self.varkw] = {}
+        if keywords:
+            keyword_index = self.keyword_index
+            for name, value in keywords:
+                i = keyword_index.get(name)
+                if i is None:
+                    if self.varkw is None or not isinstance(name, str):
+                        return None
+                    extra[name] = value
+                elif fast_locals[i] is UNBOUND:
+                    fast_locals[i] = value
+                else:
+                    return None
+        if nargs < argcount:
+            first_default = self.first_default
+            for i in range(nargs, argcount):
+                if fast_locals[i] is UNBOUND:
+                    if i < first_default:
+                        return None
+                    fast_locals[i] = self.defaults[i - first_default]
+        for i, name in self.kwonly:
+            if fast_locals[i] is UNBOUND:
+                if not self.kwdefaults or name not in self.kwdefaults:
+                    return None
+                fast_locals[i] = self.kwdefaults[name]
+        return fast_locals
+
+    def call_error(self, name, args, kwargs):
+        """Return the TypeError that CPython raises for a call with
+        positional arguments `args` and keyword arguments `kwargs`, which
+        bind() has found don't fit the parameters. `name` is what the
+        message calls the function."""
+        varnames = self.code.co_varnames
+        argcount = self.argcount
+        nargs = len(args)
+        bound = set(range(min(nargs, argcount)))
+        # The checks are made in the order CPython makes them.
+        for keyword in kwargs:
+            if not isinstance(keyword, str):
+                return TypeError("%s() keywords must be strings" % name)
+            i = self.keyword_index.get(keyword)
+            if i is None:
+                if self.varkw is not None:
+                    continue
+                posonly = [
+                    var for var in varnames[: self.posonlycount] if var in kwargs
+                ]
+                if posonly:
+                    return TypeError(
+                        "%s() got some positional-only arguments passed as "
+                        "keyword arguments: '%s'" % (name, ", ".join(posonly))
+                    )
+                return TypeError(
+                    "%s() got an unexpected keyword argument '%s'" % (name, keyword)
+                )
+            if i in bound:
+                return TypeError(
+                    "%s() got multiple values for argument '%s'" % (name, keyword)
+                )
+            bound.add(i)
+        if nargs > argcount and self.varargs is None:
+            if self.first_default < argcount:
+                takes = "from %d to %d positional arguments" % (
+                    self.first_default,
+                    argcount,
+                )
+            else:
+                takes = "%d positional argument%s" % (argcount, plural(argcount))
+            kwonly_given = len([i for i, var in self.kwonly if i in bound])
+            if kwonly_given:
+                given = "%d positional argument%s (and %d keyword-only argument%s)" % (
+                    nargs,
+                    plural(nargs),
+                    kwonly_given,
+                    plural(kwonly_given),
+                )
+            else:
+                given = str(nargs)
+            return TypeError(
+                "%s() takes %s but %s %s given"
+                % (name, takes, given, "was" if given == "1" else "were")
+            )
+        missing = [varnames[i] for i in range(self.first_default) if i not in bound]
+        if missing:
+            return missing_error(name, "positional", missing)
+        kwdefaults = self.kwdefaults or {}
+        missing = [
+            var for i, var in self.kwonly if i not in bound and var not in kwdefaults
+        ]
+        if missing:
+            return missing_error(name, "keyword-only", missing)
+        return TypeError("%s() got arguments that don't fit its parameters" % name)
+
+
+def plural(count):
+    return "" if count == 1 else "s"
+
+
+def missing_error(name, kind, missing):
+    """Return the TypeError for a call of function `name` that is missing
+    the `kind` arguments named in the list `missing`."""
+    names = ["'%s'" % var for var in missing]
+    if len(names) == 1:
+        listed = names[0]
+    elif len(names) == 2:
+        listed = "%s and %s" % tuple(names)
+    else:
+        listed = "%s, and %s" % (", ".join(names[:-1]), names[-1])
+    return TypeError(
+        "%s() missing %d required %s argument%s: %s"
+        % (name, len(names), kind, plural(len(names)), listed)
+    )
+
+
+def can_plan(code):
+    """Return True if calls of functions with code `code` can be bound by
+    a BindingPlan."""
+    if not code.co_flags & CO_OPTIMIZED:
+        return False
+    # Python 2 names a tuple parameter ".0", ".1" and so on, and unpacks it
+    # in the code of the function.
+    return not any(
+        name.startswith(".") for name in code.co_varnames[: code.co_argcount]
+    )
@@ -0,0 +1,234 @@
+"""Control-flow graphs of code objects.
+
+The bytecode of a code object is split into basic blocks: runs of
+instructions that are entered only at the first and left only after the
+last, barring exceptions. A `ControlFlowGraph` records for each block
+where control can go next, and which exception handlers an exception
+raised in the block can go to.
+
+PyVM.eval_frame() runs a block at a time. The graph is also what you want
+for branch coverage (edges), profiling by block, or putting breakpoints
+at the start of blocks.
+
+The graph is made from a DecodedCode and cached in it, so like the
+decoding it is done once per code object; see control_flow_graph().
+"""
+
+# Instructions that never continue with the next one. Jump instructions
+# are taken care of by their jump_target.
+NO_FALLTHROUGH = frozenset(
+    """
+    RETURN_VALUE RAISE_VARARGS RERAISE
+    JUMP_ABSOLUTE JUMP_FORWARD JUMP_BACKWARD JUMP_BACKWARD_NO_INTERRUPT
+    BREAK_LOOP CONTINUE_LOOP
+    """.split()
+)
+
+# Instructions other than jumps after which control may not continue with
+# the next instruction, so they end a block. YIELD_VALUE ends a block so
+# that a generator resumes at the start of one.
+BLOCK_ENDS = NO_FALLTHROUGH | frozenset(
+    """
+    YIELD_VALUE YIELD_FROM END_FINALLY
+    WITH_CLEANUP WITH_CLEANUP_START WITH_CLEANUP_FINISH
+    """.split()
+)
+
+# Instructions that push a block whose handler catches exceptions.
+SETUP_HANDLER = frozenset(
+    "SETUP_EXCEPT SETUP_FINALLY SETUP_WITH SETUP_ASYNC_WITH".split()
+)
+
+
+class BasicBlock(object):
+    """A run of instructions that is entered only at the first and left
+    only after the last, unless an exception is raised.
+
+    `offset` is where the block starts, counting any EXTENDED_ARG prefix of
+    its first instruction; `instructions` are its Instructions.
+    `successors` and `predecessors` are the blocks control can go to from
+    this one and come from, in the absence of exceptions, and
+    `exception_successors` are the blocks with the exception handlers that
+    can catch an exception raised in this one.
+    """
+
+    def __init__(self, index, offset, instructions):
+        self.index = index
+        self.offset = offset
+        self.instructions = instructions
+        self.successors = []
+        self.predecessors = []
+        self.exception_successors = []
+
+    @property
+    def next_offset(self):
+        """The offset just after the block."""
+        return self.instructions[-1].next_offset
+
+    def __repr__(self):
+        return "<BasicBlock %d: offsets %d-%d>" % (
+            self.index,
+            self.offset,
+            self.instructions[-1].offset,
+        )
+
+
+class ControlFlowGraph(object):
+    """The basic blocks of a code object, given as a DecodedCode.
+
+    `blocks` lists the blocks in offset order. `positions` is indexed by
+    offset like DecodedCode.instructions and gives, for each offset
+    that has an instruction, the block it is in and its index there.
+
+    `loop_exits` maps the offset of each BREAK_LOOP and CONTINUE_LOOP that
+    leaves only "try" blocks with no "finally" part on its way to its loop
+    to the number of those blocks; see PyVM.exit_loop().
+    """
+
+    def __init__(self, decoded):
+        self.decoded = decoded
+        instructions = decoded.instructions
+
+        # The instructions in order, once each, and where each starts.
+        insts = []
+        starts = []
+        for offset, inst in enumerate(instructions):
+            if inst is not None and (not insts or inst is not insts[-1]):
+                insts.append(inst)
+                starts.append(offset)
+
+        # Find the first instruction of each block.
+        leaders = set(decoded.jump_targets)
+        leaders.add(0)
+        for inst in insts:
+            if inst.jump_target is not None and not inst.opname.startswith(
+                "SETUP_"
+            ):
+                leaders.add(inst.next_offset)
+            elif inst.opname in BLOCK_ENDS:
+                leaders.add(inst.next_offset)
+
+        self.blocks = blocks = []
+        self.loop_exits = {}
+        self.positions = positions = [None] * len(instructions)
+        block = None
+        for inst, start in zip(insts, starts):
+            if block is None or start in leaders or inst.offset in leaders:
+                block = BasicBlock(len(blocks), start, [])
+                blocks.append(block)
+            for offset in range(start, inst.offset + 1):
+                positions[offset] = (block, len(block.instructions))
+            block.instructions.append(inst)
+
+        for block in blocks:
+            last = block.instructions[-1]
+            if last.opname not in NO_FALLTHROUGH:
+                self.add_edge(block, last.next_offset)
+            if last.jump_target is not None and not last.opname.startswith(
+                "SETUP_"
+            ):
+                self.add_edge(block, last.jump_target)
+
+        if decoded.exception_table is not None:
+            self.add_exception_table_edges()
+        else:
+            self.add_block_stack_edges()
+
+    def block_at(self, offset):
+        """Return the block holding the instruction at `offset`, or None."""
+        if 0 <= offset < len(self.positions):
+            position = self.positions[offset]
+            if position is not None:
+                return position[0]
+        return None
+
+    def add_edge(self, block, offset, kind="successors"):
+        """Add an edge of `kind`, "successors" or "exception_successors",
+        from `block` to the block at `offset`."""
+        target = self.block_at(offset)
+        if target is None:
+            return
+        edges = getattr(block, kind)
+        if target not in edges:
+            edges.append(target)
+            if kind == "successors":
+                target.predecessors.append(block)
+
+    def add_block_stack_edges(self):
+        """Add the edges that depend on the block stack: to exception
+        handlers, and from BREAK_LOOP to the end of its loop. Fill in
+        `loop_exits` along the way.
+
+        We follow the SETUP_* and POP_BLOCK instructions from the start of
+        the code to find the blocks on the block stack at each point.
+        """
+        # The block stack at the start of each block, as a tuple of
+        # (SETUP_* opname, handler offset) pairs.
+        entry_stacks = {0: ()}
+        todo = [self.blocks[0]] if self.blocks else []
+        while todo:
+            block = todo.pop()
+            stack = entry_stacks[block.index]
+            handlers = []
+            for inst in block.instructions:
+                opname = inst.opname
+                if opname in SETUP_HANDLER:
+                    handlers.append((inst.jump_target, stack))
+                    stack = stack + ((opname, inst.jump_target),)
+                elif opname == "SETUP_LOOP":
+                    stack = stack + ((opname, inst.jump_target),)
+                elif opname == "POP_BLOCK" and stack:
+                    stack = stack[:-1]
+                elif opname in ("BREAK_LOOP", "CONTINUE_LOOP"):
+                    self.add_loop_exit(block, inst, stack)
+                for setup, handler in reversed(stack):
+                    if setup != "SETUP_LOOP":
+                        self.add_edge(block, handler, "exception_successors")
+                        break
+
+            # A handler runs with the block stack as it was before its
+            # SETUP_* instruction.
+            for handler, handler_stack in handlers:
+                handler_block = self.block_at(handler)
+                if handler_block is not None:
+                    if handler_block.index not in entry_stacks:
+                        entry_stacks[handler_block.index] = handler_stack
+                        todo.append(handler_block)
+            for successor in block.successors:
+                if successor.index not in entry_stacks:
+                    entry_stacks[successor.index] = stack
+                    todo.append(successor)
+
+    def add_loop_exit(self, block, inst, stack):
+        """Note how BREAK_LOOP or CONTINUE_LOOP `inst`, at the end of
+        `block` with block stack `stack`, gets to its loop."""
+        plain = True
+        for above, (setup, handler) in enumerate(reversed(stack)):
+            if setup == "SETUP_LOOP":
+                if inst.opname == "BREAK_LOOP":
+                    self.add_edge(block, handler)
+                if plain:
+                    self.loop_exits[inst.offset] = above
+                return
+            # The handler of a "finally" or "with" block runs on the way out.
+            plain = plain and setup == "SETUP_EXCEPT"
+
+    def add_exception_table_edges(self):
+        """Add the edges to exception handlers for Python 3.11 and later,
+        where they come from the exception table instead of a block
+        stack."""
+        table = self.decoded.exception_table
+        for block in self.blocks:
+            for inst in block.instructions:
+                entry = table.handler(inst.offset)
+                if entry is not None:
+                    self.add_edge(block, entry.target, "exception_successors")
+
+
+def control_flow_graph(decoded):
+    """Return the ControlFlowGraph of `decoded`, a DecodedCode, making it
+    the first time."""
+    cfg = decoded.cfg
+    if cfg is None:
+        cfg = decoded.cfg = ControlFlowGraph(decoded)
+    return cfg
@@ -13,7 +13,7 @@ from xdis import load_module
 from xdis.version_info import (IS_PYPY, PYTHON_VERSION_TRIPLE,
                                version_tuple_to_str)
 
-from xpython.stdlib.builtins import make_compatible_builtins
+from xpython.stdlib.builtins import compatible_builtins
 from xpython.version_info import (SUPPORTED_BYTECODE, SUPPORTED_PYPY,
                                   SUPPORTED_PYTHON)
 from xpython.vm import PyVM, PyVMUncaughtException, format_instruction
@@ -73,13 +73,18 @@ def exec_code_object(
     is_pypy=IS_PYPY,
     callback=None,
     format_instruction=format_instruction,
+    engine="classic",
+    native_threshold=None,
 ):
+    if env.get("__builtins__", BUILTINS) is BUILTINS:
+        env["__builtins__"] = compatible_builtins(python_version)
     if callback:
         vm = PyVMTraced(
             callback,
             python_version,
             is_pypy,
             format_instruction_func=format_instruction,
+            native_threshold=native_threshold,
         )
         try:
             vm.run_code(code, f_globals=env)
@@ -91,9 +96,13 @@ def exec_code_object(
             )
             callback("fatal", 0, "fatalOpcode", 0, -1, event_arg, [], vm)
     else:
-        if python_version != PYTHON_VERSION_TRIPLE[:2]:
-            make_compatible_builtins(BUILTINS.__dict__, python_version)
-        vm = PyVM(python_version, is_pypy, format_instruction_func=format_instruction)
+        vm = PyVM(
+            python_version,
+            is_pypy,
+            format_instruction_func=format_instruction,
+            engine=engine,
+            native_threshold=native_threshold,
+        )
         try:
             vm.run_code(code, f_globals=env)
         except PyVMUncaughtException:
@@ -126,7 +135,7 @@ def rsplit1(s, sep):
     return sep.join(parts[:-1]), parts[-1]
 
 
-def run_python_module(modulename, args):
+def run_python_module(modulename, args, engine="classic", native_threshold=None):
     """Run a python module, as though with ``python -m name args...``.
 
     `modulename` is the name of the module, possibly a dot-separated name.
@@ -170,11 +179,23 @@ def run_python_module(modulename, args):
 
     # Finally, hand the file off to run_python_file for execution.
     args[0] = pathname
-    run_python_file(pathname, args, package=packagename)
+    run_python_file(
+        pathname,
+        args,
+        package=packagename,
+        engine=engine,
+        native_threshold=native_threshold,
+    )
 
 
 def run_python_file(
-    filename, args, package=None, callback=None, format_instruction=format_instruction
+    filename,
+    args,
+    package=None,
+    callback=None,
+    format_instruction=format_instruction,
+    engine="classic",
+    native_threshold=None,
 ):
     """Run a python file as if it were the main program on the command line.
 
@@ -186,6 +207,10 @@ def run_python_file(
     If `callback` is not None, it is a function which is called back as the
     execution progresses. This can be used for example in a debugger, or
     for custom tracing or statistics gathering.
+
+    `engine` selects how the VM runs code when there is no `callback`;
+    see PyVM. With a `native_threshold`, hot functions are run natively;
+    see xpython.native.
     """
     # Create a module to serve as __main__
     old_main_mod = sys.modules["__main__"]
@@ -232,7 +257,6 @@ def run_python_file(
                         % (mess, filename, version_tuple_to_str(python_version))
                     )
                 main_mod.__file__ = code.co_filename
-                make_compatible_builtins(main_mod.__builtins__.__dict__, python_version)
 
                 if source_is_older(code.co_filename, filename):
                     print(
@@ -276,6 +300,8 @@ def run_python_file(
             is_pypy,
             callback,
             format_instruction=format_instruction,
+            engine=engine,
+            native_threshold=native_threshold,
         )
 
     finally:
@@ -288,7 +314,13 @@ def run_python_file(
 
 
 def run_python_string(
-    source, args, package=None, callback=None, format_instruction=format_instruction
+    source,
+    args,
+    package=None,
+    callback=None,
+    format_instruction=format_instruction,
+    engine="classic",
+    native_threshold=None,
 ):
     """Run a python string as if it were the main program on the command line."""
     # Create a module to serve as __main__
@@ -327,6 +359,8 @@ def run_python_string(
             IS_PYPY,
             callback,
             format_instruction=format_instruction,
+            engine=engine,
+            native_threshold=native_threshold,
         )
 
     finally:
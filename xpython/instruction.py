@@ -0,0 +1,371 @@
+"""Decoding of bytecode into an instruction array.
+
+Decoding an instruction involves figuring out its size, folding in
+EXTENDED_ARG prefixes, and turning the integer operand into the value
+the opcode routines in xpython.byteop expect: a constant, a name, an
+absolute jump target and so on.
+
+Doing that on every execution of an instruction costs about as much
+as running the instruction, so here we do it once per code object and
+keep the result in a `DecodedCode`, which the VM caches.
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+
+from xdis import PYTHON3, code2num, next_offset, op_has_argument
+from xdis.bytecode import parse_exception_table
+
+if PYTHON3:
+
+    def byteint(b):
+        return b
+
+else:
+    byteint = ord
+
+
+# A single decoded instruction.
+#
+# "offset" is the offset of the opcode proper, i.e. after any EXTENDED_ARG
+# prefix. "arguments" is a list that is either empty or has the single
+# operand that is passed to the opcode routine. "line_number" is not None
+# only when the instruction starts a line. "jump_target" is the offset jumped
+# to for relative and absolute jump instructions, and None otherwise.
+#
+# The operand of the instructions on cells and free variables (LOAD_DEREF
+# and so on) is left as an index, since Frame.cells is indexed the same way;
+# cell_name() gives the name.
+Instruction = namedtuple(
+    "Instruction",
+    "opname opcode int_arg arguments offset next_offset line_number jump_target",
+)
+
+
+def decode_instruction(code, offset, opc, version, linestarts, opcode=None):
+    """Decode the instruction at `offset` in `code` and return an
+    `Instruction` for it.
+
+    If `opcode` is given, it is used instead of the opcode found at
+    `offset`. This is used to replay an instruction that has been
+    overwritten by a breakpoint.
+    """
+    co_code = code.co_code
+    extended_arg = 0
+    line_number = None
+    int_arg = None
+    arguments = []
+    jump_target = None
+
+    while True:
+        if line_number is None:
+            line_number = linestarts.get(offset, None)
+        if opcode is None:
+            byte_code = byteint(co_code[offset])
+        else:
+            byte_code = opcode
+            opcode = None
+        arg_offset = offset + 1
+
+        if op_has_argument(byte_code, opc):
+            if version >= (3, 6):
+                int_arg = code2num(co_code, arg_offset) | extended_arg
+                # Note: Python 3.6.0a1 is 2, for 3.6.a3 and beyond we have 1
+                arg_offset += 1
+                if byte_code == opc.EXTENDED_ARG:
+                    extended_arg = int_arg << 8
+                    offset = next_offset(byte_code, opc, offset)
+                    continue
+            else:
+                int_arg = (
+                    code2num(co_code, arg_offset)
+                    + code2num(co_code, arg_offset + 1) * 256
+                    + extended_arg
+                )
+                arg_offset += 2
+                if byte_code == opc.EXTENDED_ARG:
+                    extended_arg = int_arg * 65536
+                    offset = next_offset(byte_code, opc, offset)
+                    continue
+
+            if byte_code in opc.CONST_OPS:
+                arg = code.co_consts[int_arg]
+            elif byte_code in opc.FREE_OPS:
+                arg = int_arg
+            elif byte_code in opc.NAME_OPS:
+                arg = code.co_names[int_arg]
+            elif byte_code in opc.JREL_OPS:
+                if version >= (3, 10):
+                    int_arg += int_arg
+                arg = jump_target = arg_offset + int_arg
+            elif byte_code in opc.JABS_OPS:
+                if version >= (3, 10):
+                    int_arg += int_arg
+                arg = jump_target = int_arg
+            elif byte_code in opc.LOCAL_OPS:
+                arg = code.co_varnames[int_arg]
+            else:
+                arg = int_arg
+            arguments = [arg]
+        break
+
+    return Instruction(
+        opc.opname[byte_code],
+        byte_code,
+        int_arg,
+        arguments,
+        offset,
+        next_offset(byte_code, opc, offset),
+        line_number,
+        jump_target,
+    )
+
+
+def cell_name(code, i):
+    """Return the name of the cell or free variable with index `i` in the
+    cells of a frame running `code`. The name of the variable is
+    co_cellvars[i] if i is less than the length of co_cellvars. Otherwise
+    it is co_freevars[i - len(co_cellvars)]."""
+    if i < len(code.co_cellvars):
+        return code.co_cellvars[i]
+    return code.co_freevars[i - len(code.co_cellvars)]
+
+
+# Instructions that push one value and pop none.
+PUSH_ONE = frozenset(
+    """
+    LOAD_FAST LOAD_CONST LOAD_NAME LOAD_GLOBAL LOAD_DEREF LOAD_CLOSURE
+    LOAD_CLASSDEREF
+    """.split()
+)
+
+# Instructions that pop the number of values in their operand and push one.
+BUILD_ONE = frozenset("BUILD_TUPLE BUILD_LIST BUILD_SET BUILD_STRING".split())
+
+
+def stack_use(inst):
+    """Return how many values `inst` pops and pushes, or None if we don't
+    say. This is only for the instructions that make up the arguments of
+    calls before 3.7; see method_calls()."""
+    opname = inst.opname
+    if opname in PUSH_ONE:
+        return 0, 1
+    if opname == "LOAD_ATTR" or opname.startswith("UNARY_"):
+        return 1, 1
+    if opname == "COMPARE_OP" or opname.startswith(("BINARY_", "INPLACE_")):
+        return 2, 1
+    if opname in BUILD_ONE:
+        return inst.int_arg, 1
+    if opname == "CALL_FUNCTION":
+        len_kw, len_pos = divmod(inst.int_arg, 256)
+        return len_pos + 2 * len_kw + 1, 1
+    return None
+
+
+def method_calls(instructions, jump_targets):
+    """Return the offsets of the LOAD_ATTR instructions in `instructions`,
+    indexed by offset as in DecodedCode, whose value is only called by a
+    CALL_FUNCTION, and the offsets of those CALL_FUNCTIONs.
+
+    This is "obj.name(...)", which from 3.7 on compiles to LOAD_METHOD and
+    CALL_METHOD instead. Such a LOAD_ATTR can push the function and the
+    object for a method, and its CALL_FUNCTION can call the function with
+    the object as the first argument, with no bound method made; see
+    ByteOpBase.load_method(). We only pair up instructions in a straight
+    run of code with arguments made by instructions that stack_use()
+    knows about.
+    """
+    # The instructions in order, once each, and where each starts,
+    # counting any EXTENDED_ARG prefix.
+    insts = []
+    starts = []
+    for offset, inst in enumerate(instructions):
+        if inst is not None and (not insts or inst is not insts[-1]):
+            insts.append(inst)
+            starts.append(offset)
+
+    loads = []
+    calls = []
+    for i, inst in enumerate(insts):
+        if inst.opname != "LOAD_ATTR":
+            continue
+        # The number of values above the attribute on the stack.
+        depth = 0
+        for start, after in zip(starts[i + 1 :], insts[i + 1 :]):
+            if start in jump_targets or after.offset in jump_targets:
+                break
+            if after.jump_target is not None:
+                break
+            use = stack_use(after)
+            if use is None:
+                break
+            pops, pushes = use
+            if after.opname == "CALL_FUNCTION" and pops == depth + 1:
+                loads.append(inst.offset)
+                calls.append(after.offset)
+                break
+            if pops > depth:
+                # The attribute is used some other way.
+                break
+            depth += pushes - pops
+    return frozenset(loads), frozenset(calls)
+
+
+class ExceptionTable(object):
+    """The exception table of a code object from 3.11 on, which says where
+    the handler is for an exception raised by an instruction, in place of
+    the SETUP_* instructions and block stack of earlier versions.
+
+    The table is decoded once, into entries sorted by the offset they
+    start at. Entries don't overlap: an instruction inside nested "try"
+    statements has the entry of the innermost handler. So the entry for
+    an offset is found by bisecting the start offsets.
+    """
+
+    __slots__ = ("entries", "starts", "targets")
+
+    def __init__(self, code):
+        # Each entry has the start and end offsets of the instructions it
+        # covers, the offset of the handler, the depth to cut the stack
+        # back to, and whether the offset of the instruction that raised is
+        # pushed before the exception.
+        self.entries = sorted(
+            parse_exception_table(code.co_exceptiontable), key=lambda e: e.start
+        )
+        self.starts = [entry.start for entry in self.entries]
+        self.targets = frozenset(entry.target for entry in self.entries)
+
+    def handler(self, offset):
+        """Return the entry for the handler of the instruction at `offset`,
+        or None if an exception there leaves the frame."""
+        i = bisect_right(self.starts, offset) - 1
+        if i >= 0:
+            entry = self.entries[i]
+            if offset < entry.end:
+                return entry
+        return None
+
+
+class DecodedCode(object):
+    """The decoded form of a code object.
+
+    `instructions` is indexed by bytecode offset. Entries for offsets that
+    hold an EXTENDED_ARG prefix refer to the instruction the prefix belongs
+    to; offsets in the middle of an instruction hold None.
+    """
+
+    def __init__(self, code, opc, version, brkpt=None):
+        brkpt = brkpt or {}
+        self.code = code
+        self.co_code = code.co_code
+        self.opc = opc
+        self.version = version
+        self.linestarts = dict(opc.findlinestarts(code, dup_lines=True))
+
+        # The offsets that start a line, in order, and their line numbers,
+        # for finding the line of an offset with line_number_at().
+        self.line_offsets = sorted(
+            offset
+            for offset, line_number in self.linestarts.items()
+            if line_number is not None
+        )
+        self.line_numbers = [self.linestarts[offset] for offset in self.line_offsets]
+
+        n = len(self.co_code)
+        instructions = [None] * n
+        offset = 0
+        while offset < n:
+            orig_opcode = brkpt.get(offset)
+            if orig_opcode == byteint(self.co_code[offset]):
+                # The breakpoint has been removed.
+                orig_opcode = None
+            inst = decode_instruction(
+                code, offset, opc, version, self.linestarts, orig_opcode
+            )
+            if orig_opcode is not None:
+                # A breakpoint pseudo-op has overwritten the opcode here.
+                # It takes up the space of the instruction it replaced,
+                # which the breakpoint handler replays.
+                brkpt_opcode = byteint(self.co_code[offset])
+                inst = inst._replace(
+                    opname=opc.opname[brkpt_opcode],
+                    opcode=brkpt_opcode,
+                    int_arg=None,
+                    arguments=[],
+                    jump_target=None,
+                )
+            # An EXTENDED_ARG prefix stands for the instruction it prefixes,
+            # since jumps can target the prefix.
+            for i in range(offset, inst.offset + 1):
+                instructions[i] = inst
+            offset = inst.next_offset
+        self.instructions = instructions
+
+        # The block pushed by each SETUP_* instruction that has run, by
+        # its offset; see PyVM.setup_block().
+        self.setup_blocks = {}
+
+        # From 3.11, where exceptions are handled; see ExceptionTable.
+        if version >= (3, 11):
+            self.exception_table = ExceptionTable(code)
+        else:
+            self.exception_table = None
+
+        # Offsets that some instruction jumps to, including the handlers
+        # of SETUP_* instructions or of the exception table.
+        self.jump_targets = frozenset(
+            inst.jump_target
+            for inst in instructions
+            if inst is not None and inst.jump_target is not None
+        )
+        if self.exception_table is not None:
+            self.jump_targets |= self.exception_table.targets
+
+        # The offsets of LOAD_ATTR and CALL_FUNCTION instructions that make
+        # method calls before 3.7; see method_calls().
+        if version < (3, 7):
+            self.method_loads, self.method_calls = method_calls(
+                instructions, self.jump_targets
+            )
+        else:
+            self.method_loads = self.method_calls = frozenset()
+
+        # The index in co_varnames, and so in Frame.fast_locals, of each
+        # local variable name.
+        self.varindex = {name: i for i, name in enumerate(code.co_varnames)}
+
+        # The instructions as closures, made by xpython.vmclosure when
+        # the code is first run by that engine.
+        self.closure_ops = None
+
+        # The control-flow graph, made by xpython.cfg.control_flow_graph()
+        # when it is first needed.
+        self.cfg = None
+
+        # Calls of the code plus backward jumps made in it, counted when
+        # PyVM has a native_threshold; see xpython.native.
+        self.hotness = 0
+
+        # Frames for the code whose calls have returned, to be used again
+        # for later calls; see PyVM.recycle_frame().
+        self.free_frames = []
+
+    def line_number_at(self, offset):
+        """Return the number of the line that the instruction at `offset`
+        is part of."""
+        i = bisect_right(self.line_offsets, offset)
+        if i:
+            return self.line_numbers[i - 1]
+        return self.code.co_firstlineno
+
+    def instruction_at(self, offset):
+        """Return the instruction at `offset`. Offsets that do not start an
+        instruction are decoded on the fly, the way the bytes there would
+        be interpreted if we jumped to them.
+        """
+        inst = self.instructions[offset]
+        if inst is None:
+            inst = decode_instruction(
+                self.code, offset, self.opc, self.version, self.linestarts
+            )
+        return inst
@@ -0,0 +1,143 @@
+"""Type-keyed inline caches for LOAD_METHOD.
+
+LOAD_METHOD looks up an attribute of TOS that is about to be called. On
+an object of a class made by the VM that attribute is usually a
+pyobj.Function in the class. getattr() would call Function.__get__() to
+make a pyobj.Method bound to the object, and calling that calls the
+function with the object in front of the arguments. As CPython does, we
+skip the bound method: LOAD_METHOD pushes the function and the object,
+and CALL_METHOD passes the object as the first argument.
+
+Finding out that the attribute is such a function means looking through
+the MRO of the object's type, which in Python costs more than getattr()
+itself. So each LOAD_METHOD has a MethodCache, which remembers for up to
+a few types where the function was found.
+
+Python doesn't give us CPython's type version tags, so there is no
+single number that tells us a class has changed. An entry instead keeps
+the __dict__ proxies of the classes in the MRO, which always show what
+is in the class now, and on each use checks that:
+
+* the type still has the same MRO,
+* the function is still in the class it was found in, and the classes
+  before that one haven't gained an attribute of that name,
+* no class in the MRO but object has a __getattribute__(),
+* the object's own __dict__ has no attribute of that name.
+
+LOAD_ATTR and STORE_ATTR aren't cached: getattr() and setattr() already
+use CPython's type attribute cache. A cache of ours that went straight to
+the object's __dict__ on a type match, checking nothing else, measured no
+faster on the attrs program of admin-tools/bench-per-instruction.py, and
+a sound one would have to check the MRO as well.
+
+Each cache counts how often it answered from an entry (a hit) and how
+often it had to look through the MRO (a miss); see stats().
+"""
+
+from collections import Counter
+
+from xpython.pyobj import Function
+
+# The most types a cache has entries for. Past that, types it has no
+# entry for are looked up with getattr().
+MAX_ENTRIES = 4
+
+# The entry for a type whose attribute is not a function we can call
+# with the object as the first argument.
+NOT_A_METHOD = False
+
+
+class MethodCache(object):
+    """The cache for looking up the method `name` on objects of various
+    types."""
+
+    __slots__ = ("name", "entries", "max_entries", "hits", "misses")
+
+    def __init__(self, vm, name, max_entries=MAX_ENTRIES):
+        self.name = name
+        # Entries keyed by type; see method_entry().
+        self.entries = {}
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        vm.method_caches.append(self)
+
+    def lookup(self, obj):
+        """Return the pyobj.Function that the method `name` of `obj` is,
+        to be called with `obj` as the first argument; or None if the
+        method should be got with getattr(obj, name)."""
+        tp = type(obj)
+        entry = self.entries.get(tp)
+        if entry is not None:
+            if entry is NOT_A_METHOD:
+                self.hits += 1
+                return None
+            mro, before, owner, after, func = entry
+            name = self.name
+            if (
+                tp.__mro__ is mro
+                and owner.get(name) is func
+                and "__getattribute__" not in owner
+            ):
+                for cls_dict in before:
+                    if name in cls_dict or "__getattribute__" in cls_dict:
+                        break
+                else:
+                    for cls_dict in after:
+                        if "__getattribute__" in cls_dict:
+                            break
+                    else:
+                        self.hits += 1
+                        if name in obj.__dict__:
+                            return None
+                        return func
+        elif len(self.entries) >= self.max_entries:
+            self.misses += 1
+            return None
+
+        self.misses += 1
+        entry = self.entries[tp] = method_entry(tp, obj, self.name)
+        if entry is NOT_A_METHOD or self.name in obj.__dict__:
+            return None
+        return entry[-1]
+
+
+def method_entry(tp, obj, name):
+    """Return the MethodCache entry for the attribute `name` of `obj`,
+    whose type is `tp`.
+
+    This is a tuple of the MRO of `tp`; the __dict__s of the classes in it
+    before the one that has the attribute, that one's, and those of the
+    classes after it except object; and the function. It is NOT_A_METHOD
+    when the attribute isn't a pyobj.Function found in a class, or when
+    `tp` changes how attributes are looked up.
+    """
+    mro = tp.__mro__
+    if mro[-1] is not object:
+        return NOT_A_METHOD
+    cls_dicts = [cls.__dict__ for cls in mro[:-1]]
+    for cls_dict in cls_dicts:
+        if "__getattribute__" in cls_dict:
+            return NOT_A_METHOD
+    i = next((i for i, d in enumerate(cls_dicts) if name in d), None)
+    if i is None:
+        return NOT_A_METHOD
+    cls_dict = cls_dicts[i]
+    func = cls_dict[name]
+    if type(func) is not Function:
+        return NOT_A_METHOD
+    # The function is a non-data descriptor, so an attribute of the object
+    # itself would hide it; we check for that in a __dict__ that is a dict.
+    if type(getattr(obj, "__dict__", None)) is not dict:
+        return NOT_A_METHOD
+    return (mro, tuple(cls_dicts[:i]), cls_dict, tuple(cls_dicts[i + 1 :]), func)
+
+
+def stats(vm):
+    """Return a Counter of the hits and misses of all the method caches of
+    `vm`."""
+    counts = Counter()
+    for cache in vm.method_caches:
+        counts["hits"] += cache.hits
+        counts["misses"] += cache.misses
+    return counts
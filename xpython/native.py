@@ -0,0 +1,143 @@
+"""Running hot interpreted functions natively.
+
+When PyVM is given a `native_threshold`, it counts the calls of each code
+object and the backward jumps made in it, in DecodedCode.hotness. Once a
+function's code has been counted that many times, further calls of the
+function are made to a native Python function built from the same code
+object, bypassing the VM.
+
+There is nothing to translate: when the bytecode is for the Python we
+are running under, the code object is already something the host
+interpreter can run. So this is only done when:
+
+* the bytecode is for the running Python version and implementation,
+* the code is a real code object with no free variables, since those
+  are held in the VM's own cells, and isn't a generator or coroutine,
+* the code makes no functions or classes. Those would be host objects
+  rather than pyobj.Functions, and would go on running natively however
+  the VM is watched later. Comprehensions and generator expressions are
+  allowed as long as they make none themselves,
+* nothing is watching the function run: instructions aren't being
+  logged, and under PyVMTraced no trace events are enabled for the
+  calling frame, unless it is being stepped over (see
+  PyVM.native_allowed()).
+
+The last condition is checked on every call, so as soon as a debugger
+attaches or trace events are turned on, calls are interpreted again.
+Calls already running natively finish natively.
+
+A native function calls other functions of the program, and itself,
+through their pyobj.Function. So each level of native calls counts three
+times against the host recursion limit: for the native frame, for
+calling the pyobj.Function, and for its __call__() frame. When a run of
+native calls has used up the room there was when it started, further
+calls are interpreted, in the loop of the VM, until the recursion limit
+of the program is reached.
+"""
+
+import sys
+import types
+
+from xdis import (
+    CO_ASYNC_GENERATOR,
+    CO_COROUTINE,
+    CO_GENERATOR,
+    CO_ITERABLE_COROUTINE,
+    IS_PYPY,
+    PYTHON_VERSION_TRIPLE,
+)
+
+# Code flags of functions whose calls don't just run a frame to its end.
+CO_SUSPENDS = CO_GENERATOR | CO_COROUTINE | CO_ITERABLE_COROUTINE | CO_ASYNC_GENERATOR
+
+# The names of the code of comprehensions and generator expressions.
+COMPREHENSIONS = frozenset(("<listcomp>", "<setcomp>", "<dictcomp>", "<genexpr>"))
+
+# Host frames kept back from native calls, for what native code calls and
+# for going back into the VM.
+HOST_RESERVE = 50
+
+
+def native_function(vm, fn):
+    """Return the native function to call in place of `fn`, a
+    pyobj.Function, or None if `fn` should be interpreted."""
+    native = fn._native
+    if native is False:
+        # We found before that it can't be run natively.
+        return None
+    if vm.native_depth and vm.native_depth >= vm.native_limit:
+        # No more room on the host stack.
+        return None
+    code = fn.__code__
+    decoded = vm.decoded_code.get(id(code))
+    if (
+        decoded is None
+        or decoded.code is not code
+        or decoded.hotness < vm.native_threshold
+        or not vm.native_allowed()
+    ):
+        return None
+    if native is None:
+        if not can_run_natively(vm, fn):
+            fn._native = False
+            return None
+        native = fn._native = make_native_function(fn)
+    elif native.__defaults__ is not fn.__defaults__ or (
+        PYTHON_VERSION_TRIPLE >= (3, 0)
+        and native.__kwdefaults__ is not fn.__kwdefaults__
+    ):
+        # The defaults have been changed since we made it.
+        native = fn._native = make_native_function(fn)
+    return native
+
+
+def native_levels():
+    """Return how many levels of native calls there is room for under the
+    host recursion limit from where we are called."""
+    depth = 0
+    frame = sys._getframe(1)
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return (sys.getrecursionlimit() - depth - HOST_RESERVE) // 3
+
+
+def can_run_natively(vm, fn):
+    """Return True if the code of `fn` can be run by the host Python."""
+    code = fn.__code__
+    return (
+        vm.version[:2] == PYTHON_VERSION_TRIPLE[:2]
+        and vm.is_pypy == IS_PYPY
+        and isinstance(code, types.CodeType)
+        and not code.co_freevars
+        and not code.co_flags & CO_SUSPENDS
+        and not fn.has_dot_zero
+        and not makes_functions(code)
+    )
+
+
+def makes_functions(code):
+    """Return True if running `code` can make a function or class, that
+    is, if its constants hold the code of a def, lambda or class body
+    other than a comprehension or generator expression that makes none."""
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType) and (
+            const.co_name not in COMPREHENSIONS or makes_functions(const)
+        ):
+            return True
+    return False
+
+
+def make_native_function(fn):
+    """Return a native function with the code, globals and other
+    attributes of `fn`."""
+    native = types.FunctionType(
+        fn.__code__, fn.func_globals, fn.__name__, fn.__defaults__
+    )
+    native.__doc__ = fn.__doc__
+    if PYTHON_VERSION_TRIPLE >= (3, 0):
+        native.__kwdefaults__ = fn.__kwdefaults__
+        native.__annotations__ = fn.__annotations__
+        if PYTHON_VERSION_TRIPLE >= (3, 4):
+            native.__qualname__ = fn.__qualname__
+    return native
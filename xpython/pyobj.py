@@ -2,10 +2,20 @@
 import collections
 import inspect
 import linecache
+import sys
 import types
 from copy import copy
 from sys import stderr
-from xdis import CO_GENERATOR, CO_ITERABLE_COROUTINE, iscode
+from xdis import (
+    CO_ASYNC_GENERATOR,
+    CO_COROUTINE,
+    CO_FUTURE_GENERATOR_STOP,
+    CO_GENERATOR,
+    CO_ITERABLE_COROUTINE,
+    CO_OPTIMIZED,
+    iscode,
+)
+from xdis.op_imports import get_opcode_module
 from xdis.version_info import PYTHON3, PYTHON_VERSION_TRIPLE
 
 if PYTHON_VERSION_TRIPLE >= (3, 4):
@@ -18,8 +28,9 @@ else:
 
 import xpython.stdlib.inspect3 as inspect3
 import xpython.stdlib.inspect2 as inspect2
-
-import six
+from xpython.callargs import UNBOUND, BindingPlan, can_plan
+from xpython.instruction import DecodedCode
+from xpython.native import CO_SUSPENDS, native_function, native_levels
 
 PY2 = not PYTHON3
 
@@ -35,6 +46,11 @@ def make_cell(value):
         return fn.func_closure[0]
 
 
+# The cell put in every slot of the closure of Function._func. Its
+# value doesn't matter, since _func is never run.
+DUMMY_CELL = make_cell(0)
+
+
 # It might be the case that this is more useful in Python 2.x
 # which doesn't seem to show traceback of interpreted code.
 # Python 3.x does this but it also shows junk at the end.
@@ -86,12 +102,13 @@ class Function:
         "__closure__",
         # rest
         "func_globals",
-        "func_locals",
         "func_dict",
         "__dict__",
         # "__doc__" is filled in by the doc comment above.
         "_vm",
-        "_func",
+        "_shadow",
+        "_native",
+        "_plan",
     ]
 
     def __init__(
@@ -110,6 +127,11 @@ class Function:
         self._vm = vm
         self.version = vm.version
         self.__doc__ = doc
+        # The native function that runs this one when it is hot, False if
+        # it can't be run natively; see xpython.native.
+        self._native = None
+        # How to bind the arguments of a call; see make_call_frame().
+        self._plan = None
 
         if name is not None and not isinstance(name, str):
             raise TypeError(
@@ -145,7 +167,6 @@ class Function:
         self.func_closure = self.__closure__ = closure
 
         self.func_globals = globs
-        self.func_locals = vm.frame.f_locals
         self.__dict__ = {"version": vm.version, "_vm": vm}
 
         self.__doc__ = (
@@ -189,31 +210,48 @@ class Function:
         # The intent in providing native functions is for use in type
         # testing, mostly. The functions should not be run, since that defeats our
         # ability to trace functions.
+        #
+        # Most functions never need theirs, and functions made in a loop
+        # would make one each time around, so it is made the first time
+        # _func is asked for.
+        self._shadow = None
+
+    @property
+    def _func(self):
+        """The native function for this one, or None if there can't be
+        one; see make_shadow()."""
+        if self._shadow is None:
+            self._shadow = self.make_shadow() or False
+        return self._shadow or None
+
+    def make_shadow(self):
+        """Return a native function with the code, globals, defaults and
+        closure size of this one, or None if one can't be made."""
         kw = {"argdefs": self.func_defaults}
-        if closure:
-            kw["closure"] = tuple(make_cell(0) for _ in closure)
+        if self.__closure__:
+            kw["closure"] = (DUMMY_CELL,) * len(self.__closure__)
 
+        code = self.func_code
         if not isinstance(code, types.CodeType) and hasattr(code, "to_native"):
             try:
                 code = code.to_native()
             except Exception:
                 pass
 
-        if isinstance(code, types.CodeType):
-            try:
-                self._func = types.FunctionType(code, globs, **kw)
-                if vm.version >= 3.0:
-                    # Above, types.FunctionType() above doesn't allow passing
-                    # in the following attributes, so we set them as
-                    # assignments below.
-                    self._func.__kwdefaults__ = kwdefaults
-                    self._func.__annotations__ = annotations
-                    pass
-            except Exception:
-                self._func = None
-        else:
+        if not isinstance(code, types.CodeType):
             # cross version interpreting... FIXME: fix this up
-            self._func = None
+            return None
+        try:
+            func = types.FunctionType(code, self.func_globals, **kw)
+            if self.version >= (3, 0):
+                # Above, types.FunctionType() above doesn't allow passing
+                # in the following attributes, so we set them as
+                # assignments below.
+                func.__kwdefaults__ = self.__kwdefaults__
+                func.__annotations__ = self.__annotations__
+        except Exception:
+            return None
+        return func
 
     def __repr__(self):  # pragma: no cover
         return "<Function %s at 0x%08x>" % (self.func_name, id(self))
@@ -228,6 +266,83 @@ class Function:
             return self
 
     def __call__(self, *args, **kwargs):
+        vm = self._vm
+        if vm.native_threshold is not None:
+            native = native_function(vm, self)
+            if native is not None:
+                depth = vm.native_depth
+                if not depth:
+                    vm.native_limit = native_levels()
+                vm.native_depth = depth + 1
+                try:
+                    return native(*args, **kwargs)
+                finally:
+                    vm.native_depth = depth
+
+        frame = self.make_call_frame(args, kwargs)
+        if self.__code__.co_flags & CO_GENERATOR:
+            qualname = self.__qualname__ if self._vm.version >= (3, 4) else None
+            gen = Generator(
+                g_frame=frame, name=self.__name__, qualname=qualname, vm=self._vm
+            )
+            if self.__code__.co_flags & CO_ITERABLE_COROUTINE:
+                gen = _AsyncGeneratorWrapper(gen)
+                frame.generator = gen
+                return gen
+
+            frame.generator = gen
+            retval = gen
+        else:
+            retval = self._vm.eval_frame(frame)
+        return retval
+
+    def inline_call_frame(self, args, kwargs):
+        """Return a new frame for a call of this function with `args` and
+        `kwargs` that the VM can run in the loop of the caller, or None if
+        the call has to go through __call__(): for generators and
+        coroutines, and for functions that run natively."""
+        if not self.can_inline():
+            return None
+        return self.make_call_frame(args, kwargs)
+
+    def inline_call_frame_from_stack(self, stack, start, kwnames=()):
+        """Like inline_call_frame(), for a call whose arguments are
+        stack[start:], the last len(kwnames) of them keyword arguments
+        named by `kwnames`. None is also returned when the arguments
+        don't fit the parameters of this function; the stack is left as
+        it is then."""
+        if not self.can_inline():
+            return None
+        plan = self.binding_plan()
+        if plan is None:
+            return None
+        fast_locals = plan.bind_stack(stack, start, kwnames)
+        if fast_locals is None:
+            return None
+        return self._vm.make_frame(
+            self.func_code,
+            f_globals=self.func_globals,
+            f_locals={},
+            closure=self.__closure__,
+            fast_locals=fast_locals,
+        )
+
+    def can_inline(self):
+        """Return True if a call of this function can be run in the loop
+        of the caller."""
+        vm = self._vm
+        if self.__code__.co_flags & CO_SUSPENDS:
+            return False
+        if vm.native_threshold is not None and native_function(vm, self):
+            return False
+        if len(vm.frames) + vm.native_depth >= sys.getrecursionlimit():
+            raise RecursionError("maximum recursion depth exceeded")
+        return True
+
+    def make_call_frame(self, args, kwargs):
+        """Bind the positional arguments `args` and keyword arguments
+        `kwargs` to the parameters of this function, and return a new frame
+        to run the call in."""
         if self.has_dot_zero:
             # D'oh! http://bugs.python.org/issue19611 Py2 doesn't know how to
             # inspect set comprehensions, dict comprehensions, or generator
@@ -235,7 +350,63 @@ class Function:
             # so just do the right thing.
             assert len(args) == 1 and not kwargs, "Surprising comprehension!"
             callargs = {".0": args[0]}
-        elif self._func and self.version[:2] == PYTHON_VERSION_TRIPLE[:2]:
+        else:
+            plan = self.binding_plan()
+            fast_locals = plan.bind(args, kwargs) if plan else None
+            if fast_locals is not None:
+                return self._vm.make_frame(
+                    self.func_code,
+                    f_globals=self.func_globals,
+                    f_locals={},
+                    closure=self.__closure__,
+                    fast_locals=fast_locals,
+                )
+            if plan and self.version >= (3, 0):
+                # Named the way CPython's message names it.
+                if self.version >= (3, 10):
+                    name = self.__qualname__
+                else:
+                    name = self.func_code.co_name
+                raise plan.call_error(name, args, kwargs)
+            # Either the function has no plan, or the arguments don't fit it
+            # and getcallargs() will say why in Python 2's words.
+            callargs = self.general_callargs(args, kwargs)
+
+        return self._vm.make_frame(
+            self.func_code, callargs, self.func_globals, {}, self.__closure__
+        )
+
+    def binding_plan(self):
+        """Return the BindingPlan for calls of this function, or None if
+        calls have to be bound by general_callargs().
+
+        The plan is made again if the code or the defaults of the function
+        have been changed since it was made.
+        """
+        code = self.func_code
+        if self.version >= (3, 0):
+            defaults, kwdefaults = self.__defaults__, self.__kwdefaults__
+        else:
+            defaults, kwdefaults = self.func_defaults, None
+        plan = self._plan
+        if (
+            plan is not None
+            and plan.code is code
+            and plan.defaults is defaults
+            and plan.kwdefaults is kwdefaults
+        ):
+            return plan
+        if code is not self.__code__ or not can_plan(code):
+            self._plan = None
+            return None
+        plan = self._plan = BindingPlan(code, defaults, kwdefaults)
+        return plan
+
+    def general_callargs(self, args, kwargs):
+        """Return the dict of the parameters of this function bound to
+        `args` and `kwargs`, or raise the TypeError saying why they can't
+        be."""
+        if self._func and self.version[:2] == PYTHON_VERSION_TRIPLE[:2]:
             # Perhaps this branch can go and we just use the others.
             # It will require a *lot* more code from inspect.py to be added:
             # classes Signature, Parameter, etc.
@@ -255,47 +426,40 @@ class Function:
                 callargs = inspect3.getcallargs(self, *args, **kwargs)
             else:
                 callargs = inspect2.getcallargs(self, *args, **kwargs)
-
-        frame = self._vm.make_frame(
-            self.func_code, callargs, self.func_globals, {}, self.__closure__
-        )
-        if self.__code__.co_flags & CO_GENERATOR:
-            qualname = self.__qualname__ if self._vm.version >= (3, 4) else None
-            gen = Generator(
-                g_frame=frame, name=self.__name__, qualname=qualname, vm=self._vm
-            )
-            if self.__code__.co_flags & CO_ITERABLE_COROUTINE:
-                gen = _AsyncGeneratorWrapper(gen)
-                frame.generator = gen
-                return gen
-
-            frame.generator = gen
-            retval = gen
-        else:
-            retval = self._vm.eval_frame(frame)
-        return retval
+        return callargs
 
 
 # FIXME: go over. Not sure how close This is supposed to be
 # like type.MethodType
 class Method(object):
-    """Create a bound instance method object."""
+    # A bound instance method object, or for Python 2 an unbound one.
+    # Calls of methods made through LOAD_METHOD, and before 3.7 through
+    # LOAD_ATTR and CALL_FUNCTION, don't make one of these; see
+    # ByteOpBase.load_method(). The attributes of the function are looked
+    # up when asked for.
+
+    __slots__ = ("im_self", "im_class", "im_func")
 
     def __init__(self, obj, _class, func):
-        self.__doc__ = obj.__doc__
         self.im_self = obj
         self.im_class = _class
         self.im_func = func
 
-        if hasattr(func, "func_code"):
-            self.func_code = func.func_code
-        if hasattr(func, "__name__"):
-            self.__name__ = func.__name__
-        if hasattr(func, "__code__"):
-            self.__code__ = func.__code__
+    @property
+    def __doc__(self):
+        return self.im_func.__doc__
 
-        # This causes failure
-        # self.__name__ = obj.__name__
+    @property
+    def __name__(self):
+        return self.im_func.__name__
+
+    @property
+    def __code__(self):
+        return self.im_func.__code__
+
+    @property
+    def func_code(self):
+        return self.im_func.func_code
 
     def __repr__(self):  # pragma: no cover
         name = "%s.%s" % (self.im_class.__name__, self.im_func.func_name)
@@ -318,19 +482,15 @@ class Cell(object):
     separate object called a cell.  Frames share references to cells, and
     the LOAD_DEREF and STORE_DEREF opcodes get and set the value from cells.
 
-    This class acts as a cell, though it has to jump through two hoops to make
-    the simulation complete:
-
-        1. In order to create actual FunctionType functions, we have to have
-           actual cell objects, which are difficult to make. See the twisty
-           double-lambda in __init__.
-
-        2. Actual cell objects can't be modified, so to implement STORE_DEREF,
-           we store a one-element list in our cell, and then use [0] as the
-           actual value.
+    Actual cell objects are difficult to make and, before Python 3.7, can't
+    be modified, so we use this class instead. Where an actual cell object
+    is needed, make_cell() makes one.
 
+    The opcode routines get and set `contents` directly.
     """
 
+    __slots__ = ("contents",)
+
     def __init__(self, value):
         self.contents = value
 
@@ -358,6 +518,8 @@ class Block(object):
 
     """
 
+    __slots__ = ("type", "handler", "level")
+
     def __init__(self, type, handler, level):
         self.type = type
         self.handler = handler
@@ -376,6 +538,40 @@ class Block(object):
 
 
 class Frame(object):
+    """The frame of a call of code run by the VM.
+
+    A frame whose call has returned can be set up with start() to run
+    its code again, instead of making a new one; see PyVM.make_frame()
+    and PyVM.recycle_frame().
+    """
+
+    # f_locals is a slot that frames of optimized code leave unset; see
+    # __getattr__().
+    __slots__ = (
+        "f_code",
+        "f_globals",
+        "f_back",
+        "stack",
+        "fast_locals",
+        "_f_locals",
+        "f_locals",
+        "f_trace",
+        "event_flags",
+        "brkpt",
+        "f_builtins",
+        "decoded",
+        "f_lasti",
+        "cells",
+        "block_stack",
+        "generator",
+        "version",
+        "inst_index",
+        "fallthrough",
+        "last_op",
+        "in_traceback",
+        "handled",
+    )
+
     def __init__(
         self,
         f_code,
@@ -384,22 +580,57 @@ class Frame(object):
         f_back,
         version=PYTHON_VERSION_TRIPLE,
         closure=None,
+        fast_locals=None,
     ):
         self.f_code = f_code
-        self.f_globals = f_globals
-        self.f_locals = f_locals
-        self.f_back = f_back
+        self.version = version
         self.stack = []
-        self.f_trace = None
-
-        # event args is used in tracing/debugging callback.
-        self.event_flags = None
+        self.block_stack = []
 
         # brkpt is a mapping bytecode offset to the opcode value that was
         # smasshed by overwriting it with the pseudo opcode BRKPT.
         # After a breakpoint is serviced, this opcode needs to be run.
         self.brkpt = {}
 
+        # The DecodedCode of f_code, which has the line number table that
+        # f_lineno is computed from. PyVM.make_frame() sets this.
+        self.decoded = None
+
+        # Whether a Traceback has this frame. Such a frame is not used
+        # again; see PyVM.recycle_frame().
+        self.in_traceback = False
+
+        self.start(f_globals, f_locals, f_back, closure, fast_locals)
+
+    def start(self, f_globals, f_locals, f_back, closure=None, fast_locals=None):
+        """Set the frame up to run its code from the beginning, with
+        the arguments given as for Frame(). The stack and block stack,
+        which are empty, are kept."""
+        f_code = self.f_code
+        self.f_globals = f_globals
+        self.f_back = f_back
+
+        if f_code.co_flags & CO_OPTIMIZED:
+            # The locals of a function are kept in a list indexed like
+            # co_varnames, with UNBOUND for locals without a value. The
+            # f_locals dict is made from it only when it is asked for;
+            # see __getattr__(). A caller that has bound the arguments
+            # itself passes the list in `fast_locals`.
+            if fast_locals is None:
+                fast_locals = [
+                    f_locals.get(name, UNBOUND) for name in f_code.co_varnames
+                ]
+            self.fast_locals = fast_locals
+            self._f_locals = None
+        else:
+            # A plain attribute, since LOAD_NAME and STORE_NAME use it a lot.
+            self.fast_locals = None
+            self.f_locals = f_locals
+        self.f_trace = None
+
+        # event args is used in tracing/debugging callback.
+        self.event_flags = None
+
         if f_back and f_back.f_globals is f_globals:
             # If we share the globals, we share the builtins.
             self.f_builtins = f_back.f_builtins
@@ -412,48 +643,36 @@ class Frame(object):
                 # No builtins! Make up a minimal one with None.
                 self.f_builtins = {"None": None}
 
-        self.f_lineno = f_code.co_firstlineno
-
         # Python 2.2.3 initializes this to 0. But by 2.4.6 it is initialized to -1.
         # Note that this has to be coordinated with parse_byte_and_args() of pyvm.py
         # and other places which is why we don't set it to the more correct -1.
         self.f_lasti = -1
 
-        if f_code.co_cellvars:
-            self.cells = {}
-            if not f_back.cells:
-                f_back.cells = {}
-            for var in f_code.co_cellvars:
-                # Make a cell for the variable in our locals, or None.
-                cell = Cell(self.f_locals.get(var))
-                f_back.cells[var] = self.cells[var] = cell
+        # The cells of the cell variables and then of the free variables,
+        # indexed by the operand of LOAD_DEREF and friends; see
+        # xpython.instruction.cell_name().
+        if f_code.co_cellvars or f_code.co_freevars:
+            # A cell variable that is an argument starts out with its value.
+            if self.fast_locals is None:
+                cells = [Cell(f_locals.get(var)) for var in f_code.co_cellvars]
+            else:
+                cells = [
+                    Cell(self.argument_value(var)) for var in f_code.co_cellvars
+                ]
+            if closure:
+                cells.extend(closure)
+            else:
+                # FIXME: we should always be given the function's closure.
+                cells.extend(Cell(f_locals.get(var)) for var in f_code.co_freevars)
+            self.cells = cells
         else:
             self.cells = None
 
-        if f_code.co_freevars:
-            if not self.cells:
-                self.cells = {}
-            for i, var in enumerate(f_code.co_freevars):
-                if closure:
-                    # print("XXX", f_code.co_freevars[i], closure[i].get())
-                    # if f_code.co_freevars[i] == "c" and  closure[i].get() == 5:
-                    #     from trepan.api import debug; debug()
-                    self.cells[var] = closure[i]
-                else:
-                    # FIXME: this branch is probably wrong.
-                    # Also check all calls of Frame and make_frame() in vm to ensure we
-                    # pass a function's closure attribute.
-                    assert isinstance(f_back.cells[i], Cell), "f_back.cells[%d]: %r" % (
-                        i,
-                        f_back.cells[i],
-                    )
-                    self.cells[var] = f_back.cells[var]
-                pass
-            pass
-
-        self.block_stack = []
         self.generator = None
-        self.version = version
+
+        # The exception a handler of this frame was entered for and its
+        # traceback then, for a bare raise; see PyVM.reraise().
+        self.handled = None
 
         # These are sentinel or bogus values to start out.
         # eval_frame will adjust inst_index.
@@ -470,38 +689,103 @@ class Frame(object):
             self.f_lasti,
         )
 
-    def line_number(self):
-        """Get the current line number the frame is executing."""
-        # We don't keep f_lineno up to date, so calculate it based on the
-        # instruction address and the line number table.
-        lnotab = self.f_code.co_lnotab
-        byte_increments = six.iterbytes(lnotab[0::2])
-        line_increments = six.iterbytes(lnotab[1::2])
+    def __getattr__(self, name):
+        """Make f_locals for frames that keep their locals in fast_locals.
+
+        Those frames have no f_locals attribute of their own. Each time
+        it is asked for, the dict is brought up to date with the fast
+        locals. Use locals_to_fast() to have changes made to it take
+        effect.
+        """
+        if name != "f_locals":
+            raise AttributeError(
+                "'%s' object has no attribute '%s'" % (type(self).__name__, name)
+            )
+        if self._f_locals is None:
+            self._f_locals = {}
+        self.fast_to_locals()
+        return self._f_locals
+
+    def argument_value(self, name):
+        """Return the value in the fast locals of the argument `name`, or
+        None if `name` is not an argument."""
+        varnames = self.f_code.co_varnames
+        if name in varnames:
+            value = self.fast_locals[varnames.index(name)]
+            if value is not UNBOUND:
+                return value
+        return None
+
+    def fast_to_locals(self):
+        """Copy the fast locals into the f_locals dict, if that has been
+        made."""
+        if self.fast_locals is None:
+            return
+        f_locals = self._f_locals
+        if f_locals is None:
+            return
+        for name, value in zip(self.f_code.co_varnames, self.fast_locals):
+            if value is UNBOUND:
+                f_locals.pop(name, None)
+            else:
+                f_locals[name] = value
 
-        byte_num = 0
-        line_num = self.f_code.co_firstlineno
+    def locals_to_fast(self):
+        """Copy the f_locals dict, if it has been made, back into the fast
+        locals."""
+        if self.fast_locals is None:
+            return
+        f_locals = self._f_locals
+        if f_locals is None:
+            return
+        self.fast_locals[:] = [
+            f_locals.get(name, UNBOUND) for name in self.f_code.co_varnames
+        ]
+
+    @property
+    def f_lineno(self):
+        """The number of the line being run.
+
+        We don't track this as instructions run; it is computed from
+        f_lasti and the line number table when asked for.
+        """
+        return self.line_number_at(self.f_lasti)
+
+    def line_number_at(self, offset):
+        """Return the number of the line of the instruction at `offset`."""
+        if offset < 0:
+            return self.f_code.co_firstlineno
+        decoded = self.decoded
+        if decoded is None:
+            decoded = self.decoded = DecodedCode(
+                self.f_code, get_opcode_module(self.version), self.version
+            )
+        return decoded.line_number_at(offset)
 
-        for byte_incr, line_incr in zip(byte_increments, line_increments):
-            if isinstance(byte_incr, str):
-                byte_incr = ord(byte_incr)
+    def line_number(self):
+        """Get the current line number the frame is executing."""
+        return self.f_lineno
 
-            byte_num += byte_incr
-            if byte_num > self.f_lasti:
-                break
-            if isinstance(line_incr, str):
-                line_incr = ord(line_incr)
 
-            line_num += line_incr
+class Traceback(object):
+    """An entry of a traceback: the instruction that `frame` is running,
+    in front of the entries `tb_next` of the frames it called.
 
-        return line_num
+    An entry is added as an exception leaves each frame; see
+    PyVM.traceback_here(). The line number is only worked out when it is
+    asked for.
+    """
 
+    __slots__ = ("tb_frame", "tb_lasti", "tb_next")
 
-class Traceback(object):
-    def __init__(self, frame):
-        self.tb_next = frame.f_back
-        self.tb_lasti = frame.f_lasti
-        self.tb_lineno = frame.f_lineno
+    def __init__(self, frame, tb_next=None):
         self.tb_frame = frame
+        self.tb_lasti = frame.f_lasti
+        self.tb_next = tb_next
+
+    @property
+    def tb_lineno(self):
+        return self.tb_frame.line_number_at(self.tb_lasti)
 
     # Note: this can be removed when we have our own compatibility traceback.
     def print_tb(self, limit=None, file=stderr):
@@ -510,7 +794,7 @@ class Traceback(object):
         while tb:
             f = tb.tb_frame
             filename = f.f_code.co_filename
-            lineno = f.line_number()
+            lineno = tb.tb_lineno
             print(
                 '  File "%s", line %d, in %s' % (filename, lineno, f.f_code.co_name),
                 file=file,
@@ -523,12 +807,12 @@ class Traceback(object):
 
 
 def traceback_from_frame(frame):
+    """Return a traceback of `frame` and all the frames that called it,
+    each as it is now."""
     tb = None
 
     while frame:
-        next_tb = Traceback(copy(frame))
-        next_tb.tb_next = tb
-        tb = next_tb
+        tb = Traceback(copy(frame), tb)
         frame = frame.f_back
     return tb
 
@@ -541,6 +825,11 @@ class Generator(object):
         self.started = False
         self.finished = False
         self.gi_running = False
+        # The exception being handled in the generator, kept across
+        # yields, and while it runs the one of what resumed it; see
+        # PyVM.enter_generator().
+        self.exc_info = None
+        self.caller_exc_info = None
         self.gi_code = g_frame.f_code
         self.__name__ = g_frame.f_code.co_name
         self.__qualname__ = qualname if g_frame.version >= (3, 4) else None
@@ -556,8 +845,18 @@ class Generator(object):
             raise TypeError("Can't send non-None value to a just-started generator")
         self.gi_frame.stack.append(value)
         self.started = True
-        self.running = True
-        val = self.vm.resume_frame(self.gi_frame)
+        self.running = self.gi_running = True
+        self.vm.enter_generator(self)
+        try:
+            val = self.vm.resume_frame(self.gi_frame)
+        except StopIteration as exc:
+            error = self.stop_iteration_error(exc)
+            if error is None:
+                raise
+            raise error
+        finally:
+            self.gi_running = False
+            self.vm.leave_generator(self)
         if self.finished:
             self.running = False
             raise StopIteration(val)
@@ -565,6 +864,24 @@ class Generator(object):
 
     __next__ = next
 
+    def stop_iteration_error(self, exc):
+        """Return the RuntimeError that StopIteration `exc`, raised out of
+        the generator's frame, is replaced by, as of PEP 479. None is
+        returned before 3.7 without "from __future__ import
+        generator_stop", where `exc` just ends the iteration."""
+        flags = self.gi_code.co_flags
+        if self.gi_frame.version < (3, 7) and not flags & CO_FUTURE_GENERATOR_STOP:
+            return None
+        if flags & CO_ASYNC_GENERATOR:
+            kind = "async generator"
+        elif flags & CO_COROUTINE:
+            kind = "coroutine"
+        else:
+            kind = "generator"
+        error = RuntimeError("%s raised StopIteration" % kind)
+        error.__cause__ = error.__context__ = exc
+        return error
+
 
 if __name__ == "__main__":
     frame = Frame(
@@ -0,0 +1,336 @@
+"""Adaptive specialization ("quickening") of closure-engine instructions.
+
+This follows the scheme of PEP 659. Some of the closures that
+xpython.vmclosure makes start out *adaptive*: they run the instruction
+the general way, and after they have been run a number of times they
+look at the values they are working on. If these have one of the types
+we know about, the adaptive closure replaces itself in the code's list
+of closures with one *specialized* for those types.
+
+A specialized closure checks that its operands still have those types
+(its guard) and then takes a shortcut. Values of the built-in types we
+specialize for can't run code of the program being interpreted, so the
+shortcuts can skip the bookkeeping that is needed when they might, such
+as setting frame.f_lasti. When a guard fails, the closure deoptimizes:
+it puts the adaptive closure back and runs the instruction the general
+way. The adaptive closure then waits longer before it tries again.
+
+We specialize arithmetic on ints, floats and strs, comparisons of those,
+and FOR_ITER over list, range and tuple iterators. Guards cost about as
+much as what they save unless the shortcut is big enough, so e.g. we
+don't specialize LOAD_ATTR for instance attributes: getattr() looks in
+the instance's __dict__ faster than we can.
+
+What happened is counted in PyVM.specialization_stats, a Counter keyed
+by (event, opname, kind) where event is "specialized", "deoptimized" or
+"failed". "kind" is the type specialized for, e.g. "int", and is None
+for failures.
+"""
+
+from collections import Counter
+
+from xpython.byteop.byteop import arithmetic_operator
+
+# Number of runs of an instruction before we first try to specialize it.
+WARMUP = 8
+
+# The most runs we wait before trying again, after failures to specialize
+# or deoptimizations.
+MAX_BACKOFF = 1024
+
+# Types whose values we can specialize for.
+list_iterator = type(iter([]))
+range_iterator = type(iter(range(0)))
+tuple_iterator = type(iter(()))
+
+NUMBER_TYPES = {int: "int", float: "float"}
+SEQUENCE_ITERATOR_TYPES = {
+    list_iterator: "list",
+    range_iterator: "range",
+    tuple_iterator: "tuple",
+}
+
+# The COMPARE_OP operand values for <, <=, ==, !=, > and >=, which for
+# numbers and strings compare without calling back into the program.
+ORDERING_COMPARISONS = frozenset(range(6))
+
+
+def new_stats():
+    """Return an empty Counter for PyVM.specialization_stats."""
+    return Counter()
+
+
+def adaptive(vm, inst, generic, specializer, install):
+    """Return an adaptive closure for `inst`.
+
+    `generic` is the closure that runs the instruction the general way.
+    `specializer(frame, miss)` returns a (kind, closure) pair specialized
+    for the values the instruction is about to work on in `frame`, or None
+    if there is nothing to specialize for. The specialized closure should
+    call `miss(frame)` and return its result when its guard fails.
+    `install(op)` puts closure `op` in the place of this one.
+    """
+    opname = inst.opname
+    stats = vm.specialization_stats
+    # The number of runs left before we next try to specialize, and how
+    # many to wait after that.
+    state = [WARMUP, WARMUP]
+
+    def back_off():
+        state[1] = min(state[1] * 2, MAX_BACKOFF)
+        state[0] = state[1]
+
+    def op(frame):
+        state[0] -= 1
+        if state[0] <= 0:
+            specialized = specializer(frame, miss)
+            if specialized is None:
+                stats["failed", opname, None] += 1
+                back_off()
+            else:
+                kind, special_op = specialized
+                stats["specialized", opname, kind] += 1
+                if getattr(generic, "fused", False):
+                    # Its miss() runs the superinstruction.
+                    special_op.fused = True
+                miss.kind = kind
+                install(special_op)
+        return generic(frame)
+
+    def miss(frame):
+        stats["deoptimized", opname, miss.kind] += 1
+        back_off()
+        install(op)
+        return generic(frame)
+
+    miss.kind = None
+    if getattr(generic, "fused", False):
+        op.fused = True
+    return op
+
+
+# Specializers for the closures made in xpython.vmclosure.
+#
+# Each function here takes the VM and the list of instructions the closure
+# runs, which has more than one for superinstructions, and returns a
+# specializer for adaptive() above, or None.
+#
+# Specialized closures set frame.f_lasti only before operations that can
+# fail. An exception from a closure that is not a superinstruction is
+# attributed to the instruction whose closure it is anyway.
+
+
+def binary_op(vm, insts):
+    (inst,) = insts
+    fn = arithmetic_operator(inst.opname)[0]
+    next_offset = inst.next_offset
+    is_add = inst.opname.endswith("_ADD")
+
+    def specializer(frame, miss):
+        stack = frame.stack
+        x, y = stack[-2], stack[-1]
+        t = x.__class__
+        if y.__class__ is not t:
+            return None
+        if t is str and is_add:
+            kind = "str"
+        elif t in NUMBER_TYPES:
+            kind = NUMBER_TYPES[t]
+        else:
+            return None
+
+        if is_add:
+
+            def op(frame):
+                stack = frame.stack
+                y = stack.pop()
+                x = stack[-1]
+                if x.__class__ is t and y.__class__ is t:
+                    stack[-1] = x + y
+                    return next_offset
+                stack.append(y)
+                return miss(frame)
+
+        else:
+
+            def op(frame):
+                stack = frame.stack
+                y = stack.pop()
+                x = stack[-1]
+                if x.__class__ is t and y.__class__ is t:
+                    stack[-1] = fn(x, y)
+                    return next_offset
+                stack.append(y)
+                return miss(frame)
+
+        return kind, op
+
+    return specializer
+
+
+def COMPARE_OP(vm, insts):
+    (inst,) = insts
+    compare = vm.byteop.COMPARE_OPERATORS[inst.int_arg]
+    next_offset = inst.next_offset
+    if inst.int_arg not in ORDERING_COMPARISONS:
+        return None
+
+    def specializer(frame, miss):
+        kind, t = comparison_kind(frame.stack)
+        if kind is None:
+            return None
+
+        def op(frame):
+            stack = frame.stack
+            y = stack.pop()
+            x = stack[-1]
+            if x.__class__ is t and y.__class__ is t:
+                stack[-1] = compare(x, y)
+                return next_offset
+            stack.append(y)
+            return miss(frame)
+
+        return kind, op
+
+    return specializer
+
+
+def comparison_kind(stack):
+    """Return the kind of comparison of the two values on top of `stack`
+    that we specialize, and their type; or None, None."""
+    x, y = stack[-2], stack[-1]
+    t = x.__class__
+    if y.__class__ is not t:
+        return None, None
+    if t is str:
+        return "str", t
+    if t in NUMBER_TYPES:
+        return NUMBER_TYPES[t], t
+    return None, None
+
+
+def COMPARE_OP_JUMP(vm, insts):
+    """The COMPARE_OP superinstruction made by
+    xpython.vmclosure.COMPARE_OP_JUMP()."""
+    if insts[0].int_arg not in ORDERING_COMPARISONS:
+        return None
+    compare = vm.byteop.COMPARE_OPERATORS[insts[0].int_arg]
+    jump = insts[1]
+    pop = jump.opname.startswith("POP_")
+    if jump.opname.endswith("_TRUE"):
+        true_offset, false_offset = jump.jump_target, jump.next_offset
+    else:
+        true_offset, false_offset = jump.next_offset, jump.jump_target
+
+    def specializer(frame, miss):
+        kind, t = comparison_kind(frame.stack)
+        if kind is None:
+            return None
+
+        # The result of comparing these is a bool, so testing it can't
+        # fail either.
+        if pop:
+
+            def op(frame):
+                stack = frame.stack
+                y = stack[-1]
+                x = stack[-2]
+                if x.__class__ is t and y.__class__ is t:
+                    del stack[-2:]
+                    if compare(x, y):
+                        return true_offset
+                    return false_offset
+                return miss(frame)
+
+        else:
+
+            def op(frame):
+                stack = frame.stack
+                y = stack.pop()
+                x = stack[-1]
+                if x.__class__ is t and y.__class__ is t:
+                    result = stack[-1] = compare(x, y)
+                    if result:
+                        return true_offset
+                    return false_offset
+                stack.append(y)
+                return miss(frame)
+
+        return kind, op
+
+    return specializer
+
+
+def LOAD_FAST_LOAD_CONST_BINARY(vm, insts):
+    """The LOAD_FAST LOAD_CONST <binary op> superinstruction made by
+    xpython.vmclosure.LOAD_FAST_LOAD_CONST_BINARY()."""
+    fn = arithmetic_operator(insts[2].opname)[0]
+    offset = insts[2].offset
+    i, const = insts[0].int_arg, insts[1].arguments[0]
+    next_offset = insts[-1].next_offset
+    t = const.__class__
+    is_add = insts[2].opname.endswith("_ADD")
+    if t is str and is_add:
+        kind = "str"
+    elif t in NUMBER_TYPES:
+        kind = NUMBER_TYPES[t]
+    else:
+        return None
+
+    # A local without a value is UNBOUND, which is not a t either.
+    def specializer(frame, miss):
+        if frame.fast_locals[i].__class__ is not t:
+            return None
+
+        if is_add:
+
+            def op(frame):
+                x = frame.fast_locals[i]
+                if x.__class__ is t:
+                    frame.stack.append(x + const)
+                    return next_offset
+                return miss(frame)
+
+        else:
+
+            def op(frame):
+                x = frame.fast_locals[i]
+                if x.__class__ is t:
+                    # e.g. division by zero
+                    frame.f_lasti = offset
+                    frame.stack.append(fn(x, const))
+                    return next_offset
+                return miss(frame)
+
+        return kind, op
+
+    return specializer
+
+
+def FOR_ITER(vm, insts):
+    (inst,) = insts
+    target = inst.jump_target
+    next_offset = inst.next_offset
+
+    def specializer(frame, miss):
+        t = frame.stack[-1].__class__
+        if t not in SEQUENCE_ITERATOR_TYPES:
+            return None
+
+        def op(frame):
+            stack = frame.stack
+            iterator = stack[-1]
+            if iterator.__class__ is t:
+                # A "for" statement is the cheapest way to get one item. It
+                # calls iter(iterator), which is the iterator itself for the
+                # types we specialize for.
+                for v in iterator:
+                    stack.append(v)
+                    return next_offset
+                stack.pop()
+                return target
+            return miss(frame)
+
+        return SEQUENCE_ITERATOR_TYPES[t], op
+
+    return specializer
@@ -2,11 +2,13 @@
 Compatibility of built-in functions between different Python versions.
 """
 
+import types
 from typing import Any, Callable
 
 from xdis.version_info import PYTHON_VERSION_TRIPLE
 
 if PYTHON_VERSION_TRIPLE >= (3, 0):
+    import builtins as host_builtins
     import importlib
     from builtins import input
     from functools import reduce
@@ -19,8 +21,39 @@ if PYTHON_VERSION_TRIPLE >= (3, 0):
     from io import open
     from sys import intern
 else:
+    import __builtin__ as host_builtins
+
     import_fn = __import__
 
+# The namespaces made by compatible_builtins(), keyed by target version.
+# These are only ever copied, so no run of code sees or changes them.
+_compatible_namespaces = {}
+
+
+def compatible_builtins(target_python: tuple) -> types.ModuleType:
+    """
+    Return a builtins module for running bytecode of Python version
+    `target_python`, to be used as __builtins__ in its globals.
+
+    The module has the host's builtins and the compatible functions that
+    make_compatible_builtins() adds for the target version. Those are
+    worked out once per version; each call returns a new module with a
+    copy of them, so what one run does to its builtins isn't seen by the
+    next. The host's builtins are not changed, so code of several versions
+    can be run in one process.
+    """
+    if type(target_python) is not tuple:
+        target_python = (int(str(target_python)[0]), int(str(target_python)[2]))
+    key = target_python[:2]
+    namespace = _compatible_namespaces.get(key)
+    if namespace is None:
+        namespace = dict(host_builtins.__dict__)
+        make_compatible_builtins(namespace, target_python)
+        _compatible_namespaces[key] = namespace
+    module = types.ModuleType(host_builtins.__name__)
+    module.__dict__.update(namespace)
+    return module
+
 
 def make_compatible_builtins(builtins: dict, target_python: tuple):
     """
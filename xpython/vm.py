@@ -4,33 +4,36 @@
 import linecache
 import logging
 import sys
+from collections import Counter
 
 import six
 from six.moves import reprlib
 
 from xdis import (
-    code2num,
     CO_NEWLOCALS,
+    CO_OPTIMIZED,
     PYTHON3,
     PYTHON_VERSION_TRIPLE,
     IS_PYPY,
-    op_has_argument,
-    next_offset,
 )
 from xdis.op_imports import get_opcode_module
-from xdis.opcodes.opcode_311 import _nb_ops
 
-from xpython.pyobj import Frame, Block, Traceback, traceback_from_frame
+from xpython.pyobj import Frame, Block, Generator, Traceback
 from xpython.byteop import get_byteop
+from xpython.cfg import control_flow_graph
+from xpython.instruction import DecodedCode, cell_name, decode_instruction
+from xpython.quicken import new_stats
+from xpython.vmclosure import eval_frame_closure
 
 PY2 = not PYTHON3
 log = logging.getLogger(__name__)
 
-if PYTHON3:
-    def byteint(b):
-        return b
-else:
-    byteint = ord
+# Values for the "engine" parameter of PyVM.
+ENGINES = ("classic", "closure")
+
+# The most frames of a code object kept to be used again; see
+# PyVM.recycle_frame().
+MAX_FREE_FRAMES = 16
 
 LINE_NUMBER_WIDTH = 4
 LINE_NUMBER_WIDTH_FMT = "L. %%-%dd@" % LINE_NUMBER_WIDTH
@@ -82,7 +85,10 @@ class PyVMUncaughtException(Exception):
         assert (
             len(exception) == 3
         ), "Expecting exception tuple to have 3 args: type, args, traceback"
-        return cls(*exception)
+        exctype, value, traceback = exception
+        if isinstance(value, BaseException):
+            value = value.args
+        return cls(exctype, value, traceback)
 
     pass
 
@@ -120,6 +126,8 @@ def format_instruction(
         argrepr = ""
     elif byte_code in opc.COMPARE_OPS:
         argrepr = opc.cmp_op[int_arg]
+    elif byte_code in opc.FREE_OPS and code is not None:
+        argrepr = cell_name(code, int_arg)
     elif isinstance(arguments, list) and arguments:
         argrepr = arguments[0]
     else:
@@ -143,6 +151,8 @@ class PyVM(object):
         is_pypy=IS_PYPY,
         vmtest_testing=False,
         format_instruction_func=format_instruction,
+        engine="classic",
+        native_threshold=None,
     ):
         # The call stack of frames.
         self.frames = []
@@ -152,10 +162,48 @@ class PyVM(object):
         self.last_exception = None
         self.last_traceback_limit = None
         self.last_traceback = None
+        # The exception that last_traceback is for; see traceback_here().
+        self.traceback_exception = None
         self.version = python_version
         self.is_pypy = is_pypy
         self.format_instruction = format_instruction_func
 
+        # How we run frames: "classic" is the loop in eval_frame() below,
+        # "closure" runs code translated into closures by xpython.vmclosure.
+        if engine not in ENGINES:
+            raise PyVMError(
+                "Unknown engine %r; should be one of: %s" % (engine, ", ".join(ENGINES))
+            )
+        self.engine = engine
+        # Why the last frame run by the closure engine stopped.
+        self.frame_why = None
+        # What the closure engine's specialization of instructions has
+        # done; see xpython.quicken.
+        self.specialization_stats = new_stats()
+        # Every LOAD_METHOD cache made; see xpython.methodcache.
+        self.method_caches = []
+        # How many frames make_frame() has made ("made") and how many
+        # it has set up again from the frames of returned calls
+        # ("reused"); see recycle_frame().
+        self.frame_stats = Counter()
+
+        # When not None, functions whose code has been called or jumped
+        # back in this many times are run natively when they can be; see
+        # xpython.native.
+        if native_threshold is not None and (
+            not isinstance(native_threshold, int) or native_threshold < 0
+        ):
+            raise PyVMError(
+                "native_threshold should be None or a non-negative integer; got %r"
+                % (native_threshold,)
+            )
+        self.native_threshold = native_threshold
+
+        # How many calls of hot functions are being run natively, and how
+        # many there is room for on the host stack; see xpython.native.
+        self.native_depth = 0
+        self.native_limit = 0
+
         # FIXME: until we figure out how to fix up test/vmtest.el
         # This changes how we report a VMRuntime error.
         self.vmtest_testing = vmtest_testing
@@ -163,11 +211,30 @@ class PyVM(object):
         # Like sys.exc_info() tuple
         self.last_exception = None
 
+        # From 3.11, the exception being handled, along with its
+        # traceback, as note_handled() saves it, or None. PUSH_EXC_INFO
+        # and POP_EXCEPT keep the ones of the handlers it was entered
+        # inside on the stack. As in CPython, a generator has its own
+        # while it runs; see enter_generator().
+        self.exc_info = None
+
         # Sometimes we need a native function (e.g. for method lookup), but
         # most of the time we want a VM function defined in pyobj.
         # This maps between the two.
         self.fn2native = {}
 
+        # Calls of interpreted functions are run in the loop of
+        # eval_frame() that runs the calling frame, instead of by a
+        # recursive eval_frame(). The routine of the call instruction puts
+        # the frame for the call here; see
+        # ByteOpBase.call_function_with_args_resolved().
+        self.inline_calls = True
+        self.call_frame = None
+
+        # Decoded instructions of code objects we have run, keyed by the id
+        # of the code object. See get_decoded().
+        self.decoded_code = {}
+
         self.in_exception_processing = False
 
         # This is somewhat hokey:
@@ -199,10 +266,8 @@ class PyVM(object):
     def peek(self, n):
         if n <= 0:
             raise PyVMError("Peek value must be greater than 0")
-        try:
-            return self.frame.stack[-n]
-        except Exception:
-            return 0
+        stack = self.frame.stack
+        return stack[-n] if n <= len(stack) else 0
 
     def pop(self, i=0):
         """Pop a value from the stack.
@@ -220,14 +285,19 @@ class PyVM(object):
 
         """
         if n:
-            ret = self.frame.stack[-n:]
-            self.frame.stack[-n:] = []
+            stack = self.frame.stack
+            ret = stack[-n:]
+            del stack[-n:]
             return ret
         else:
             return []
 
     def push(self, *vals):
-        """Push values onto the value stack."""
+        """Push values onto the value stack.
+
+        Opcode routines that push a single value append to
+        `self.frame.stack` directly, which avoids building the `vals` tuple.
+        """
         self.frame.stack.extend(vals)
 
     def set(self, i: int, value):
@@ -249,6 +319,52 @@ class PyVM(object):
             level = len(self.frame.stack)
         self.frame.block_stack.append(Block(type, handler, level))
 
+    def setup_block(self, type, handler):
+        """Push the block of the SETUP_* instruction being run, of type
+        `type` with handler offset `handler`.
+
+        Blocks aren't changed once made, and a SETUP_* instruction of a code
+        object runs at the same stack level each time, so its block is made
+        once and kept in DecodedCode.setup_blocks, rather than made anew for
+        each loop run or "try" statement entered.
+        """
+        frame = self.frame
+        decoded = frame.decoded
+        if decoded is None:
+            decoded = self.get_decoded(frame)
+        level = len(frame.stack)
+        block = decoded.setup_blocks.get(frame.f_lasti)
+        if block is None or block.level != level:
+            block = decoded.setup_blocks[frame.f_lasti] = Block(type, handler, level)
+        frame.block_stack.append(block)
+
+    def exit_loop(self):
+        """For the BREAK_LOOP or CONTINUE_LOOP being run, pop the blocks
+        above its loop and return the loop's block, when the control-flow
+        graph found them all to be "try" blocks with no "finally" part.
+        Nothing runs on the way out of those, so the block stack needn't
+        be unwound one "why" at a time.
+
+        Otherwise, or if the block stack has a block the graph doesn't
+        know about, such as the one of an "except" clause being run,
+        return None and leave the block stack as it is.
+        """
+        frame = self.frame
+        decoded = frame.decoded
+        if decoded is None:
+            decoded = self.get_decoded(frame)
+        above = control_flow_graph(decoded).loop_exits.get(frame.f_lasti)
+        block_stack = frame.block_stack
+        if above is None or len(block_stack) <= above:
+            return None
+        loop = block_stack[-above - 1]
+        if loop.type != "loop":
+            return None
+        if above:
+            del frame.stack[block_stack[-above].level :]
+            del block_stack[-above:]
+        return loop
+
     def top_block(self):
         return self.frame.block_stack[-1]
 
@@ -276,18 +392,28 @@ class PyVM(object):
         self.frame.fallthrough = False
 
     def make_frame(
-        self, code, callargs={}, f_globals=None, f_locals=None, closure=None
+        self,
+        code,
+        callargs={},
+        f_globals=None,
+        f_locals=None,
+        closure=None,
+        fast_locals=None,
     ):
         # The callargs default is safe because we never modify the dict.
         # pylint: disable=dangerous-default-value
-
-        log.debug(
-            "make_frame: code=%r, callargs=%s, f_globals=%r, f_locals=%r",
-            code,
-            repper(callargs),
-            (type(f_globals), id(f_globals)),
-            (type(f_locals), id(f_locals)),
-        )
+        # A caller that has bound the arguments into the list of fast
+        # locals of optimized code passes that as `fast_locals`, instead of
+        # `callargs`; see xpython.callargs.
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "make_frame: code=%r, callargs=%s, f_globals=%r, f_locals=%r",
+                code,
+                repper(callargs),
+                (type(f_globals), id(f_globals)),
+                (type(f_locals), id(f_locals)),
+            )
         if f_globals is not None:
             f_globals = f_globals
             if f_locals is None:
@@ -305,22 +431,40 @@ class PyVM(object):
                 "__package__": None,
             }
 
-        # Implement NEWLOCALS flag. See Objects/frameobject.c in CPython.
-        if code.co_flags & CO_NEWLOCALS:
-            f_locals = {"__locals__": {}}
-
-        f_locals.update(callargs)
-        frame = Frame(
-            f_code=code,
-            f_globals=f_globals,
-            f_locals=f_locals,
-            f_back=self.frame,
-            version=self.version,
-            closure=closure,
-        )
-
-        # THINK ABOUT: should this go into making the frame?
-        frame.linestarts = dict(self.opc.findlinestarts(code, dup_lines=True))
+        if code.co_flags & CO_OPTIMIZED:
+            # Frame puts the arguments into its fast locals.
+            f_locals = callargs
+        else:
+            # Implement NEWLOCALS flag. See Objects/frameobject.c in CPython.
+            if code.co_flags & CO_NEWLOCALS:
+                f_locals = {"__locals__": {}}
+
+            f_locals.update(callargs)
+
+        decoded = self.decoded_code.get(id(code))
+        if (
+            decoded is not None
+            and decoded.free_frames
+            and decoded.code is code
+            and decoded.co_code is code.co_code
+        ):
+            frame = decoded.free_frames.pop()
+            frame.start(f_globals, f_locals, self.frame, closure, fast_locals)
+            self.frame_stats["reused"] += 1
+        else:
+            frame = Frame(
+                f_code=code,
+                f_globals=f_globals,
+                f_locals=f_locals,
+                f_back=self.frame,
+                version=self.version,
+                closure=closure,
+                fast_locals=fast_locals,
+            )
+            self.frame_stats["made"] += 1
+
+            # THINK ABOUT: should this go into making the frame?
+            frame.decoded = self.get_decoded(frame)
 
         log.debug("%r", frame)
         return frame
@@ -336,6 +480,32 @@ class PyVM(object):
         else:
             self.frame = None
 
+    def recycle_frame(self, frame):
+        """Keep `frame`, whose call has just returned, so that
+        make_frame() can set it up for a later call of the same code.
+
+        This is only done for the frames of calls run in the loop of
+        the caller, which are not generators or coroutines. Closures have
+        the cells of a frame rather than the frame, so nothing else has
+        them once they return, unless a traceback does. A frame in a
+        traceback or with a breakpoint set is not kept.
+        """
+        decoded = frame.decoded
+        if (
+            frame.stack
+            or frame.block_stack
+            or frame.brkpt
+            or frame.in_traceback
+            or decoded is None
+            or len(decoded.free_frames) >= MAX_FREE_FRAMES
+        ):
+            return
+        # Don't keep the values of the call alive.
+        if frame.fast_locals is None:
+            frame.f_locals = None
+        frame.f_back = frame.fast_locals = frame._f_locals = frame.cells = None
+        decoded.free_frames.append(frame)
+
     def print_frames(self):
         """Print the call stack for debugging. Note that the
         format exactly the same as in traceback.print_tb()
@@ -367,6 +537,121 @@ class PyVM(object):
         frame.f_back = None
         return val
 
+    def enter_generator(self, gen):
+        """Make the exception being handled that of generator `gen`,
+        which is about to run, keeping the one it replaces."""
+        gen.caller_exc_info = self.exc_info
+        self.exc_info = gen.exc_info
+
+    def leave_generator(self, gen):
+        """Keep the exception being handled in generator `gen`, which has
+        stopped running, and go back to the one of what resumed it."""
+        gen.exc_info = self.exc_info
+        self.exc_info = gen.caller_exc_info
+        gen.caller_exc_info = None
+
+    def resume_generator(self, gen, value):
+        """Set up the frame of generator `gen` to be resumed with `value`
+        in the loop of the current frame, which is running a FOR_ITER or
+        YIELD_FROM on it, the way a call of an interpreted function is.
+        Return "call" if so; see generator_to_caller() for what happens
+        when it stops. Return None if the generator has to be resumed by
+        its send() instead.
+
+        A generator that is itself delegating to another one with "yield
+        from" is not resumed just to run its YIELD_FROM again: its frame
+        is pushed as it is, and the innermost generator of the chain is
+        the one resumed.
+        """
+        if (
+            gen.__class__ is not Generator
+            or gen.vm is not self
+            or gen.finished
+            or gen.gi_running
+            or not self.inline_calls
+            or (value is not None and not gen.started)
+        ):
+            return None
+        # How far YIELD_FROM is past the f_lasti of a generator stopped
+        # in it; see ByteOp33.YIELD_FROM.
+        step = 2 if self.version >= (3, 6) else 1
+        caller = self.frame
+        while True:
+            frame = gen.gi_frame
+            gen.started = gen.gi_running = True
+            self.enter_generator(gen)
+            frame.f_back = caller
+            if frame.f_lasti == -1 or not frame.stack:
+                break
+            inner = frame.stack[-1]
+            if (
+                inner.__class__ is not Generator
+                or inner.vm is not self
+                or inner.finished
+                or inner.gi_running
+                or (value is not None and not inner.started)
+            ):
+                break
+            decoded = frame.decoded
+            if decoded is None:
+                decoded = self.get_decoded(frame)
+            instructions = decoded.instructions
+            offset = frame.f_lasti + step
+            inst = instructions[offset] if offset < len(instructions) else None
+            if inst is None or inst.opname != "YIELD_FROM":
+                break
+            # Leave the frame as if it were running its YIELD_FROM.
+            frame.f_lasti = offset
+            self.push_frame(frame)
+            caller = frame
+            gen = inner
+        frame.stack.append(value)
+        self.call_frame = frame
+        return "call"
+
+    def generator_to_caller(self, done, frame, why):
+        """Give what generator frame `done`, resumed by resume_generator(),
+        has stopped with for reason `why` to `frame`, the frame that
+        resumed it, as its FOR_ITER or YIELD_FROM would have got it from
+        the generator's send().
+
+        Return the reason `frame` stops in turn, or None if it carries on.
+        A YIELD_FROM yields what the generator yields.
+        """
+        done.generator.gi_running = False
+        self.leave_generator(done.generator)
+        done.f_back = None
+        decoded = frame.decoded
+        if decoded is None:
+            decoded = self.get_decoded(frame)
+        inst = decoded.instructions[frame.f_lasti]
+        if why == "yield":
+            if inst.opname == "YIELD_FROM":
+                # To run the YIELD_FROM again when resumed, as
+                # ByteOp33.YIELD_FROM does.
+                frame.f_lasti -= 2 if self.version >= (3, 6) else 1
+                return "yield"
+            frame.stack.append(self.return_value)
+            return None
+        if why == "exception":
+            if not issubclass(self.last_exception[0], StopIteration):
+                return why
+            exc = self.last_exception[1]
+            error = done.generator.stop_iteration_error(exc)
+            if error is not None:
+                self.last_exception = RuntimeError, error, None
+                return why
+            # As if send() had raised it: the iteration is over.
+            self.in_exception_processing = False
+            self.return_value = exc.value if isinstance(exc, StopIteration) else None
+        if inst.opname == "YIELD_FROM":
+            frame.stack[-1] = self.return_value
+        else:
+            frame.stack.pop()
+            frame.f_lasti = inst.jump_target
+            frame.fallthrough = False
+        return None
+
     ##############################################
     # End Frame operations.
     ##############################################
@@ -401,109 +686,76 @@ class PyVM(object):
         return val
 
     def unwind_block(self, block):
+        stack = self.frame.stack
         if block.type == "except-handler":
-            offset = 3
+            del stack[block.level + 3 :]
+            tb, value, exctype = self.popn(3)
+            self.last_exception = exctype, value, tb
         else:
-            offset = 0
+            del stack[block.level :]
 
-        while len(self.frame.stack) > block.level + offset:
-            self.pop()
+    def native_allowed(self):
+        """Return True if hot functions may be run natively now. See
+        xpython.native for when that is."""
+        return not log.isEnabledFor(logging.INFO)
 
-        if block.type == "except-handler":
-            tb, value, exctype = self.popn(3)
-            self.last_exception = exctype, value, tb
+    def get_decoded(self, frame):
+        """Return the DecodedCode for the code that `frame` runs.
+
+        Decoding is done once per code object. Breakpoints replace the
+        bytecode of a code object, so we check that what we have cached
+        is still for the bytecode we see now.
+        """
+        code = frame.f_code
+        decoded = self.decoded_code.get(id(code))
+        if (
+            decoded is None
+            or decoded.code is not code
+            or decoded.co_code is not code.co_code
+        ):
+            decoded = DecodedCode(code, self.opc, self.version, frame.brkpt)
+            self.decoded_code[id(code)] = decoded
+        return decoded
 
     def parse_byte_and_args(self, byte_code, replay=False):
         """Parse 1 - 3 bytes of bytecode into
         an instruction and optionally arguments.
 
-        Argument replay is used to handle breakpoints.
+        Argument replay is used to handle breakpoints. In that case
+        `byte_code` is the opcode to use in place of the one at the
+        current offset.
         """
 
         f = self.frame
-        f_code = f.f_code
-        co_code = f_code.co_code
-        extended_arg = 0
-
-        # Note: There is never more than one argument.
-        # The list size is used to indicate whether an argument
-        # exists or not.
-        # FIMXE: remove and use int_arg as a indicator of whether
-        # the argument exists.
-        arguments = []
-        int_arg = None
-
-        while True:
-            if f.fallthrough:
-                if not replay:
-                    f.f_lasti = next_offset(byte_code, self.opc, f.f_lasti)
-            else:
-                # Jump instructions must set this False.
-                f.fallthrough = True
-            offset = f.f_lasti
-            line_number = self.frame.linestarts.get(offset, None)
-            if line_number is not None:
-                f.f_lineno = line_number
+        decoded = self.get_decoded(f)
+        if f.fallthrough:
             if not replay:
-                byte_code = byteint(co_code[offset])
-            bytecode_name = self.opc.opname[byte_code]
-            arg_offset = offset + 1
-            arg = None
-
-            if op_has_argument(byte_code, self.opc):
-                if self.version >= (3, 6):
-                    int_arg = code2num(co_code, arg_offset) | extended_arg
-                    # Note: Python 3.6.0a1 is 2, for 3.6.a3 and beyond we have 1
-                    arg_offset += 1
-                    if byte_code == self.opc.EXTENDED_ARG:
-                        extended_arg = int_arg << 8
-                        continue
-                    else:
-                        extended_arg = 0
-                else:
-                    int_arg = (
-                        code2num(co_code, arg_offset)
-                        + code2num(co_code, arg_offset + 1) * 256
-                        + extended_arg
-                    )
-                    arg_offset += 2
-                    if byte_code == self.opc.EXTENDED_ARG:
-                        extended_arg = int_arg * 65536
-                        continue
-                    else:
-                        extended_arg = 0
-
-                if byte_code in self.opc.CONST_OPS:
-                    arg = f_code.co_consts[int_arg]
-                elif byte_code in self.opc.FREE_OPS:
-                    if int_arg < len(f_code.co_cellvars):
-                        arg = f_code.co_cellvars[int_arg]
-                    else:
-                        var_idx = int_arg - len(f.f_code.co_cellvars)
-                        arg = f_code.co_freevars[var_idx]
-                elif byte_code in self.opc.NAME_OPS:
-                    arg = f_code.co_names[int_arg]
-                elif byte_code in self.opc.JREL_OPS:
-                    # Many relative jumps are conditional,
-                    # so setting f.fallthrough is wrong.
-                    if self.version >= (3, 10, 0):
-                        int_arg += int_arg
-                    arg = arg_offset + int_arg
-                elif byte_code in self.opc.JABS_OPS:
-                    # We probably could set fallthough, since many (all?)
-                    # of these are unconditional, but we'll make the jump do
-                    # the work of setting.
-                    if self.version >= (3, 10, 0):
-                        int_arg += int_arg
-                    arg = int_arg
-                elif byte_code in self.opc.LOCAL_OPS:
-                    arg = f_code.co_varnames[int_arg]
-                else:
-                    arg = int_arg
-                arguments = [arg]
-            break
-
-        return bytecode_name, byte_code, int_arg, arguments, offset, line_number
+                f.f_lasti = decoded.instruction_at(f.f_lasti).next_offset
+        else:
+            # Jump instructions must set this False.
+            f.fallthrough = True
+
+        if replay:
+            inst = decode_instruction(
+                f.f_code,
+                f.f_lasti,
+                self.opc,
+                self.version,
+                decoded.linestarts,
+                byte_code,
+            )
+        else:
+            inst = decoded.instruction_at(f.f_lasti)
+        f.f_lasti = inst.offset
+
+        return (
+            inst.opname,
+            inst.opcode,
+            inst.int_arg,
+            inst.arguments,
+            inst.offset,
+            inst.line_number,
+        )
 
     def log(self, bytecode_name, int_arg, arguments, offset, line_number):
         """Log arguments, block stack, and data stack for each opcode."""
@@ -526,82 +778,164 @@ class PyVM(object):
         log.debug("  %sblocks     : %s" % (indent, block_stack_rep))
         log.info("%s%s" % (indent, op))
 
-    def dispatch(self, bytecode_name, int_arg, arguments, offset, line_number):
-        """Dispatch by bytecode_name to the corresponding methods.
-        Exceptions are caught and set on the virtual machine."""
+    def dispatch(
+        self, bytecode_name, int_arg, arguments, offset, line_number, opcode=None
+    ):
+        """Dispatch by opcode to the corresponding methods.
+        Exceptions are caught and set on the virtual machine.
+
+        `opcode` is the opcode for `bytecode_name`. When it is not given,
+        it is looked up from the name.
+        """
 
         why = None
         self.in_exception_processing = False
-        byteop = self.byteop
+        if opcode is None:
+            opcode = self.opc.opmap.get(bytecode_name)
         try:
-            if bytecode_name.startswith("UNARY_"):
-                byteop.unaryOperator(bytecode_name[6:])
-            elif bytecode_name.startswith("BINARY_"):
-                if self.version < (3, 11):
-                    byteop.binaryOperator(bytecode_name[7:])
-                else:
-                    byteop.binaryOperator(_nb_ops[int_arg][0][3:])
-
-            elif bytecode_name.startswith("INPLACE_"):
-                byteop.inplaceOperator(bytecode_name[8:])
-            elif "SLICE+" in bytecode_name:
-                self.sliceOperator(bytecode_name)
+            if opcode is None:
+                bytecode_fn = None
             else:
-                # dispatch
-                if hasattr(byteop, bytecode_name):
-                    bytecode_fn = getattr(byteop, bytecode_name, None)
-                else:
-                    bytecode_fn = None
-                if not bytecode_fn:  # pragma: no cover
-                    raise PyVMError(
-                        "Unknown bytecode type: %s\n\t%s"
-                        % (
-                            self.format_instruction(
-                                self.frame,
-                                self.opc,
-                                bytecode_name,
-                                int_arg,
-                                arguments,
-                                offset,
-                                line_number,
-                                False,
-                            ),
+                bytecode_fn = self.byteop.dispatch_table[opcode]
+            if not bytecode_fn:  # pragma: no cover
+                raise PyVMError(
+                    "Unknown bytecode type: %s\n\t%s"
+                    % (
+                        self.format_instruction(
+                            self.frame,
+                            self.opc,
                             bytecode_name,
-                        )
+                            int_arg,
+                            arguments,
+                            offset,
+                            line_number,
+                            False,
+                        ),
+                        bytecode_name,
                     )
-                why = bytecode_fn(*arguments)
+                )
+            why = bytecode_fn(*arguments)
 
         except Exception:
-            # Deal with exceptions encountered while executing the op.
+            # Deal with exceptions encountered while executing the op. This
+            # can also be one that came out of a frame run by a recursive
+            # eval_frame(), which note_exception() adds this frame to the
+            # traceback of.
             self.last_exception = sys.exc_info()
-
-            # FIXME: dry code
-            if not self.in_exception_processing:
-                if self.last_exception[0] != SystemExit:
-                    log.info(
-                        (
-                            "exception in the execution of "
-                            "instruction:\n\t%s"
-                            % self.format_instruction(
-                                self.frame,
-                                self.opc,
-                                bytecode_name,
-                                int_arg,
-                                arguments,
-                                offset,
-                                line_number,
-                                False,
-                            )
-                        )
-                    )
-                if not self.last_traceback:
-                    self.last_traceback = traceback_from_frame(self.frame)
-                self.in_exception_processing = True
+            self.note_exception(
+                self.frame,
+                bytecode_name,
+                int_arg,
+                arguments,
+                offset,
+                line_number,
+            )
 
             why = "exception"
 
         return why
 
+    def note_exception(
+        self, frame, bytecode_name, int_arg, arguments, offset, line_number
+    ):
+        """Log the exception in self.last_exception, which came about in
+        running the given instruction of `frame`, and add `frame` to its
+        traceback."""
+        if self.last_exception[0] != SystemExit and log.isEnabledFor(logging.INFO):
+            log.info(
+                "exception in the execution of instruction:\n\t%s",
+                self.format_instruction(
+                    frame,
+                    self.opc,
+                    bytecode_name,
+                    int_arg,
+                    arguments,
+                    offset,
+                    line_number,
+                    False,
+                ),
+            )
+        self.traceback_here(frame, self.last_exception[1])
+
+    def traceback_here(self, frame, exception):
+        """Add the instruction `frame` is running to the front of
+        last_traceback, the traceback of `exception`, and return that.
+
+        As with CPython's PyTraceBack_Here(), this is done in each frame
+        that the exception comes out of or passes through, so an exception
+        caught where it is raised costs one entry. A traceback is started
+        for an exception other than the one being handled.
+        """
+        tb = self.last_traceback
+        if (
+            tb is not None
+            and self.in_exception_processing
+            and exception is self.traceback_exception
+        ):
+            if tb.tb_frame is frame and tb.tb_lasti == frame.f_lasti:
+                # Already noted.
+                return tb
+        else:
+            tb = None
+        frame.in_traceback = True
+        self.last_traceback = Traceback(frame, tb)
+        self.traceback_exception = exception
+        self.in_exception_processing = True
+        return self.last_traceback
+
+    def note_handled(self, frame):
+        """Save the exception a handler of `frame` is about to be entered
+        for, along with its traceback, for reraise()."""
+        value = self.last_exception[1]
+        if value is self.traceback_exception:
+            frame.handled = value, self.last_traceback
+        else:
+            frame.handled = value, None
+
+    def reraise(self, frame):
+        """A bare raise in `frame` raises the exception being handled
+        again. Its traceback goes on from where it was when the handler
+        was entered, as in CPython, rather than starting over. Return the
+        "why" to unwind with.
+        """
+        handled = frame.handled
+        if (
+            handled is not None
+            and handled[1] is not None
+            and handled[0] is self.last_exception[1]
+        ):
+            self.traceback_exception, self.last_traceback = handled
+            self.in_exception_processing = True
+        return "exception"
+
+    def unwind_exception_table(self, frame, why):
+        """For 3.11 and later, where there is no block stack, look up the
+        handler in the exception table for an exception raised by the
+        instruction at `frame.f_lasti`.
+
+        If there is one, the stack is cut back to the handler's depth, the
+        exception is pushed, preceded by the index of the instruction that
+        raised if the handler wants it, and we jump to the handler. None is
+        returned then, and `why` otherwise.
+        """
+        if why != "exception":
+            return why
+        table = self.get_decoded(frame).exception_table
+        if table is None:
+            return why
+        entry = table.handler(frame.f_lasti)
+        if entry is None:
+            return why
+        self.note_handled(frame)
+        del frame.stack[entry.depth :]
+        if entry.lasti:
+            # As an instruction index, as CPython pushes it.
+            frame.stack.append(frame.f_lasti // 2)
+        frame.stack.append(self.last_exception[1])
+        frame.f_lasti = entry.target
+        frame.fallthrough = False
+        return None
+
     def manage_block_stack(self, why):
         """Manage a frame's block stack.
         Manipulate the block stack and data stack for looping,
@@ -614,7 +948,14 @@ class PyVM(object):
             why = None
             return why
 
-        if not (block.type == "except-handler" and why == "silenced"):
+        if block.type == "except-handler" and why == "exception":
+            # An exception coming out of a handler goes on in place of the
+            # one that was being handled.
+            self.pop_block()
+            exception = self.last_exception
+            self.unwind_block(block)
+            self.last_exception = exception
+        elif not (block.type == "except-handler" and why == "silenced"):
             self.pop_block()
             self.unwind_block(block)
 
@@ -630,6 +971,7 @@ class PyVM(object):
                 or block.type == "with"
             ):
                 if why == "exception":
+                    self.note_handled(self.frame)
                     exctype, value, tb = self.last_exception
                     self.push(tb, value, exctype)
                 else:
@@ -643,6 +985,7 @@ class PyVM(object):
 
         else:
             if why == "exception" and block.type in ["setup-except", "finally"]:
+                self.note_handled(self.frame)
                 self.push_block("except-handler")
                 exctype, value, tb = self.last_exception
                 self.push(tb, value, exctype)
@@ -678,76 +1021,171 @@ class PyVM(object):
 
         Exceptions are raised, the return value is returned.
 
+        The frames of calls to interpreted functions that the frame makes
+        are run by this same loop, so calls don't use up the Python stack
+        of the VM.
         """
+        if self.engine == "closure" and not log.isEnabledFor(logging.INFO):
+            return eval_frame_closure(self, frame)
+
         self.f_code = frame.f_code
+        decoded = self.get_decoded(frame)
+        positions = control_flow_graph(decoded).positions
+        logging_instructions = log.isEnabledFor(logging.INFO)
+        counting = self.native_threshold is not None
         if frame.f_lasti == -1:
             # We were started new, not yielded back from.
+            if counting:
+                decoded.hotness += 1
             frame.f_lasti = 0
             # Don't increment before fetching next instruction.
             frame.fallthrough = False
-            byte_code = None
+            offset = None
         else:
-            byte_code = byteint(self.f_code.co_code[frame.f_lasti])
             # byte_code == opcode["YIELD_VALUE"]?
+            offset = decoded.instruction_at(frame.f_lasti).next_offset
 
+        base = frame
         self.push_frame(frame)
-        offset = 0
         while True:
 
-            (
-                bytecode_name,
-                byte_code,
-                int_arg,
-                arguments,
-                offset,
-                line_number,
-            ) = self.parse_byte_and_args(byte_code)
-            if log.isEnabledFor(logging.INFO):
-                self.log(bytecode_name, int_arg, arguments, offset, line_number)
+            if frame.fallthrough:
+                # We ran off the end of the last block.
+                block, index = positions[offset]
+            else:
+                # Jump instructions must set this False.
+                frame.fallthrough = True
+                if counting and offset is not None and frame.f_lasti < offset:
+                    # A backward jump.
+                    decoded.hotness += 1
+                block, index = positions[frame.f_lasti]
+
+            # Run the block. Only its last instruction can jump.
+            instructions = block.instructions
+            for inst in instructions[index:] if index else instructions:
+                bytecode_name = inst.opname
+                int_arg = inst.int_arg
+                arguments = inst.arguments
+                offset = inst.offset
+                line_number = inst.line_number
+                frame.f_lasti = offset
+
+                if logging_instructions:
+                    self.log(bytecode_name, int_arg, arguments, offset, line_number)
+
+                # When unwinding the block stack, we need to keep track of why
+                # we are doing it.
+                why = self.dispatch(
+                    bytecode_name, int_arg, arguments, offset, line_number, inst.opcode
+                )
+                if why:
+                    break
+            else:
+                offset = block.next_offset
+                continue
+
+            if why == "call":
+                # The instruction called an interpreted function. We run
+                # the frame the routine made for it here rather than in a
+                # recursive eval_frame().
+                frame = self.call_frame
+                self.call_frame = None
+                self.f_code = frame.f_code
+                decoded = self.get_decoded(frame)
+                positions = control_flow_graph(decoded).positions
+                if counting:
+                    decoded.hotness += 1
+                if frame.f_lasti == -1:
+                    frame.f_lasti = 0
+                    frame.fallthrough = False
+                    offset = None
+                else:
+                    # A generator resumed by resume_generator().
+                    frame.fallthrough = True
+                    offset = decoded.instruction_at(frame.f_lasti).next_offset
+                self.push_frame(frame)
+                continue
 
-            # When unwinding the block stack, we need to keep track of why we
-            # are doing it.
-            why = self.dispatch(bytecode_name, int_arg, arguments, offset, line_number)
             if why == "exception":
-                # TODO: ceval calls PyTraceBack_Here, not sure what that does.
-
                 # Deal with exceptions encountered while executing the op.
                 if not self.in_exception_processing:
-                    # FIXME: DRY code
-                    if self.last_exception[0] != SystemExit:
-                        log.info(
-                            (
-                                "exception in the execution of "
-                                "instruction:\n\t%s"
-                                % self.format_instruction(
-                                    frame,
-                                    self.opc,
-                                    bytecode_name,
-                                    int_arg,
-                                    arguments,
-                                    offset,
-                                    line_number,
-                                    False,
-                                )
-                            )
-                        )
-                    if self.last_traceback is None:
-                        self.last_traceback = traceback_from_frame(frame)
-                    self.in_exception_processing = True
+                    self.note_exception(
+                        frame,
+                        bytecode_name,
+                        int_arg,
+                        arguments,
+                        offset,
+                        line_number,
+                    )
 
             elif why == "reraise":
-                why = "exception"
+                why = self.reraise(frame)
 
             if why != "yield":
+                why = self.unwind_exception_table(frame, why)
                 while why and frame.block_stack:
                     # Deal with any block management we need to do.
                     why = self.manage_block_stack(why)
 
+            if why and frame is not base:
+                # A call we ran above is done. Go back to the frame that
+                # made it, unless that stops too.
+                while why and frame is not base:
+                    why = self.return_to_caller(why)
+                    frame = self.frame
+                if why:
+                    break
+                self.f_code = frame.f_code
+                decoded = self.get_decoded(frame)
+                positions = control_flow_graph(decoded).positions
+                if frame.fallthrough:
+                    offset = decoded.instruction_at(frame.f_lasti).next_offset
+                else:
+                    # An exception handler caught what the call raised.
+                    offset = None
+                continue
+
             if why:
                 break
+            offset = inst.next_offset
 
         # TODO: handle generator exception state
 
+        return self.finish_frame(why)
+
+    def return_to_caller(self, why):
+        """Pop the current frame, which ran a call without a recursive
+        eval_frame() and has stopped for reason `why`, and give the result
+        of the call to the frame that made it: push the return value, or
+        unwind that frame's block stack for the exception. The frame of a
+        generator goes back by way of generator_to_caller().
+
+        Return the reason the calling frame stops in turn, or None if it
+        carries on.
+        """
+        done = self.frame
+        self.pop_frame()
+        frame = self.frame
+        if done.generator is not None:
+            why = self.generator_to_caller(done, frame, why)
+            if why != "exception":
+                return why
+        elif why == "return":
+            self.in_exception_processing = False
+            frame.stack.append(self.return_value)
+            self.recycle_frame(done)
+            return None
+        if why == "exception":
+            self.traceback_here(frame, self.last_exception[1])
+            why = self.unwind_exception_table(frame, why)
+        while why and frame.block_stack:
+            why = self.manage_block_stack(why)
+        return why
+
+    def finish_frame(self, why):
+        """Pop the current frame, which has stopped running for reason `why`,
+        and return its return value or raise its exception.
+        """
         self.pop_frame()
 
         if why == "exception":
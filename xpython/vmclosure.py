@@ -0,0 +1,1093 @@
+"""An execution engine that runs each instruction as a Python closure.
+
+A code object is translated once into a list of closures indexed by
+bytecode offset, with constants, names and jump targets bound in as
+closure variables. Each closure runs its instruction on the frame it is
+given and returns the offset of the next instruction to run, so the
+main loop is just:
+
+    pc = ops[pc](frame)
+
+Common instructions get closures of their own that work directly on the
+frame. For everything else the closure calls the opcode routine from the
+VM's dispatch table, and looks at frame.fallthrough afterwards the way
+PyVM.eval_frame() does. Frequent sequences of instructions, listed per
+Python version in the ByteOp classes, are run by a single closure, a
+"superinstruction".
+
+Select this engine with PyVM(engine="closure"). Since there is no
+per-instruction hook here, frames are run by PyVM.eval_frame() instead
+when instructions are being logged, and PyVMTraced always uses its own
+loop.
+"""
+
+import sys
+
+from xdis import CO_OPTIMIZED
+
+from xpython import quicken
+from xpython.methodcache import MethodCache
+from xpython.byteop.byteop import (
+    BINARY_OPERATORS,
+    INPLACE_OPERATORS,
+    arithmetic_operator,
+)
+from xpython.pyobj import UNBOUND, Block, Generator
+
+
+def run_routine(vm, frame, why, inst):
+    """Handle the non-None `why` that the routine for `inst` returned.
+
+    Return the offset of the next instruction to run in `frame`, or None
+    if the frame is done; in that case the reason is left in vm.frame_why.
+    """
+    if why == "call":
+        # eval_frame_closure() runs the frame of the call next.
+        vm.frame_why = why
+        return None
+    if why == "exception":
+        vm.note_exception(
+            frame,
+            inst.opname,
+            inst.int_arg,
+            inst.arguments,
+            inst.offset,
+            inst.line_number,
+        )
+    elif why == "reraise":
+        why = vm.reraise(frame)
+    return unwind(vm, frame, why, inst)
+
+
+def unwind(vm, frame, why, inst):
+    """Unwind `frame`'s block stack for `why`, which came about in running
+    `inst`, and return the offset to continue at, or None if the frame is
+    done.
+    """
+    if why != "yield":
+        why = vm.unwind_exception_table(frame, why)
+        while why and frame.block_stack:
+            why = vm.manage_block_stack(why)
+    if why:
+        vm.frame_why = why
+        return None
+    if frame.fallthrough:
+        return inst.next_offset
+    frame.fallthrough = True
+    return frame.f_lasti
+
+
+def generic_op(vm, inst, routine):
+    """Return a closure that runs `inst` using its opcode routine."""
+    arguments = inst.arguments
+    offset = inst.offset
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.f_lasti = offset
+        why = routine(*arguments)
+        if why:
+            return run_routine(vm, frame, why, inst)
+        if frame.fallthrough:
+            return next_offset
+        # The routine jumped.
+        frame.fallthrough = True
+        return frame.f_lasti
+
+    return op
+
+
+# Closures for instructions that we run without calling an opcode routine.
+# Each function here takes the VM and the instruction, and returns the
+# closure. Instructions that can run code of the program being
+# interpreted set frame.f_lasti, so that tracebacks made while that code
+# runs show the right place in this frame.
+
+
+def LOAD_FAST(vm, inst):
+    (name,) = inst.arguments
+    i = inst.int_arg
+    next_offset = inst.next_offset
+    message = "local variable '%s' referenced before assignment" % name
+
+    def op(frame):
+        value = frame.fast_locals[i]
+        if value is UNBOUND:
+            raise UnboundLocalError(message)
+        frame.stack.append(value)
+        return next_offset
+
+    return op
+
+
+def STORE_FAST(vm, inst):
+    i = inst.int_arg
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.fast_locals[i] = frame.stack.pop()
+        return next_offset
+
+    return op
+
+
+def LOAD_CONST(vm, inst):
+    (const,) = inst.arguments
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.stack.append(const)
+        return next_offset
+
+    return op
+
+
+def LOAD_CLOSURE(vm, inst):
+    i = inst.int_arg
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.stack.append(frame.cells[i])
+        return next_offset
+
+    return op
+
+
+def LOAD_DEREF(vm, inst):
+    i = inst.int_arg
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.stack.append(frame.cells[i].contents)
+        return next_offset
+
+    return op
+
+
+def STORE_DEREF(vm, inst):
+    i = inst.int_arg
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.cells[i].contents = frame.stack.pop()
+        return next_offset
+
+    return op
+
+
+def LOAD_GLOBAL(vm, inst):
+    (name,) = inst.arguments
+    next_offset = inst.next_offset
+    message = "global name '%s' is not defined" % name
+
+    def op(frame):
+        f_globals = frame.f_globals
+        if name in f_globals:
+            frame.stack.append(f_globals[name])
+        elif name in frame.f_builtins:
+            frame.stack.append(frame.f_builtins[name])
+        else:
+            raise NameError(message)
+        return next_offset
+
+    return op
+
+
+def LOAD_NAME(vm, inst):
+    (name,) = inst.arguments
+    next_offset = inst.next_offset
+    offset = inst.offset
+    message = "name '%s' is not defined" % name
+
+    # The lookup of ByteOpBase.lookup_name(), inlined. f_locals can be a
+    # mapping from a metaclass's __prepare__() that runs code of its own.
+    def op(frame):
+        frame.f_lasti = offset
+        f_locals = frame.f_locals
+        if name in f_locals:
+            frame.stack.append(f_locals[name])
+            return next_offset
+        f_globals = frame.f_globals
+        if f_globals is not f_locals and name in f_globals:
+            frame.stack.append(f_globals[name])
+        elif name in frame.f_builtins:
+            frame.stack.append(frame.f_builtins[name])
+        else:
+            raise NameError(message)
+        return next_offset
+
+    return op
+
+
+def STORE_NAME(vm, inst):
+    (name,) = inst.arguments
+    offset = inst.offset
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.f_lasti = offset
+        frame.f_locals[name] = frame.stack.pop()
+        return next_offset
+
+    return op
+
+
+def LOAD_ATTR(vm, inst):
+    (name,) = inst.arguments
+    offset = inst.offset
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.f_lasti = offset
+        stack = frame.stack
+        stack[-1] = getattr(stack[-1], name)
+        return next_offset
+
+    return op
+
+
+def STORE_ATTR(vm, inst):
+    (name,) = inst.arguments
+    offset = inst.offset
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.f_lasti = offset
+        stack = frame.stack
+        obj = stack.pop()
+        setattr(obj, name, stack.pop())
+        return next_offset
+
+    return op
+
+
+def LOAD_METHOD(vm, inst):
+    """LOAD_METHOD with a cache of its own; see ByteOpBase.load_method().
+    This is also LOAD_ATTR before 3.7 when its attribute is only called;
+    see DecodedCode.method_loads."""
+    (name,) = inst.arguments
+    offset = inst.offset
+    next_offset = inst.next_offset
+    lookup = MethodCache(vm, name).lookup
+
+    def op(frame):
+        frame.f_lasti = offset
+        stack = frame.stack
+        obj = stack[-1]
+        func = lookup(obj)
+        if func is None:
+            stack[-1] = getattr(obj, name)
+            stack.append(None)
+        else:
+            stack[-1] = func
+            stack.append(obj)
+        return next_offset
+
+    return op
+
+
+def POP_TOP(vm, inst):
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.stack.pop()
+        return next_offset
+
+    return op
+
+
+def COMPARE_OP(vm, inst):
+    compare = vm.byteop.COMPARE_OPERATORS[inst.int_arg]
+    offset = inst.offset
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.f_lasti = offset
+        stack = frame.stack
+        y = stack.pop()
+        stack[-1] = compare(stack[-1], y)
+        return next_offset
+
+    return op
+
+
+def JUMP_ABSOLUTE(vm, inst):
+    target = inst.jump_target
+
+    def op(frame):
+        return target
+
+    return op
+
+
+JUMP_FORWARD = JUMP_ABSOLUTE
+
+
+def POP_JUMP_IF_FALSE(vm, inst):
+    target = inst.jump_target
+    next_offset = inst.next_offset
+
+    def op(frame):
+        if frame.stack.pop():
+            return next_offset
+        return target
+
+    return op
+
+
+def POP_JUMP_IF_TRUE(vm, inst):
+    target = inst.jump_target
+    next_offset = inst.next_offset
+
+    def op(frame):
+        if frame.stack.pop():
+            return target
+        return next_offset
+
+    return op
+
+
+def JUMP_IF_FALSE(vm, inst):
+    target = inst.jump_target
+    next_offset = inst.next_offset
+
+    def op(frame):
+        if frame.stack[-1]:
+            return next_offset
+        return target
+
+    return op
+
+
+def JUMP_IF_TRUE(vm, inst):
+    target = inst.jump_target
+    next_offset = inst.next_offset
+
+    def op(frame):
+        if frame.stack[-1]:
+            return target
+        return next_offset
+
+    return op
+
+
+def FOR_ITER(vm, inst):
+    target = inst.jump_target
+    offset = inst.offset
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.f_lasti = offset
+        stack = frame.stack
+        if stack[-1].__class__ is Generator:
+            why = vm.resume_generator(stack[-1], None)
+            if why:
+                return run_routine(vm, frame, why, inst)
+        try:
+            v = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            return target
+        stack.append(v)
+        return next_offset
+
+    return op
+
+
+def setup_op(vm, inst, type):
+    """Return a closure that pushes the block of SETUP_* instruction
+    `inst`, of type `type`. As in PyVM.setup_block(), the block is made
+    once and pushed again each time the instruction runs at the same
+    stack level."""
+    (handler,) = inst.arguments
+    next_offset = inst.next_offset
+    made = [None]
+
+    def op(frame):
+        level = len(frame.stack)
+        block = made[0]
+        if block is None or block.level != level:
+            block = made[0] = Block(type, handler, level)
+        frame.block_stack.append(block)
+        return next_offset
+
+    return op
+
+
+def SETUP_LOOP(vm, inst):
+    return setup_op(vm, inst, "loop")
+
+
+def SETUP_EXCEPT(vm, inst):
+    return setup_op(vm, inst, "setup-except")
+
+
+def SETUP_FINALLY(vm, inst):
+    return setup_op(vm, inst, "finally")
+
+
+def POP_BLOCK(vm, inst):
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.block_stack.pop()
+        return next_offset
+
+    return op
+
+
+# The arithmetic operators also get the operator to apply.
+
+
+def unary_op(vm, inst, fn):
+    offset = inst.offset
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.f_lasti = offset
+        stack = frame.stack
+        stack[-1] = fn(stack[-1])
+        return next_offset
+
+    return op
+
+
+def binary_op(vm, inst, fn):
+    offset = inst.offset
+    next_offset = inst.next_offset
+
+    def op(frame):
+        frame.f_lasti = offset
+        stack = frame.stack
+        y = stack.pop()
+        stack[-1] = fn(stack[-1], y)
+        return next_offset
+
+    return op
+
+
+# The closure makers above, keyed by the qualified name of the opcode
+# routine each stands in for. Subclasses of ByteOp24 change the meaning of
+# some opcodes by overriding their routines, so we use a closure only where
+# the routine it replaces is the one in effect.
+CLOSURE_MAKERS = {
+    "ByteOp24.LOAD_FAST": LOAD_FAST,
+    "ByteOp24.STORE_FAST": STORE_FAST,
+    "ByteOp24.LOAD_CONST": LOAD_CONST,
+    "ByteOp24.LOAD_GLOBAL": LOAD_GLOBAL,
+    "ByteOp24.LOAD_CLOSURE": LOAD_CLOSURE,
+    "ByteOp24.LOAD_DEREF": LOAD_DEREF,
+    "ByteOp24.STORE_DEREF": STORE_DEREF,
+    "ByteOp24.LOAD_NAME": LOAD_NAME,
+    "ByteOp24.STORE_NAME": STORE_NAME,
+    "ByteOp24.LOAD_ATTR": LOAD_ATTR,
+    "ByteOp24.STORE_ATTR": STORE_ATTR,
+    "ByteOp24.POP_TOP": POP_TOP,
+    "ByteOp24.COMPARE_OP": COMPARE_OP,
+    "ByteOp24.JUMP_ABSOLUTE": JUMP_ABSOLUTE,
+    "ByteOp24.JUMP_FORWARD": JUMP_FORWARD,
+    "ByteOp24.FOR_ITER": FOR_ITER,
+    "ByteOp24.SETUP_LOOP": SETUP_LOOP,
+    "ByteOp24.SETUP_EXCEPT": SETUP_EXCEPT,
+    "ByteOp24.SETUP_FINALLY": SETUP_FINALLY,
+    "ByteOp24.POP_BLOCK": POP_BLOCK,
+    "ByteOp24.JUMP_IF_FALSE": JUMP_IF_FALSE,
+    "ByteOp24.JUMP_IF_TRUE": JUMP_IF_TRUE,
+    "ByteOp27.JUMP_FORWARD": JUMP_FORWARD,
+    "ByteOp27.POP_JUMP_IF_FALSE": POP_JUMP_IF_FALSE,
+    "ByteOp27.POP_JUMP_IF_TRUE": POP_JUMP_IF_TRUE,
+    "ByteOp37.LOAD_METHOD": LOAD_METHOD,
+}
+
+
+def closure_maker(routine):
+    """Return the closure maker in CLOSURE_MAKERS for opcode routine
+    `routine`, a bound method, or None."""
+    fn = getattr(routine, "__func__", None)
+    if fn is None:
+        return None
+    return CLOSURE_MAKERS.get(fn.__qualname__)
+
+
+# Superinstructions: closures that run a short sequence of instructions
+# in one go, saving the trip through the main loop for all but the first.
+# Which sequences a version fuses is given by the SUPERINSTRUCTIONS
+# attribute of its ByteOp class; the functions here make the closures.
+#
+# Each function takes the VM, the instructions of the sequence and their
+# opcode routines, and returns the closure, or None if it can't handle
+# this particular sequence. The closure stands in for the first
+# instruction only: the others keep their own closures, so running from
+# the middle of the sequence still works. A superinstruction sets
+# frame.f_lasti to the offset of the instruction it is running before
+# anything can go wrong, so that tracebacks and exception handling see
+# the original instruction.
+
+
+def LOAD_FAST_LOAD_FAST(vm, insts, routines):
+    name1, name2 = insts[0].arguments[0], insts[1].arguments[0]
+    i1, i2 = insts[0].int_arg, insts[1].int_arg
+    offset1, offset2 = insts[0].offset, insts[1].offset
+    next_offset = insts[-1].next_offset
+
+    def op(frame):
+        fast_locals = frame.fast_locals
+        value1 = fast_locals[i1]
+        value2 = fast_locals[i2]
+        if value1 is not UNBOUND and value2 is not UNBOUND:
+            frame.stack.extend((value1, value2))
+            return next_offset
+        frame.f_lasti = offset1 if value1 is UNBOUND else offset2
+        name = name1 if value1 is UNBOUND else name2
+        raise UnboundLocalError(
+            "local variable '%s' referenced before assignment" % name
+        )
+
+    return op
+
+
+def LOAD_FAST_LOAD_CONST(vm, insts, routines):
+    name, const = insts[0].arguments[0], insts[1].arguments[0]
+    i = insts[0].int_arg
+    offset = insts[0].offset
+    next_offset = insts[-1].next_offset
+    message = "local variable '%s' referenced before assignment" % name
+
+    def op(frame):
+        value = frame.fast_locals[i]
+        if value is UNBOUND:
+            frame.f_lasti = offset
+            raise UnboundLocalError(message)
+        frame.stack.extend((value, const))
+        return next_offset
+
+    return op
+
+
+def LOAD_FAST_LOAD_CONST_BINARY(vm, insts, routines):
+    """LOAD_FAST, LOAD_CONST and a binary arithmetic operator, as in
+    "i + 1"."""
+    name, const = insts[0].arguments[0], insts[1].arguments[0]
+    i = insts[0].int_arg
+    fn = arithmetic_operator(insts[2].opname)[0]
+    offset1, offset3 = insts[0].offset, insts[2].offset
+    next_offset = insts[-1].next_offset
+    message = "local variable '%s' referenced before assignment" % name
+
+    def op(frame):
+        value = frame.fast_locals[i]
+        if value is UNBOUND:
+            frame.f_lasti = offset1
+            raise UnboundLocalError(message)
+        frame.f_lasti = offset3
+        frame.stack.append(fn(value, const))
+        return next_offset
+
+    return op
+
+
+def LOAD_FAST_LOAD_ATTR(vm, insts, routines):
+    name, attr = insts[0].arguments[0], insts[1].arguments[0]
+    i = insts[0].int_arg
+    offset1, offset2 = insts[0].offset, insts[1].offset
+    next_offset = insts[-1].next_offset
+    message = "local variable '%s' referenced before assignment" % name
+
+    def op(frame):
+        value = frame.fast_locals[i]
+        if value is UNBOUND:
+            frame.f_lasti = offset1
+            raise UnboundLocalError(message)
+        frame.f_lasti = offset2
+        frame.stack.append(getattr(value, attr))
+        return next_offset
+
+    return op
+
+
+def STORE_FAST_LOAD_FAST(vm, insts, routines):
+    name2 = insts[1].arguments[0]
+    i1, i2 = insts[0].int_arg, insts[1].int_arg
+    offset2 = insts[1].offset
+    next_offset = insts[-1].next_offset
+    message = "local variable '%s' referenced before assignment" % name2
+
+    def op(frame):
+        fast_locals = frame.fast_locals
+        stack = frame.stack
+        fast_locals[i1] = stack.pop()
+        value = fast_locals[i2]
+        if value is UNBOUND:
+            frame.f_lasti = offset2
+            raise UnboundLocalError(message)
+        stack.append(value)
+        return next_offset
+
+    return op
+
+
+def LOAD_CONST_LOAD_CONST(vm, insts, routines):
+    const1, const2 = insts[0].arguments[0], insts[1].arguments[0]
+    next_offset = insts[-1].next_offset
+
+    def op(frame):
+        frame.stack.extend((const1, const2))
+        return next_offset
+
+    return op
+
+
+def LOAD_NAME_LOAD_CONST(vm, insts, routines):
+    name, const = insts[0].arguments[0], insts[1].arguments[0]
+    offset = insts[0].offset
+    next_offset = insts[-1].next_offset
+    message = "name '%s' is not defined" % name
+
+    def op(frame):
+        frame.f_lasti = offset
+        f_locals = frame.f_locals
+        if name in f_locals:
+            value = f_locals[name]
+        else:
+            f_globals = frame.f_globals
+            if f_globals is not f_locals and name in f_globals:
+                value = f_globals[name]
+            elif name in frame.f_builtins:
+                value = frame.f_builtins[name]
+            else:
+                raise NameError(message)
+        frame.stack.extend((value, const))
+        return next_offset
+
+    return op
+
+
+def STORE_NAME_LOAD_CONST(vm, insts, routines):
+    name, const = insts[0].arguments[0], insts[1].arguments[0]
+    offset = insts[0].offset
+    next_offset = insts[-1].next_offset
+
+    def op(frame):
+        frame.f_lasti = offset
+        stack = frame.stack
+        frame.f_locals[name] = stack.pop()
+        stack.append(const)
+        return next_offset
+
+    return op
+
+
+def STORE_NAME_LOAD_NAME(vm, insts, routines):
+    name1, name2 = insts[0].arguments[0], insts[1].arguments[0]
+    offset1, offset2 = insts[0].offset, insts[1].offset
+    next_offset = insts[-1].next_offset
+    message = "name '%s' is not defined" % name2
+
+    def op(frame):
+        frame.f_lasti = offset1
+        stack = frame.stack
+        f_locals = frame.f_locals
+        f_locals[name1] = stack.pop()
+        frame.f_lasti = offset2
+        if name2 in f_locals:
+            stack.append(f_locals[name2])
+            return next_offset
+        f_globals = frame.f_globals
+        if f_globals is not f_locals and name2 in f_globals:
+            stack.append(f_globals[name2])
+        elif name2 in frame.f_builtins:
+            stack.append(frame.f_builtins[name2])
+        else:
+            raise NameError(message)
+        return next_offset
+
+    return op
+
+
+def LOAD_GLOBAL_CALL_FUNCTION(vm, insts, routines):
+    """LOAD_GLOBAL and a call of a function without arguments, as in
+    "f()". The call itself is left to the CALL_FUNCTION routine."""
+    name = insts[0].arguments[0]
+    offset1, offset2 = insts[0].offset, insts[1].offset
+    call_inst = insts[1]
+    arguments = call_inst.arguments
+    call = routines[1]
+    next_offset = insts[-1].next_offset
+    message = "global name '%s' is not defined" % name
+
+    def op(frame):
+        f_globals = frame.f_globals
+        if name in f_globals:
+            frame.stack.append(f_globals[name])
+        elif name in frame.f_builtins:
+            frame.stack.append(frame.f_builtins[name])
+        else:
+            frame.f_lasti = offset1
+            raise NameError(message)
+        frame.f_lasti = offset2
+        why = call(*arguments)
+        if why:
+            return run_routine(vm, frame, why, call_inst)
+        if frame.fallthrough:
+            return next_offset
+        frame.fallthrough = True
+        return frame.f_lasti
+
+    return op
+
+
+def COMPARE_OP_JUMP(vm, insts, routines):
+    """COMPARE_OP and a conditional jump on its result, as in "if x < y:"
+    and "while x < y:"."""
+    compare = vm.byteop.COMPARE_OPERATORS[insts[0].int_arg]
+    offset1, offset2 = insts[0].offset, insts[1].offset
+    jump_name = insts[1].opname
+    jump_if_true = jump_name.endswith("_TRUE")
+    pop = jump_name.startswith("POP_")
+    if jump_if_true:
+        true_offset, false_offset = insts[1].jump_target, insts[1].next_offset
+    else:
+        true_offset, false_offset = insts[1].next_offset, insts[1].jump_target
+
+    if pop:
+
+        def op(frame):
+            frame.f_lasti = offset1
+            stack = frame.stack
+            y = stack.pop()
+            result = compare(stack.pop(), y)
+            # Testing the result is part of the jump; it can fail too.
+            frame.f_lasti = offset2
+            if result:
+                return true_offset
+            return false_offset
+
+    else:
+
+        def op(frame):
+            frame.f_lasti = offset1
+            stack = frame.stack
+            y = stack.pop()
+            result = stack[-1] = compare(stack[-1], y)
+            frame.f_lasti = offset2
+            if result:
+                return true_offset
+            return false_offset
+
+    return op
+
+
+FUSION_MAKERS = {
+    ("LOAD_FAST", "LOAD_FAST"): LOAD_FAST_LOAD_FAST,
+    ("LOAD_FAST", "LOAD_CONST"): LOAD_FAST_LOAD_CONST,
+    ("LOAD_FAST", "LOAD_ATTR"): LOAD_FAST_LOAD_ATTR,
+    ("STORE_FAST", "LOAD_FAST"): STORE_FAST_LOAD_FAST,
+    ("LOAD_CONST", "LOAD_CONST"): LOAD_CONST_LOAD_CONST,
+    ("LOAD_NAME", "LOAD_CONST"): LOAD_NAME_LOAD_CONST,
+    ("STORE_NAME", "LOAD_CONST"): STORE_NAME_LOAD_CONST,
+    ("STORE_NAME", "LOAD_NAME"): STORE_NAME_LOAD_NAME,
+    ("LOAD_GLOBAL", "CALL_FUNCTION"): LOAD_GLOBAL_CALL_FUNCTION,
+    ("COMPARE_OP", "JUMP_IF_FALSE"): COMPARE_OP_JUMP,
+    ("COMPARE_OP", "JUMP_IF_TRUE"): COMPARE_OP_JUMP,
+    ("COMPARE_OP", "POP_JUMP_IF_FALSE"): COMPARE_OP_JUMP,
+    ("COMPARE_OP", "POP_JUMP_IF_TRUE"): COMPARE_OP_JUMP,
+}
+for opname in BINARY_OPERATORS:
+    FUSION_MAKERS[
+        ("LOAD_FAST", "LOAD_CONST", "BINARY_" + opname)
+    ] = LOAD_FAST_LOAD_CONST_BINARY
+for opname in INPLACE_OPERATORS:
+    FUSION_MAKERS[
+        ("LOAD_FAST", "LOAD_CONST", "INPLACE_" + opname)
+    ] = LOAD_FAST_LOAD_CONST_BINARY
+del opname
+
+# Instructions a superinstruction may contain without having a closure of
+# their own, because it calls their opcode routine.
+ROUTINE_CALLED = frozenset(["CALL_FUNCTION"])
+
+
+def superinstructions(byteop):
+    """Return a dict mapping an opcode name to the sequences in
+    byteop.SUPERINSTRUCTIONS that start with it, longest first."""
+    by_first = {}
+    for sequence in sorted(byteop.SUPERINSTRUCTIONS, key=len, reverse=True):
+        if sequence in FUSION_MAKERS:
+            by_first.setdefault(sequence[0], []).append(sequence)
+    return by_first
+
+
+def fuse(
+    vm, insts, starts, i, by_first, jump_targets, optimized, method_loads=frozenset()
+):
+    """Return a superinstruction closure for the sequence of instructions
+    starting at insts[i], the maker of the closure and the instructions
+    in the sequence; or None, None, None if there is no superinstruction to
+    run there. starts[i] is the offset insts[i] starts at, counting any
+    EXTENDED_ARG prefix. `optimized` is false for code whose frames have
+    no fast locals. `method_loads` are the offsets of LOAD_ATTRs that are
+    run as LOAD_METHOD, which are left out of superinstructions."""
+    sequences = by_first.get(insts[i].opname)
+    if not sequences:
+        return None, None, None
+    dispatch_table = vm.byteop.dispatch_table
+    for sequence in sequences:
+        window = insts[i : i + len(sequence)]
+        if tuple(inst.opname for inst in window) != sequence:
+            continue
+        routines = []
+        for j, inst in enumerate(window):
+            routine = dispatch_table[inst.opcode]
+            if j and (starts[i + j] in jump_targets or inst.offset in jump_targets):
+                # Code can get to the middle of the sequence.
+                break
+            if not optimized and inst.opname in FAST_LOCALS_OPNAMES:
+                break
+            if inst.offset in method_loads:
+                break
+            if (
+                routine is None
+                or inst.opname not in ROUTINE_CALLED
+                and arithmetic_operator(inst.opname) is None
+                and closure_maker(routine) is None
+            ):
+                # The opcode means something else in this version.
+                break
+            routines.append(routine)
+        else:
+            maker = FUSION_MAKERS[sequence]
+            op = maker(vm, window, routines)
+            if op is not None:
+                op.fused = True
+                return op, maker, window
+    return None, None, None
+
+
+# Instructions whose closures use Frame.fast_locals. Only frames of
+# optimized code have those; in other code, which Python 2 makes for
+# functions using exec or "import *", the opcode routines run these.
+FAST_LOCALS_OPNAMES = frozenset(("LOAD_FAST", "STORE_FAST", "DELETE_FAST"))
+
+
+# Specializers from xpython.quicken for the closures that some of the
+# makers here make.
+QUICKENERS = {
+    binary_op: quicken.binary_op,
+    COMPARE_OP: quicken.COMPARE_OP,
+    FOR_ITER: quicken.FOR_ITER,
+    COMPARE_OP_JUMP: quicken.COMPARE_OP_JUMP,
+    LOAD_FAST_LOAD_CONST_BINARY: quicken.LOAD_FAST_LOAD_CONST_BINARY,
+}
+
+
+def installer(ops, first, last):
+    """Return a function that puts a closure in `ops` for the instruction
+    at offsets `first` to `last`, which is more than one offset when the
+    instruction has an EXTENDED_ARG prefix."""
+
+    def install(op):
+        for offset in range(first, last + 1):
+            ops[offset] = op
+
+    return install
+
+
+def counting_installer(decoded, install):
+    """Return a function like `install` that puts in closures which also
+    count in decoded.hotness how often they are run. This is for backward
+    jumps when PyVM.native_threshold is set; see xpython.native."""
+
+    def counting_install(op):
+        def counted(frame):
+            decoded.hotness += 1
+            return op(frame)
+
+        if getattr(op, "fused", False):
+            counted.fused = True
+        install(counted)
+
+    return counting_install
+
+
+def compile_code(vm, decoded):
+    """Return the list of closures for the instructions in `decoded`, a
+    DecodedCode. It is indexed by offset like decoded.instructions.
+    """
+    dispatch_table = vm.byteop.dispatch_table
+    by_first = superinstructions(vm.byteop)
+    jump_targets = decoded.jump_targets
+    optimized = decoded.code.co_flags & CO_OPTIMIZED
+    method_loads = decoded.method_loads
+
+    # The instructions in order, once each, and where each starts.
+    insts = []
+    starts = []
+    for offset, inst in enumerate(decoded.instructions):
+        if inst is not None and (not insts or inst is not insts[-1]):
+            insts.append(inst)
+            starts.append(offset)
+
+    ops = [None] * len(decoded.instructions)
+    for i, inst in enumerate(insts):
+        opname = inst.opname
+        routine = dispatch_table[inst.opcode]
+        op, maker, op_insts = fuse(
+            vm, insts, starts, i, by_first, jump_targets, optimized, method_loads
+        )
+        if op is None:
+            op_insts = [inst]
+            arithmetic = arithmetic_operator(opname)
+            if inst.offset in method_loads:
+                # A LOAD_ATTR before 3.7 that is paired with a CALL_FUNCTION,
+                # which calls its opcode routine.
+                maker = LOAD_METHOD
+                op = maker(vm, inst)
+            elif arithmetic is not None:
+                fn, operands = arithmetic
+                maker = unary_op if operands == 1 else binary_op
+                op = maker(vm, inst, fn)
+            elif routine is not None and (
+                optimized or opname not in FAST_LOCALS_OPNAMES
+            ):
+                maker = closure_maker(routine)
+                if maker is not None:
+                    op = maker(vm, inst)
+        if op is None:
+            if routine is None:
+                # Let PyVM.dispatch() report the unknown opcode.
+                routine = unknown_opcode_routine(vm, inst)
+            op = generic_op(vm, inst, routine)
+
+        install = installer(ops, starts[i], inst.offset)
+        last = op_insts[-1]
+        if (
+            vm.native_threshold is not None
+            and last.jump_target is not None
+            and last.jump_target <= last.offset
+            and not last.opname.startswith("SETUP_")
+        ):
+            install = counting_installer(decoded, install)
+        quickener = QUICKENERS.get(maker)
+        if quickener is not None:
+            specializer = quickener(vm, op_insts)
+            if specializer is not None:
+                op = quicken.adaptive(vm, inst, op, specializer, install)
+        install(op)
+    return ops
+
+
+def unknown_opcode_routine(vm, inst):
+    def routine(*arguments):
+        return vm.dispatch(
+            inst.opname,
+            inst.int_arg,
+            inst.arguments,
+            inst.offset,
+            inst.line_number,
+            inst.opcode,
+        )
+
+    return routine
+
+
+def eval_frame_closure(vm, frame):
+    """Run a frame until it returns (somehow), running its code as closures.
+
+    This is PyVM.eval_frame() for the "closure" engine. Exceptions are
+    raised, the return value is returned.
+    """
+    vm.f_code = frame.f_code
+    decoded = vm.get_decoded(frame)
+    ops = closure_ops(vm, decoded)
+    counting = vm.native_threshold is not None
+
+    if frame.f_lasti == -1:
+        # We were started new, not yielded back from.
+        frame.f_lasti = pc = 0
+        if counting:
+            decoded.hotness += 1
+    elif frame.fallthrough:
+        pc = decoded.instruction_at(frame.f_lasti).next_offset
+    else:
+        pc = frame.f_lasti
+    frame.fallthrough = True
+
+    base = frame
+    vm.push_frame(frame)
+    while True:
+        try:
+            while pc is not None:
+                pc = ops[pc](frame)
+        except Exception:
+            # Deal with exceptions encountered while executing the op.
+            # pc is still the offset of the instruction that raised it,
+            # unless that was a superinstruction, which leaves the offset
+            # of the instruction it was running in f_lasti.
+            if getattr(ops[pc], "fused", False):
+                pc = frame.f_lasti
+            inst = decoded.instruction_at(pc)
+            frame.f_lasti = inst.offset
+            frame.fallthrough = True
+            vm.last_exception = sys.exc_info()
+            vm.note_exception(
+                frame,
+                inst.opname,
+                inst.int_arg,
+                inst.arguments,
+                inst.offset,
+                inst.line_number,
+            )
+            pc = unwind(vm, frame, "exception", inst)
+            continue
+
+        why = vm.frame_why
+        if why == "call":
+            # An instruction called an interpreted function. We run the
+            # frame the routine made for it here rather than in a
+            # recursive eval_frame_closure().
+            frame = vm.call_frame
+            vm.call_frame = None
+            vm.f_code = frame.f_code
+            decoded = vm.get_decoded(frame)
+            ops = closure_ops(vm, decoded)
+            if counting:
+                decoded.hotness += 1
+            if frame.f_lasti == -1:
+                frame.f_lasti = pc = 0
+            else:
+                # A generator resumed by PyVM.resume_generator().
+                pc = decoded.instruction_at(frame.f_lasti).next_offset
+            frame.fallthrough = True
+            vm.push_frame(frame)
+            continue
+
+        if frame is base:
+            break
+        # A call we ran above is done. Go back to the frame that made it,
+        # unless that stops too.
+        while why and frame is not base:
+            why = vm.return_to_caller(why)
+            frame = vm.frame
+        if why:
+            vm.frame_why = why
+            break
+        vm.f_code = frame.f_code
+        decoded = vm.get_decoded(frame)
+        ops = closure_ops(vm, decoded)
+        if frame.fallthrough:
+            pc = decoded.instruction_at(frame.f_lasti).next_offset
+        else:
+            # An exception handler caught what the call raised.
+            pc = frame.f_lasti
+            frame.fallthrough = True
+
+    return vm.finish_frame(vm.frame_why)
+
+
+def closure_ops(vm, decoded):
+    """Return the closures for `decoded`, a DecodedCode, making them the
+    first time."""
+    ops = decoded.closure_ops
+    if ops is None:
+        ops = decoded.closure_ops = compile_code(vm, decoded)
+    return ops
@@ -9,8 +9,9 @@ from xdis import IS_PYPY, PYTHON_VERSION_TRIPLE, codeType2Portable
 # We will add a new "DEBUG" opcode
 from xdis.opcodes.base import def_op
 
-from xpython.pyobj import Frame, traceback_from_frame
-from xpython.vm import PyVM, PyVMError, byteint, format_instruction
+from xpython.instruction import byteint
+from xpython.pyobj import Frame
+from xpython.vm import PyVM, PyVMError, format_instruction
 
 log = logging.getLogger(__name__)
 
@@ -82,15 +83,20 @@ class PyVMTraced(PyVM):
         vmtest_testing=False,
         event_flags=PyVMEVENT_ALL,
         format_instruction_func=format_instruction,
+        native_threshold=None,
     ):
         super().__init__(
             python_version,
             is_pypy,
             vmtest_testing,
             format_instruction_func=format_instruction_func,
+            native_threshold=native_threshold,
         )
         self.event_flags = event_flags
         self.callback = callback
+        # Our eval_frame() runs each call in a recursive call of itself, so
+        # that events are reported around it.
+        self.inline_calls = False
         # Add a new opcode to allow us high-speed breakpoints
 
         # FIXME: older xdis uses  "self.opc.l" instead of "self.opc.loc"
@@ -98,6 +104,7 @@ class PyVMTraced(PyVM):
             if hasattr(self.opc, "l"):
                 self.opc.loc = self.opc.l
         def_op(self.opc.loc, "BRKPT", BREAKPOINT_OP, 0, 0)
+        self.byteop.dispatch_table[BREAKPOINT_OP] = self.byteop.BRKPT
 
     def add_breakpoint(self, frame: Frame, offset: int):
         """
@@ -130,6 +137,32 @@ class PyVMTraced(PyVM):
         bytecode[offset] = frame.brkpt[offset]
         code.co_code = bytes(bytecode)
 
+    def native_allowed(self):
+        """Also look at the trace events of the calling frame. See
+        xpython.native for when hot functions are run natively."""
+        frame = self.frame
+        if frame is None:
+            f_trace, event_flags = self.callback, self.event_flags
+        else:
+            f_trace, event_flags = frame.f_trace, frame.event_flags
+        if f_trace and event_flags and not event_flags & PyVMEVENT_STEP_OVER:
+            return False
+        return super().native_allowed()
+
+    def call_trace(self, frame, *args):
+        """Call the trace function of `frame` with `args`, and return what
+        it returns.
+
+        The trace function may change the frame's locals through
+        frame.f_locals. As CPython does around trace functions, we bring
+        that dict up to date before the call and copy it back into the
+        fast locals after.
+        """
+        frame.fast_to_locals()
+        result = frame.f_trace(*args)
+        frame.locals_to_fast()
+        return result
+
     # FIXME: put callback in f_trace, and update it accordingly
     def eval_frame(self, frame: Frame):
         """Run a frame until it returns (somehow).
@@ -152,6 +185,9 @@ class PyVMTraced(PyVM):
         result = None
         if frame.f_lasti == -1:
             # We were started new, not yielded back from
+            if self.native_threshold is not None:
+                # Only calls are counted here, not backward jumps.
+                self.get_decoded(frame).hotness += 1
             frame.f_lasti = 0
             frame.fallthrough = (
                 False  # Don't increment before fetching next instruction
@@ -165,12 +201,13 @@ class PyVMTraced(PyVM):
                     # return and yield
                     frame.event_flags &= ~(PyVMEVENT_RETURN | PyVMEVENT_YIELD)
                 else:
-                    result = frame.f_trace(
+                    result = self.call_trace(
+                        frame,
                         "call",
                         last_i,
                         "CALL",
                         byte_code,
-                        frame.f_lineno,
+                        frame.f_code.co_firstlineno,
                         None,
                         [],
                         self,
@@ -201,10 +238,6 @@ class PyVMTraced(PyVM):
             elif result == "return":
                 return self.return_value
 
-        self.frame.linestarts = dict(
-            self.opc.findlinestarts(frame.f_code, dup_lines=True)
-        )
-
         opoffset = 0
         while True:
             (
@@ -224,7 +257,8 @@ class PyVMTraced(PyVM):
                 and line_number is not None
                 and frame.event_flags & (PyVMEVENT_LINE | PyVMEVENT_INSTRUCTION)
             ):
-                result = frame.f_trace(
+                result = self.call_trace(
+                    frame,
                     "line",
                     opoffset,
                     byte_name,
@@ -235,7 +269,8 @@ class PyVMTraced(PyVM):
                     self,
                 )
             elif frame.f_trace and frame.event_flags & PyVMEVENT_INSTRUCTION:
-                result = frame.f_trace(
+                result = self.call_trace(
+                    frame,
                     "instruction",
                     opoffset,
                     byte_name,
@@ -270,18 +305,20 @@ class PyVMTraced(PyVM):
 
             # When unwinding the block stack, we need to keep track of why we
             # are doing it.
-            why = self.dispatch(byte_name, intArg, arguments, opoffset, line_number)
+            why = self.dispatch(
+                byte_name, intArg, arguments, opoffset, line_number, byte_code
+            )
 
             if why == "exception":
                 # Deal with exceptions encountered while executing the op.
                 if not self.in_exception_processing:
-                    self.last_traceback = traceback_from_frame(self.frame)
-                    self.in_exception_processing = True
+                    self.traceback_here(self.frame, self.last_exception[1])
 
             elif why == "reraise":
-                why = "exception"
+                why = self.reraise(frame)
 
             if why != "yield":
+                why = self.unwind_exception_table(frame, why)
                 while why and frame.block_stack:
                     # Deal with any block management we need to do.
                     why = self.manage_block_stack(why)